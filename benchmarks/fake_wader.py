@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Fake wader core for benchmarks and tests without hardware
+
+It exports on the session bus the parts of wader's D-Bus API used by the
+GUI, backed by an in-memory modem whose SIM sizes, reply latency and
+traffic profile are set from the command line::
+
+    dbus-launch --exit-with-session sh -c '
+        python benchmarks/fake_wader.py --sim-contacts 250 --sim-sms 40 &
+        VMB_USE_SESSION_BUS=1 bin/v-mobile-broadband'
+
+The modem is enabled, registered and connected through its methods and
+the control interface (L{CONTROL_INTFACE}), connecting starts emitting
+dial stats according to the traffic profile.
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+import dbus
+import dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+import gobject
+
+from wader.common.consts import (WADER_SERVICE, WADER_OBJPATH,
+                                 WADER_INTFACE, MDM_INTFACE, CRD_INTFACE,
+                                 NET_INTFACE, SMS_INTFACE, CTS_INTFACE,
+                                 USD_INTFACE,
+                                 MM_MODEM_STATE_DISABLED,
+                                 MM_MODEM_STATE_ENABLED,
+                                 MM_MODEM_STATE_REGISTERED,
+                                 MM_MODEM_STATE_CONNECTED,
+                                 MM_GSM_ACCESS_TECH_HSPA)
+import wader.common.signals as S
+
+DEVICE_OPATH = '/org/freedesktop/ModemManager/Devices/0'
+CONTROL_INTFACE = 'es.vodafone.FakeWader.Control'
+
+# seconds between SIG_DIAL_STATS and SIG_RSSI emissions
+STATS_INTERVAL = 1
+RSSI_INTERVAL = 10
+
+TRAFFIC_PROFILES = ['idle', 'steady', 'bursty', 'ramp']
+
+
+def get_rates(profile, tick, rate):
+    """Returns the (rx, tx) rates in bytes per second of C{tick}"""
+    if profile == 'idle':
+        return 0, 0
+    if profile == 'steady':
+        return rate, rate / 10
+    if profile == 'bursty':
+        # 5 seconds on, 5 seconds off
+        if (tick / 5) % 2:
+            return 0, 0
+        return rate * 2, rate / 5
+    if profile == 'ramp':
+        # up to rate in a minute, then start over
+        current = rate * (tick % 60 + 1) / 60
+        return current, current / 10
+    raise ValueError("Unknown traffic profile %s" % profile)
+
+
+def _signal(interface, name, signature):
+    """Returns a D-Bus signal called C{name}, for names known at runtime"""
+
+    def emit(self, *args):
+        pass
+
+    emit.__name__ = name
+    return dbus.service.signal(interface, signature=signature)(emit)
+
+
+class SimContacts(dbus.service.Object):
+    """
+    I am the SIM phonebook of L{FakeModem}
+
+    The contacts methods share their names with the SMS ones, dbus-python
+    tells them apart by interface as long as they live in different
+    classes of the hierarchy
+    """
+
+    @dbus.service.method(CTS_INTFACE, in_signature='',
+                         out_signature='a(uss)',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def List(self, reply_cb, error_cb):
+        self._reply(reply_cb, [(index,) + self.contacts[index]
+                                for index in sorted(self.contacts)])
+
+    @dbus.service.method(CTS_INTFACE, in_signature='u', out_signature='(uss)')
+    def Get(self, index):
+        return (index,) + self.contacts[index]
+
+    @dbus.service.method(CTS_INTFACE, in_signature='u', out_signature='')
+    def Delete(self, index):
+        self.contacts.pop(index, None)
+
+
+class ModemProperties(dbus.service.Object):
+    """
+    I am the D-Bus properties of L{FakeModem}
+    """
+
+    def _get_properties(self, interface):
+        if interface == MDM_INTFACE:
+            return {'State': dbus.UInt32(self.state),
+                    'EquipmentIdentifier': '351234567890123',
+                    'UnlockRequired': ''}
+        if interface == NET_INTFACE:
+            return {'AccessTechnology': dbus.UInt32(MM_GSM_ACCESS_TECH_HSPA)}
+        if interface == CRD_INTFACE:
+            return {'SupportedBands': dbus.UInt32(0xffffffff),
+                    'SupportedModes': dbus.UInt32(0xffffffff)}
+        return {}
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='s',
+                         out_signature='a{sv}')
+    def GetAll(self, interface):
+        return self._get_properties(interface)
+
+    @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature='ss',
+                         out_signature='v')
+    def Get(self, interface, name):
+        return self._get_properties(interface)[name]
+
+    @dbus.service.signal(dbus.PROPERTIES_IFACE, signature='sa{sv}')
+    def MmPropertiesChanged(self, interface, properties):
+        pass
+
+
+class FakeModem(SimContacts, ModemProperties):
+    """
+    I am an in-memory modem with a SIM card
+    """
+
+    def __init__(self, bus, options):
+        self.options = options
+        self.latency = options.latency / 1000.0
+        self.state = MM_MODEM_STATE_DISABLED
+        self.rssi = options.rssi
+        self.rx_bytes = self.tx_bytes = 0
+        self.tick = 0
+        self.traffic_id = None
+        self.next_sms_ref = 1
+
+        self.contacts = {}
+        for i in range(1, options.sim_contacts + 1):
+            self.contacts[i] = (u'Contact %d' % i, '+3460000%04d' % i)
+
+        self.messages = {}
+        now = time.time()
+        for i in range(1, options.sim_sms + 1):
+            self.messages[i] = {
+                'index': i,
+                'number': '+3460000%04d' % (i % 100 + 1),
+                'text': u'Message %d from the fake SIM' % i,
+                'timestamp': now - i * 3600,
+                'where': 1,
+            }
+
+        dbus.service.Object.__init__(self, bus, DEVICE_OPATH)
+        gobject.timeout_add_seconds(RSSI_INTERVAL, self._emit_rssi)
+
+    def _reply(self, reply_cb, *args):
+        """Replies after the configured latency"""
+        if not self.latency:
+            reply_cb(*args)
+            return
+
+        def reply():
+            reply_cb(*args)
+            return False
+
+        gobject.timeout_add(int(self.latency * 1000), reply)
+
+    def _set_state(self, state):
+        self.state = state
+        self.MmPropertiesChanged(MDM_INTFACE, {'State': dbus.UInt32(state)})
+
+    # Modem
+
+    @dbus.service.method(MDM_INTFACE, in_signature='b', out_signature='',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def Enable(self, enable, reply_cb, error_cb):
+
+        def enable_cb():
+            if enable:
+                self._set_state(MM_MODEM_STATE_ENABLED)
+            else:
+                self._stop_traffic()
+                self._set_state(MM_MODEM_STATE_DISABLED)
+            reply_cb()
+
+        self._reply(enable_cb)
+
+    @dbus.service.method(MDM_INTFACE, in_signature='', out_signature='(sss)',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def GetInfo(self, reply_cb, error_cb):
+        self._reply(reply_cb, ('Fake', 'Modem 3000', '1.0'))
+
+    @dbus.service.method(MDM_INTFACE, in_signature='', out_signature='(tt)')
+    def GetStats(self):
+        return (self.rx_bytes, self.tx_bytes)
+
+    vars()[S.SIG_DIAL_STATS] = _signal(MDM_INTFACE, S.SIG_DIAL_STATS,
+                                       '(tttt)')
+
+    # Card
+
+    @dbus.service.method(CRD_INTFACE, in_signature='', out_signature='s',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def GetImsi(self, reply_cb, error_cb):
+        self._reply(reply_cb, self.options.imsi)
+
+    @dbus.service.method(CRD_INTFACE, in_signature='s', out_signature='',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def SendPin(self, pin, reply_cb, error_cb):
+        self._reply(reply_cb)
+
+    # Network
+
+    @dbus.service.method(NET_INTFACE, in_signature='s', out_signature='',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def Register(self, netid, reply_cb, error_cb):
+
+        def register_cb():
+            self._set_state(MM_MODEM_STATE_REGISTERED)
+            getattr(self, S.SIG_REG_INFO)(1, '21401', 'Fake Mobile')
+            reply_cb()
+            if self.options.connect:
+                self.Connect(self.options.traffic)
+
+        self._reply(register_cb)
+
+    @dbus.service.method(NET_INTFACE, in_signature='', out_signature='(uss)',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def GetRegistrationInfo(self, reply_cb, error_cb):
+        self._reply(reply_cb, (1, '21401', 'Fake Mobile'))
+
+    @dbus.service.method(NET_INTFACE, in_signature='', out_signature='u',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def GetSignalQuality(self, reply_cb, error_cb):
+        self._reply(reply_cb, self.rssi)
+
+    @dbus.service.method(NET_INTFACE, in_signature='s', out_signature='')
+    def SetApn(self, apn):
+        pass
+
+    @dbus.service.method(NET_INTFACE, in_signature='u', out_signature='')
+    def SetBand(self, band):
+        pass
+
+    @dbus.service.method(NET_INTFACE, in_signature='u', out_signature='')
+    def SetAllowedMode(self, mode):
+        pass
+
+    vars()[S.SIG_RSSI] = _signal(NET_INTFACE, S.SIG_RSSI, 'u')
+    vars()[S.SIG_REG_INFO] = _signal(NET_INTFACE, S.SIG_REG_INFO, 'uss')
+
+    # SMS
+
+    @dbus.service.method(SMS_INTFACE, in_signature='', out_signature='aa{sv}',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def List(self, reply_cb, error_cb):
+        self._reply(reply_cb, [self.messages[i]
+                                for i in sorted(self.messages)])
+
+    @dbus.service.method(SMS_INTFACE, in_signature='u', out_signature='a{sv}')
+    def Get(self, index):
+        return self.messages[index]
+
+    @dbus.service.method(SMS_INTFACE, in_signature='u', out_signature='',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def Delete(self, index, reply_cb, error_cb):
+        self.messages.pop(index, None)
+        self._reply(reply_cb)
+
+    @dbus.service.method(SMS_INTFACE, in_signature='a{sv}',
+                         out_signature='au',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def Send(self, sms, reply_cb, error_cb):
+        ref = self.next_sms_ref
+        self.next_sms_ref += 1
+        self._reply(reply_cb, [ref])
+
+    @dbus.service.method(SMS_INTFACE, in_signature='', out_signature='s',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def GetSmsc(self, reply_cb, error_cb):
+        self._reply(reply_cb, '+34607003110')
+
+    vars()[S.SIG_SMS_COMP] = _signal(SMS_INTFACE, S.SIG_SMS_COMP, 'ub')
+
+    # Contacts, see L{SimContacts} for the rest
+
+    @dbus.service.method(CTS_INTFACE, in_signature='ss', out_signature='u')
+    def Add(self, name, number):
+        if len(self.contacts) >= self.options.sim_capacity:
+            return 0
+        index = 1
+        while index in self.contacts:
+            index += 1
+        self.contacts[index] = (name, number)
+        return index
+
+    @dbus.service.method(CTS_INTFACE, in_signature='uss', out_signature='u')
+    def Edit(self, index, name, number):
+        if index not in self.contacts:
+            return 0
+        self.contacts[index] = (name, number)
+        return index
+
+    # USSD
+
+    @dbus.service.method(USD_INTFACE, in_signature='s', out_signature='s',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def Initiate(self, command, reply_cb, error_cb):
+        self._reply(reply_cb, self.options.ussd_reply)
+
+    # Control
+
+    @dbus.service.method(CONTROL_INTFACE, in_signature='s', out_signature='')
+    def Connect(self, profile):
+        """Connects and starts emitting dial stats for C{profile}"""
+        if profile not in TRAFFIC_PROFILES:
+            raise ValueError("Unknown traffic profile %s" % profile)
+        self.options.traffic = profile
+        self._set_state(MM_MODEM_STATE_CONNECTED)
+        self._start_traffic()
+
+    @dbus.service.method(CONTROL_INTFACE, in_signature='', out_signature='')
+    def Disconnect(self):
+        self._stop_traffic()
+        self._set_state(MM_MODEM_STATE_REGISTERED)
+
+    @dbus.service.method(CONTROL_INTFACE, in_signature='u', out_signature='')
+    def SetLatency(self, latency):
+        """Sets the reply latency in milliseconds"""
+        self.latency = latency / 1000.0
+
+    @dbus.service.method(CONTROL_INTFACE, in_signature='ss', out_signature='u')
+    def ReceiveSms(self, number, text):
+        """Stores an incoming SMS and emits SIG_SMS_COMP for it"""
+        index = max([0] + self.messages.keys()) + 1
+        self.messages[index] = {'index': index, 'number': number,
+                                'text': text, 'timestamp': time.time(),
+                                'where': 0}
+        # a single part message, so it's complete on arrival
+        getattr(self, S.SIG_SMS_COMP)(index, True)
+        return index
+
+    def _start_traffic(self):
+        if self.traffic_id is None:
+            self.traffic_id = gobject.timeout_add_seconds(STATS_INTERVAL,
+                                                          self._emit_stats)
+
+    def _stop_traffic(self):
+        if self.traffic_id is not None:
+            gobject.source_remove(self.traffic_id)
+            self.traffic_id = None
+
+    def _emit_stats(self):
+        rx_rate, tx_rate = get_rates(self.options.traffic, self.tick,
+                                     self.options.rate)
+        self.tick += 1
+        self.rx_bytes += rx_rate * STATS_INTERVAL
+        self.tx_bytes += tx_rate * STATS_INTERVAL
+        getattr(self, S.SIG_DIAL_STATS)((self.rx_bytes, self.tx_bytes,
+                                         rx_rate, tx_rate))
+        return True
+
+    def _emit_rssi(self):
+        getattr(self, S.SIG_RSSI)(self.rssi)
+        return True
+
+
+class FakeWader(dbus.service.Object):
+    """
+    I am the wader core object, with a single device
+    """
+
+    def __init__(self, bus, modem):
+        self.modem = modem
+        dbus.service.Object.__init__(self, bus, WADER_OBJPATH)
+
+    @dbus.service.method(WADER_INTFACE, in_signature='', out_signature='ao',
+                         async_callbacks=('reply_cb', 'error_cb'))
+    def EnumerateDevices(self, reply_cb, error_cb):
+        self.modem._reply(reply_cb, [DEVICE_OPATH])
+
+    @dbus.service.signal(WADER_INTFACE, signature='o')
+    def DeviceAdded(self, opath):
+        pass
+
+    @dbus.service.signal(WADER_INTFACE, signature='o')
+    def DeviceRemoved(self, opath):
+        pass
+
+
+def get_option_parser():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--latency', type='int', default=0,
+                      help="reply latency in milliseconds [%default]")
+    parser.add_option('--sim-contacts', type='int', default=50,
+                      help="contacts on the SIM [%default]")
+    parser.add_option('--sim-capacity', type='int', default=250,
+                      help="contacts the SIM can hold [%default]")
+    parser.add_option('--sim-sms', type='int', default=20,
+                      help="messages on the SIM [%default]")
+    parser.add_option('--traffic', choices=TRAFFIC_PROFILES,
+                      default='steady',
+                      help="traffic profile once connected, one of %s "
+                           "[%%default]" % ', '.join(TRAFFIC_PROFILES))
+    parser.add_option('--rate', type='int', default=100 * 1024,
+                      help="nominal rx rate in bytes/s [%default]")
+    parser.add_option('--rssi', type='int', default=70,
+                      help="signal quality [%default]")
+    parser.add_option('--imsi', default='214010000000000',
+                      help="SIM IMSI [%default]")
+    parser.add_option('--ussd-reply', default='Saldo 10,00 EUR',
+                      help="reply to every USSD request [%default]")
+    parser.add_option('--connect', action='store_true', default=False,
+                      help="connect as soon as the modem is registered")
+    return parser
+
+
+def main(argv):
+    options, args = get_option_parser().parse_args(argv)
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.SessionBus()
+    # keep references, the name and objects go away with them
+    bus_name = dbus.service.BusName(WADER_SERVICE, bus)
+    modem = FakeModem(bus, options)
+    wader = FakeWader(bus, modem)
+
+    gobject.MainLoop().run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
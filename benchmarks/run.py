@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Benchmarks of the GUI hot paths
+
+The data benchmarks need a display (see the C{bench} target of the
+Makefile, which runs them under xvfb-run), the model ones also need a
+session bus where L{fake_wader} is started. Benchmarks whose requirements
+are not met are reported as skipped.
+
+Results are written as JSON and can be compared with a previous run, any
+benchmark whose median is slower than the baseline's by more than the
+tolerance is a regression and makes the run exit with status 1. So do
+baseline benchmarks that were skipped or don't exist anymore, unless
+--allow-missing is given.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# gui.consts computes every path from $HOME at import time, the benchmarks
+# must not touch the user's DBs
+if not os.environ.get('VMB_BENCH_KEEP_HOME'):
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='vmb-bench-')
+
+from gui.consts import GUI_HOME, DB_DIR
+for path in [GUI_HOME, DB_DIR]:
+    if not os.path.exists(path):
+        os.makedirs(path, 0700)
+
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 0.2
+
+BENCHMARKS = []  # [(name, group, func)]
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark whose requirements are not met"""
+
+
+def benchmark(name, group):
+    """
+    Registers a benchmark
+
+    The decorated function does the setup and returns a callable that is
+    timed, so the setup cost is not measured
+    """
+
+    def decorator(func):
+        BENCHMARKS.append((name, group, func))
+        return func
+
+    return decorator
+
+
+def require_display():
+    try:
+        import gtk
+    except (ImportError, RuntimeError), e:
+        raise SkipBenchmark(str(e))
+
+    if gtk.gdk.display_get_default() is None:
+        raise SkipBenchmark("no display")
+
+
+def pump_main_loop():
+    import gtk
+    while gtk.events_pending():
+        gtk.main_iteration(False)
+
+
+# data model benchmarks
+
+def make_contacts(count):
+    from gui.contacts import SIMContact
+    return [SIMContact(u'Contact %d' % i, u'+3460%07d' % i, i)
+                for i in xrange(count)]
+
+
+def make_messages(count, senders):
+    from datetime import datetime, timedelta
+    from dateutil.tz import gettz
+    from wader.common.sms import Message
+
+    tz = gettz()
+    now = datetime.now(tz)
+    ret = []
+    for i in xrange(count):
+        # national notation so the index has to fall back to the suffix
+        number = '60%07d' % (i % senders)
+        ret.append(Message(number, u'Benchmark message %d' % i,
+                           index=i, _datetime=now - timedelta(minutes=i)))
+    return ret
+
+
+@benchmark('sms_add_messages_5000x1000', 'data')
+def bench_sms_add_messages():
+    require_display()
+    from gui.models.sms import SMSStoreModel
+
+    contacts = make_contacts(1000)
+    messages = make_messages(5000, 2000)
+
+    def run():
+        model = SMSStoreModel(lambda: None)
+        model.add_messages(messages, contacts)
+
+    return run
+
+
+@benchmark('sms_reconcile_5000x1000', 'data')
+def bench_sms_reconcile():
+    require_display()
+    from gui.models.sms import SMSStoreModel
+
+    contacts = make_contacts(1000)
+    messages = make_messages(5000, 2000)
+    model = SMSStoreModel(lambda: None)
+    model.add_messages(messages, contacts)
+
+    def run():
+        model.reconcile(messages, contacts)
+
+    return run
+
+
+@benchmark('contacts_find_contacts_10000', 'data')
+def bench_find_contacts():
+    require_display()
+    from gui.models.contacts import ContactsStoreModel
+
+    model = ContactsStoreModel()
+    for contact in make_contacts(10000):
+        model.add_contact(contact)
+
+    def run():
+        for pattern in [u'contact 1', u'99', u'nobody']:
+            model.find_contacts(pattern)
+
+    return run
+
+
+@benchmark('contacts_find_by_number_10000', 'data')
+def bench_find_contacts_by_number():
+    require_display()
+    from gui.models.contacts import ContactsStoreModel
+
+    model = ContactsStoreModel()
+    for contact in make_contacts(10000):
+        model.add_contact(contact)
+
+    def run():
+        for i in xrange(0, 10000, 10):
+            model.find_contacts_by_number('60%07d' % i)
+
+    return run
+
+
+def make_vcf(count):
+    lines = []
+    for i in xrange(count):
+        lines.extend(['BEGIN:VCARD', 'VERSION:3.0',
+                      'FN:Contact %d' % i,
+                      'N:%d;Contact;;;' % i,
+                      'TEL;TYPE=CELL:+3460%07d' % i,
+                      'TEL;TYPE=HOME:+3491%07d' % i,
+                      'EMAIL;TYPE=INTERNET:contact%d@example.com' % i,
+                      'ADR;TYPE=HOME:;;Street %d;Madrid;;28000;Spain' % i,
+                      'NOTE:Generated for the benchmarks\\, contact %d' % i,
+                      'END:VCARD'])
+    return '\r\n'.join(lines) + '\r\n'
+
+
+@benchmark('vcard_load_from_stream_5000', 'data')
+def bench_vcard_load():
+    from cStringIO import StringIO
+    from gui.contrib.pycocuma.vcard import vCardList
+
+    data = make_vcf(5000)  # ~1.3MB
+
+    def run():
+        cards = vCardList()
+        cards.LoadFromStream(StringIO(data))
+
+    return run
+
+
+@benchmark('vcard_extract_5000', 'data')
+def bench_vcard_extract():
+    from cStringIO import StringIO
+    from gui.contrib.pycocuma.vstream import iter_cards
+
+    data = make_vcf(5000)
+
+    def run():
+        list(iter_cards(StringIO(data), ['FN', 'TEL', 'EMAIL']))
+
+    return run
+
+
+@benchmark('csv_write_rows_20000', 'data')
+def bench_csv_write():
+    from gui.csvutils import CSVUnicodeWriter
+
+    rows = [contact.to_csv() for contact in make_contacts(20000)]
+
+    def run():
+        fobj = open(os.path.join(GUI_HOME, 'bench.csv'), 'wb')
+        writer = CSVUnicodeWriter(fobj)
+        writer.write_rows(rows)
+        fobj.close()
+
+    return run
+
+
+@benchmark('csv_export_20000', 'data')
+def bench_csv_export():
+    from gui.csvutils import export_csv
+
+    contacts = make_contacts(20000)
+
+    def run():
+        fobj = open(os.path.join(GUI_HOME, 'bench.csv'), 'wb')
+        export_csv(fobj, contacts)
+        fobj.close()
+
+    return run
+
+
+@benchmark('vcard_export_5000', 'data')
+def bench_vcard_export():
+    from gui.csvutils import export_vcard
+
+    contacts = make_contacts(5000)
+
+    def run():
+        fobj = open(os.path.join(GUI_HOME, 'bench.vcf'), 'wb')
+        export_vcard(fobj, contacts)
+        fobj.close()
+
+    return run
+
+
+@benchmark('csv_contacts_reader_20000', 'data')
+def bench_csv_read():
+    from cStringIO import StringIO
+    from gui.csvutils import CSVContactsReader
+
+    data = ''.join(['"Contact %d","+3460%07d"\r\n' % (i, i)
+                        for i in xrange(20000)])
+
+    def run():
+        CSVContactsReader(StringIO(data)).get_rows()
+
+    return run
+
+
+# model benchmarks
+
+_fake_wader = None
+_main_model = None
+
+
+def get_main_model():
+    """Returns a L{MainModel} talking to a fake wader"""
+    global _fake_wader, _main_model
+    if _main_model is not None:
+        return _main_model
+
+    require_display()
+    if not os.environ.get('DBUS_SESSION_BUS_ADDRESS'):
+        raise SkipBenchmark("no session bus")
+
+    import dbus
+    from dbus.mainloop.glib import DBusGMainLoop
+    from wader.common.consts import WADER_SERVICE
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.SessionBus()
+    if not bus.name_has_owner(WADER_SERVICE):
+        _fake_wader = subprocess.Popen([sys.executable,
+                                    os.path.join(BENCH_DIR, 'fake_wader.py'),
+                                    '--traffic', 'idle'])
+        deadline = time.time() + 10
+        while not bus.name_has_owner(WADER_SERVICE):
+            if time.time() > deadline:
+                raise SkipBenchmark("fake wader didn't start")
+            time.sleep(0.1)
+
+    os.environ['VMB_USE_SESSION_BUS'] = '1'
+    from gui.models.main import MainModel
+    _main_model = MainModel()
+    pump_main_loop()
+    return _main_model
+
+
+def stop_fake_wader():
+    if _fake_wader is not None:
+        _fake_wader.terminate()
+        _fake_wader.wait()
+
+
+@benchmark('main_model_on_dial_stats_3600', 'model')
+def bench_on_dial_stats():
+    from gui.usage import utcnow
+
+    model = get_main_model()
+
+    def run():
+        model.start_time = utcnow()
+        model.rx_bytes = model.tx_bytes = 0
+        model.usage_recorder.start(0, 0, True, model.start_time)
+        for i in xrange(3600):
+            model.on_dial_stats((i * 1000, i * 100, 1000, 100))
+        pump_main_loop()
+        model.usage_recorder.stop()
+
+    return run
+
+
+@benchmark('main_model_calc_month_20000', 'model')
+def bench_calc_month():
+    import datetime
+
+    model = get_main_model()
+    if not getattr(model, '_bench_usage_filled', False):
+        start = datetime.datetime.utcnow().replace(day=1, hour=0, minute=0)
+        for i in xrange(20000):
+            model.provider.add_usage_item(start, start, 1000, 100, i % 2)
+        model._bench_usage_filled = True
+
+    def run():
+        # cold, the aggregates are summed up from the usage DB
+        model.usage_cache.rebuild()
+        model.calc_month(0)
+        # warm
+        for i in xrange(1000):
+            model.calc_month(0)
+
+    return run
+
+
+# harness
+
+def run_benchmark(func, repeats):
+    run = func()
+    timings = []
+    for i in xrange(repeats):
+        start = time.time()
+        run()
+        timings.append((time.time() - start) * 1000)
+
+    timings.sort()
+    return {
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(timings[len(timings) / 2], 3),
+        'repeats': repeats,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of (name, baseline median, median) for every benchmark
+    slower than the baseline by more than C{tolerance}
+    """
+    regressions = []
+    for name, result in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+
+        if result['median_ms'] > base['median_ms'] * (1 + tolerance):
+            regressions.append((name, base['median_ms'],
+                                result['median_ms']))
+    return regressions
+
+
+def find_missing(results, baseline, selected):
+    """
+    Returns the sorted names of the benchmarks in C{baseline} that have
+    no result in this run, either because they were skipped or because
+    they don't exist anymore. Benchmarks left out with C{selected}, a
+    callable that tells whether a name was asked for, are not missing
+    """
+    return sorted([name for name in baseline['results']
+                        if name not in results['results'] and selected(name)])
+
+
+def get_option_parser():
+    parser = OptionParser(usage="%prog [options] [benchmark...]")
+    parser.add_option('-o', '--output', help="write the results to this file")
+    parser.add_option('-b', '--baseline',
+                      help="compare with the results in this file")
+    parser.add_option('-t', '--tolerance', type='float',
+                      default=DEFAULT_TOLERANCE,
+                      help="allowed slowdown over the baseline [%default]")
+    parser.add_option('-r', '--repeats', type='int', default=DEFAULT_REPEATS,
+                      help="times every benchmark is run [%default]")
+    parser.add_option('-g', '--group', action='append', default=[],
+                      help="only run this group (data, model)")
+    parser.add_option('-m', '--allow-missing', action='store_true',
+                      default=False,
+                      help="don't fail on baseline benchmarks that didn't run")
+    parser.add_option('-l', '--list', action='store_true', default=False,
+                      help="list the benchmarks and exit")
+    return parser
+
+
+def main(argv):
+    options, names = get_option_parser().parse_args(argv)
+
+    if options.list:
+        for name, group, func in BENCHMARKS:
+            print "%-6s %s" % (group, name)
+        return 0
+
+    groups = dict([(name, group) for name, group, func in BENCHMARKS])
+
+    def selected(name):
+        if names and name not in names:
+            return False
+        # a benchmark that is gone has no group, report it anyway
+        if options.group and groups.get(name) not in options.group:
+            return name not in groups
+        return True
+
+    results = {'python': sys.version.split()[0], 'results': {},
+               'skipped': {}}
+    try:
+        for name, group, func in BENCHMARKS:
+            if not selected(name):
+                continue
+
+            try:
+                result = run_benchmark(func, options.repeats)
+            except SkipBenchmark, e:
+                results['skipped'][name] = str(e)
+                print "%-40s skipped: %s" % (name, e)
+                continue
+
+            results['results'][name] = result
+            print "%-40s %10.3f ms (min %.3f ms)" % (name,
+                                                     result['median_ms'],
+                                                     result['min_ms'])
+    finally:
+        stop_fake_wader()
+
+    if options.output:
+        fobj = open(options.output, 'w')
+        json.dump(results, fobj, indent=2, sort_keys=True)
+        fobj.close()
+
+    if not options.baseline:
+        return 0
+
+    fobj = open(options.baseline)
+    baseline = json.load(fobj)
+    fobj.close()
+
+    regressions = compare(results, baseline, options.tolerance)
+    for name, before, after in regressions:
+        print "REGRESSION %s: %.3f ms -> %.3f ms (+%d%%)" % (name, before,
+                                    after, (after / before - 1) * 100)
+
+    missing = find_missing(results, baseline, selected)
+    for name in missing:
+        reason = results['skipped'].get(name, "not a benchmark anymore")
+        print "MISSING %s: %s" % (name, reason)
+
+    if missing and not options.allow_missing:
+        return 1
+    return regressions and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -69,7 +69,12 @@ LOG_FILE = join(GUI_HOME, 'log')
 
 DB_DIR = join(GUI_HOME, 'db')
 MESSAGES_DB = join(DB_DIR, 'messages.db')
+SMS_INDEX_DB = join(DB_DIR, 'messages-index.db')
 USAGE_DB = join(DB_DIR, 'usage.db')
+USAGE_CACHE = join(DB_DIR, 'usage-months.cache')
+USAGE_JOURNAL = join(DB_DIR, 'usage.journal')
+# the %s is a hash of the address book id
+EVOLUTION_CACHE = join(DB_DIR, 'evolution-%s.cache')
 
 GCONF_BASE_DIR = '/apps/%s' % APP_SLUG_NAME
 
@@ -80,6 +85,10 @@ CFG_PREFS_DEFAULT_CLOSE_MINIMIZES = False
 CFG_PREFS_DEFAULT_EXIT_WITHOUT_CONFIRMATION = False
 CFG_PREFS_DEFAULT_USAGE_USER_LIMIT = 5
 CFG_PREFS_DEFAULT_USAGE_MAX_VALUE = 20
+# seconds between usage journal writes
+CFG_PREFS_DEFAULT_USAGE_JOURNAL_INTERVAL = 30
+# milliseconds between refreshes of the connection statistics
+CFG_PREFS_DEFAULT_STATS_UPDATE_INTERVAL = 2000
 
 CFG_SMS_VALIDITY_R1D = '1day'
 CFG_SMS_VALIDITY_R3D = '3days'
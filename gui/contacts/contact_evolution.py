@@ -16,12 +16,25 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import os
+from hashlib import md5
 from zope.interface import implements
 from os.path import join
 
 from gui.translate import _
-from gui.consts import IMAGES_DIR
+from gui.consts import IMAGES_DIR, EVOLUTION_CACHE
 from gui.contacts.interface import IContact
+from gui.logger import logger
+
+SNAPSHOT_VERSION = '1'
+# change tracking id registered in every address book
+CHANGE_ID = 'vmb-contacts'
+# EBookChangeType
+E_BOOK_CHANGE_CARD_ADDED, E_BOOK_CHANGE_CARD_DELETED, \
+    E_BOOK_CHANGE_CARD_MODIFIED = range(3)
+
+# address book id -> EVSnapshot
+_snapshots = {}
 
 
 class EVContact(object):
@@ -65,10 +78,8 @@ class EVContact(object):
         return join(IMAGES_DIR, 'evolution.png')
 
     def to_csv(self):
-        """Returns a list with the name and number formatted for csv"""
-        name = '"' + self.name + '"'
-        number = '"' + self.number + '"'
-        return [name, number]
+        """Returns a list with the name and number for csv"""
+        return [self.name, self.number]
 
     def set_name(self, name):
         return False
@@ -77,6 +88,178 @@ class EVContact(object):
         return False
 
 
+def _escape(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return (value or '').encode('string_escape')
+
+
+def _unescape(value):
+    return value.decode('string_escape')
+
+
+def _normalize(name, number):
+    """Returns the key two contacts are considered duplicates by"""
+    from gui.phonebook import normalize_number
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8', 'replace')
+    return u' '.join(name.lower().split()), normalize_number(number)
+
+
+class EVSnapshot(object):
+    """
+    I keep the contacts extracted from an Evolution address book
+
+    Every entry is stored by uid with the revision of the contact it was
+    extracted from, and the snapshot is persisted so later refreshes
+    only need to look at the contacts that changed. Evolution forgets
+    the changes it hands out, so a marker file tells the next start to
+    resync everything while consumed changes haven't been saved yet
+    """
+
+    def __init__(self, book_id):
+        self.path = EVOLUTION_CACHE % md5(book_id).hexdigest()
+        self.pending_path = self.path + '.pending'
+        self.entries = {}  # uid -> (rev, name, number)
+        self.tracking = False  # CHANGE_ID has been registered
+        self.dirty = False  # differs from the persisted snapshot
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        self.tracking = False
+        try:
+            fobj = open(self.path)
+        except IOError:
+            return
+
+        try:
+            try:
+                header = fobj.readline().split()
+                if not header or header[0] != SNAPSHOT_VERSION:
+                    return
+
+                entries = {}
+                for line in fobj:
+                    uid, rev, name, number = line.rstrip('\n').split('\t')
+                    entries[_unescape(uid)] = (_unescape(rev) or None,
+                                               _unescape(name),
+                                               _unescape(number))
+                self.entries = entries
+                self.tracking = (header[1:] == ['tracking'] and
+                                 not os.path.exists(self.pending_path))
+            except ValueError:
+                logger.warn("Corrupt Evolution snapshot %s" % self.path)
+        finally:
+            fobj.close()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        try:
+            fobj = open(tmp, 'w')
+            try:
+                fobj.write('%s %s\n' % (SNAPSHOT_VERSION,
+                                        self.tracking and 'tracking' or '-'))
+                for uid, (rev, name, number) in self.entries.iteritems():
+                    fobj.write('\t'.join(map(_escape,
+                                             [uid, rev, name, number])))
+                    fobj.write('\n')
+            finally:
+                fobj.close()
+            os.rename(tmp, self.path)
+            self.dirty = False
+            self._end_changes()
+        except (IOError, OSError), e:
+            logger.error("Can not save Evolution snapshot %s: %s"
+                         % (self.path, e))
+            # the changes consumed from Evolution are lost with it
+            self._discard()
+
+    def _discard(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _begin_changes(self):
+        # must be done before consuming the changes of Evolution
+        try:
+            open(self.pending_path, 'w').close()
+        except IOError, e:
+            logger.warn("Can not mark Evolution snapshot %s: %s"
+                        % (self.path, e))
+            self._discard()
+
+    def _end_changes(self):
+        try:
+            os.unlink(self.pending_path)
+        except OSError:
+            pass
+
+    def update(self, contact):
+        uid = contact.get_property('id')
+        rev = contact.get_property('rev')
+        entry = self.entries.get(uid)
+        if entry is None or rev is None or entry[0] != rev:
+            self.entries[uid] = (rev, contact.get_name() or '',
+                                 contact.get_property('mobile-phone') or '')
+            self.dirty = True
+
+    def remove(self, uid):
+        if self.entries.pop(uid, None) is not None:
+            self.dirty = True
+
+    def refresh(self, addressbook):
+        """Brings the snapshot up to date with C{addressbook}"""
+        if hasattr(addressbook, 'get_changes'):
+            self._begin_changes()
+
+        if self.tracking:
+            try:
+                for change_type, contact in addressbook.get_changes(CHANGE_ID):
+                    if change_type == E_BOOK_CHANGE_CARD_DELETED:
+                        self.remove(contact.get_property('id'))
+                    else:
+                        self.update(contact)
+                if not self.dirty:
+                    # nothing that needs saving was consumed
+                    self._end_changes()
+                return
+            except Exception, e:
+                logger.warn("Evolution change tracking failed: %s" % e)
+                self.tracking = False
+                self.dirty = True
+
+        if hasattr(addressbook, 'get_changes'):
+            # sets the baseline of the next refresh before fetching
+            # everything, changes in between are just applied twice
+            try:
+                addressbook.get_changes(CHANGE_ID)
+                self.tracking = True
+                self.dirty = True
+            except Exception, e:
+                logger.warn("Evolution change tracking unavailable: %s" % e)
+
+        # every contact has to be fetched, but only those whose
+        # revision changed are extracted again
+        seen = {}
+        for contact in addressbook.get_all_contacts():
+            self.update(contact)
+            seen[contact.get_property('id')] = True
+
+        for uid in self.entries.keys():
+            if uid not in seen:
+                self.remove(uid)
+
+
+def get_snapshot(book_id):
+    try:
+        return _snapshots[book_id]
+    except KeyError:
+        snapshot = _snapshots[book_id] = EVSnapshot(book_id)
+        return snapshot
+
+
 class EVContactsManager(object):
     """
     Contacts manager
@@ -105,6 +288,7 @@ class EVContactsManager(object):
             return []
 
         ret = []
+        seen = {}
         for i in addressbooks:
             name, id = i  # ('Personal', 'default')
 
@@ -112,16 +296,19 @@ class EVContactsManager(object):
             if not addressbook:
                 continue
 
-            for c in addressbook.get_all_contacts():
-
-                item = EVContact(name=c.get_name(),
-                                 number=c.get_property('mobile-phone'),
-                                 index=c.get_property('id'))
+            snapshot = get_snapshot(id)
+            snapshot.refresh(addressbook)
+            if snapshot.dirty:
+                snapshot.save()
 
+            for uid, (rev, cname, number) in snapshot.entries.iteritems():
                 # Ubuntu one mirrors personal address books, so avoid
-                # duplicate entry - might be slow with many contacts
-                if not item in ret:
-                    ret.append(item)
+                # duplicate entries
+                key = _normalize(cname, number)
+                if key not in seen:
+                    seen[key] = True
+                    ret.append(EVContact(name=cname, number=number,
+                                         index=uid))
 
         return ret
 
@@ -21,6 +21,7 @@ from os.path import join
 
 from gui.translate import _
 from gui.consts import IMAGES_DIR
+from gui.logger import logger
 from gui.contacts.interface import IContact
 
 
@@ -64,10 +65,8 @@ class KDEContact(object):
         return join(IMAGES_DIR, 'kdepim.png')
 
     def to_csv(self):
-        """Returns a list with the name and number formatted for csv"""
-        name = '"' + self.name + '"'
-        number = '"' + self.number + '"'
-        return [name, number]
+        """Returns a list with the name and number for csv"""
+        return [self.name, self.number]
 
     def set_name(self, name):
         return False
@@ -98,28 +97,33 @@ class KDEContactsManager(object):
 
         # XXX: maybe we should try to read a system version of the
         #      vcard library provided with pycocuma
-        from gui.contrib.pycocuma.vcard import vCardList
+        from gui.contrib.pycocuma.vstream import extract_file
 
-        vl = vCardList()
+        path = expanduser('~') + '/.kde/share/apps/kabc/std.vcf'
+        try:
+            cards = extract_file(path, ['FN', 'TEL', 'EMAIL'])
+        except (IOError, OSError):
+            return []
+        except ValueError, e:
+            logger.warn("Can not parse KDE address book %s: %s" % (path, e))
+            return []
 
         ret = []
-        if vl.LoadFromFile(expanduser('~') + '/.kde/share/apps/kabc/std.vcf'):
-            for vc in vl.data.keys():
-
-                fn = vl.data[vc].fn.get()
-
-                if len(fn):
-                    tel = vl.data[vc].tel
-                    cell = ''
-                    for num in tel:
-                        if 'CELL' in num.params.get('type'):
-                            cell = num.value.get()
-                            break
-
-                    # try to exclude distribution lists etc
-                    email = vl.data[vc].email
-                    if len(cell) or len(email):
-                        ret.append(KDEContact(name=fn, number=cell))
+        for card in cards:
+            fn = card.get('FN')
+            if not fn or not len(fn[-1][1]):
+                continue
+
+            cell = ''
+            for params, value in card.get('TEL', []):
+                types = params.get('type') or []
+                if 'CELL' in [t.upper() for t in types]:
+                    cell = value
+                    break
+
+            # try to exclude distribution lists etc
+            if len(cell) or card.get('EMAIL'):
+                ret.append(KDEContact(name=fn[-1][1], number=cell))
         return ret
 
     def get_contact_by_id(self, index):
@@ -70,10 +70,8 @@ class SIMContact(object):
         return join(IMAGES_DIR, 'mobile.png')
 
     def to_csv(self):
-        """Returns a list with the name and number formatted for csv"""
-        name = '"' + self.name + '"'
-        number = '"' + self.number + '"'
-        return [name, number]
+        """Returns a list with the name and number for csv"""
+        return [self.name, self.number]
 
     def set_name(self, name):
         ret = self._edit(name, self.number)
@@ -119,6 +117,22 @@ class SIMContactsManager(object):
         else:
             return None
 
+    def add_contact_async(self, name, number, cb, eb):
+        """
+        Adds a contact to the SIM
+            callback cb has the new SIMContact or None as arg
+            errorback eb has a dbus error as arg
+        """
+
+        def _cb(index):
+            if index > 0:
+                cb(SIMContact(name, number, index, self.device))
+            else:
+                cb(None)
+
+        self.device.Add(name, number, dbus_interface=CTS_INTFACE,
+                        reply_handler=_cb, error_handler=eb)
+
     def delete_contact(self, contact):
         if not isinstance(contact, SIMContact):
             return False
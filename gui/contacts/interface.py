@@ -43,7 +43,7 @@ class IContact(Interface):
         """Returns the pathname of the 16x16 icon to represent this contact"""
 
     def to_csv():
-        """Returns a csv string with the contact info"""
+        """Returns a list with the contact info for a csv row"""
 
     def set_name(self, name):
         """Sets the contact's name - return True if successful"""
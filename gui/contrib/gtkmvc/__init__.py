@@ -26,7 +26,7 @@ __all__ = ["model", "view", "controller", "observable", "observer", "support"]
 
 __version = (1,2,2)
 
-from model import Model, TreeStoreModel, ListStoreModel, TextBufferModel
+from model import Model, TreeStoreModel, ListStoreModel, TextBufferModel, batched
 from model_mt import ModelMT
 from controller import Controller
 from view import View
@@ -21,7 +21,11 @@
 #  or email to the author Roberto Cavada <cavada@fbk.eu>.
 #  Please report bugs to <cavada@fbk.eu>.
 
+import re
+import gobject
+
 import support.metaclasses
+from support import decorators
 from support.wrappers import ObsWrapperBase
 from observable import Signal
 
@@ -50,20 +54,52 @@ class Model (object):
     pattern. The notification method gets the emitting model, the
     old value for the property and the new one.  Properties
     functionalities are automatically provided by the
-    ObservablePropertyMeta meta-class."""
+    ObservablePropertyMeta meta-class.
+
+    Properties that change too often can be throttled, either in the
+    __throttled_properties__ member map (property name -> minimum
+    interval in milliseconds) or with set_property_throttle. The first
+    change of a throttled property is notified on the next idle
+    iteration of the main loop, later changes are collapsed and
+    notified at most once per interval with the first old value and
+    the last new one. Throttled properties sharing the same interval
+    are notified together: observers defining the method
+    'properties_value_change' get a single call with the model and a
+    list of (name, old, new) tuples instead of one call per property.
+
+    Several properties can be changed together inside a batch, either
+    with 'with model.batch():' or by decorating a model method with
+    batched. Value change notifications are deferred until the
+    outermost batch ends, repeated changes of a property are collapsed
+    into a single one from the first old value to the last new one,
+    and changes are notified in the order properties first changed,
+    aggregated as for throttled properties."""
 
     __metaclass__  = support.metaclasses.ObservablePropertyMeta
     __properties__ = {} # override this
+    __throttled_properties__ = {} # override this
 
     def __init__(self):
         object.__init__(self)
         self.__observers = []
+        # keys are observers, values are their notification methods
+        # (see _get_observer_notifications), computed at registration:
+        self.__observer_notifications = {}
         # keys are properties names, values are methods inside the observer:
         self.__value_notifications = {}
         self.__instance_notif_before = {}
         self.__instance_notif_after = {}
         self.__signal_notif = {}
 
+        # keys are properties names, values are intervals in ms:
+        self.__throttles = dict(self.__throttled_properties__)
+        # keys are intervals, values are _ThrottleGroup instances:
+        self.__throttle_groups = {}
+
+        self.__batch_depth = 0
+        self.__batch_names = [] # changed properties, in first change order
+        self.__batch_changes = {} # name -> [first old, last new]
+
         for key in (self.__properties__.keys() + self.__derived_properties__.keys()):
             self.register_property(key)
             pass
@@ -74,7 +110,7 @@ class Model (object):
         """Registers an existing property to be monitored, and sets
         up notifiers for notifications"""
         if not self.__value_notifications.has_key(name):
-            self.__value_notifications[name] = []
+            self.__value_notifications[name] = _MethodSet()
             pass
 
         # registers observable wrappers
@@ -85,15 +121,15 @@ class Model (object):
 
             if isinstance(prop, Signal):
                 if not self.__signal_notif.has_key(name):
-                    self.__signal_notif[name] = []
+                    self.__signal_notif[name] = _MethodSet()
                     pass
                 pass
             else:
                 if not self.__instance_notif_before.has_key(name):
-                    self.__instance_notif_before[name] = []
+                    self.__instance_notif_before[name] = _MethodSet()
                     pass
                 if not self.__instance_notif_after.has_key(name):
-                    self.__instance_notif_after[name] = []
+                    self.__instance_notif_after[name] = _MethodSet()
                     pass
                 pass
             pass
@@ -101,6 +137,50 @@ class Model (object):
         return
 
 
+    def set_property_throttle(self, name, interval):
+        """Notifies changes of property name at most once every
+        interval milliseconds. A interval of None or 0 removes the
+        throttle."""
+        assert(self.has_property(name))
+        if interval:
+            self.__throttles[name] = interval
+        elif self.__throttles.has_key(name):
+            del self.__throttles[name]
+            pass
+        return
+
+
+    def batch(self):
+        """Returns a context manager deferring value change
+        notifications until it exits. Batches can be nested"""
+        return _Batch(self)
+
+    def _begin_batch(self):
+        self.__batch_depth += 1
+        return
+
+    def _end_batch(self):
+        self.__batch_depth -= 1
+        if self.__batch_depth > 0 or not self.__batch_names: return
+
+        changes = [(name,) + tuple(self.__batch_changes[name])
+                   for name in self.__batch_names]
+        self.__batch_names = []
+        self.__batch_changes = {}
+
+        immediate = []
+        for change in changes:
+            if self.__throttles.has_key(change[0]):
+                self.__throttle_value_change(*change)
+            else:
+                immediate.append(change)
+                pass
+            pass
+
+        self.__deliver_changes(immediate)
+        return
+
+
     def has_property(self, name):
         """Returns true if given property name refers an observable
         property inside self or inside derived classes"""
@@ -112,8 +192,12 @@ class Model (object):
         if observer in self.__observers: return # not already registered
 
         self.__observers.append(observer)
-        for key in (self.__properties__.keys() + self.__derived_properties__.keys()):
-            self.__add_observer_notification(observer, key)
+        notifications = _get_observer_notifications(observer)
+        self.__observer_notifications[observer] = notifications
+        for key in notifications:
+            if self.has_property(key):
+                self.__add_observer_notification(observer, key)
+                pass
             pass
 
         return
@@ -122,11 +206,14 @@ class Model (object):
     def unregister_observer(self, observer):
         if observer not in self.__observers: return
 
-        for key in (self.__properties__.keys() + self.__derived_properties__.keys()):
-            self.__remove_observer_notification(observer, key)
+        for key in self.__observer_notifications[observer]:
+            if self.has_property(key):
+                self.__remove_observer_notification(observer, key)
+                pass
             pass
 
         self.__observers.remove(observer)
+        del self.__observer_notifications[observer]
         return
 
 
@@ -146,95 +233,49 @@ class Model (object):
 
 
     def __add_observer_notification(self, observer, prop_name):
-        """Searches in the observer for any possible listener, and
-        stores the notification methods to be called later"""
-
-        method_name = "property_%s_value_change" % prop_name
-        if hasattr(observer, method_name):
-            method = getattr(observer, method_name)
-            if method not in self.__value_notifications[prop_name]:
-                list.append(self.__value_notifications[prop_name], method)
-                pass
-            pass
+        """Stores the notification methods the observer defines for
+        the given property, to be called later"""
 
-        # is it a signal?
-        orig_prop = getattr(self, "_prop_%s" % prop_name)
-        if isinstance(orig_prop, Signal):
-            method_name = "property_%s_signal_emit" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
-                if method not in self.__signal_notif[prop_name]:
-                    list.append(self.__signal_notif[prop_name], method)
-                    pass
-                pass
-            pass
+        kinds = self.__observer_notifications[observer].get(prop_name)
+        if not kinds: return
 
-        # is it an instance change notification type?
-        elif isinstance(orig_prop, ObsWrapperBase):
-            method_name = "property_%s_before_change" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
-                if method not in self.__instance_notif_before[prop_name]:
-                    list.append(self.__instance_notif_before[prop_name], method)
-                    pass
+        orig_prop = getattr(self, "_prop_%s" % prop_name)
+        for kind, method_name in kinds.items():
+            if kind == "value_change":
+                notifs = self.__value_notifications
+            # is it a signal?
+            elif isinstance(orig_prop, Signal):
+                if kind != "signal_emit": continue
+                notifs = self.__signal_notif
+            # is it an instance change notification type?
+            elif isinstance(orig_prop, ObsWrapperBase):
+                if kind == "before_change":
+                    notifs = self.__instance_notif_before
+                elif kind == "after_change":
+                    notifs = self.__instance_notif_after
+                else: continue
                 pass
+            else: continue
 
-            method_name = "property_%s_after_change" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
-                if method not in self.__instance_notif_after[prop_name]:
-                    list.append(self.__instance_notif_after[prop_name], method)
-                    pass
-                pass
+            notifs[prop_name].add(getattr(observer, method_name))
             pass
 
         return
 
 
     def __remove_observer_notification(self, observer, prop_name):
-        if self.__value_notifications.has_key(prop_name):
-            method_name = "property_%s_value_change" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
-                if method in self.__value_notifications[prop_name]:
-                    self.__value_notifications[prop_name].remove(method)
-                    pass
-                pass
-            pass
-
-
-        orig_prop = getattr(self, "_prop_%s" % prop_name)
-        # is it a signal?
-        if isinstance(orig_prop, Signal):
-            method_name = "property_%s_signal_emit" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
-                if method in self.__signal_notif[prop_name]:
-                    self.__signal_notif[prop_name].remove(method)
-                    pass
-                pass
-            pass
-
-        # is it an instance change notification type?
-        elif isinstance(orig_prop, ObsWrapperBase):
-            if self.__instance_notif_before.has_key(prop_name):
-                method_name = "property_%s_before_change" % prop_name
-                if hasattr(observer, method_name):
-                    method = getattr(observer, method_name)
-                    if method in self.__instance_notif_before[prop_name]:
-                        self.__instance_notif_before[prop_name].remove(method)
-                        pass
-                    pass
-                pass
-
-            if self.__instance_notif_after.has_key(prop_name):
-                method_name = "property_%s_after_change" % prop_name
-                if hasattr(observer, method_name):
-                    method = getattr(observer, method_name)
-                    if method in self.__instance_notif_after[prop_name]:
-                        self.__instance_notif_after[prop_name].remove(method)
-                        pass
-                    pass
+        kinds = self.__observer_notifications[observer].get(prop_name)
+        if not kinds: return
+
+        all_notifs = {"value_change" : self.__value_notifications,
+                      "signal_emit" : self.__signal_notif,
+                      "before_change" : self.__instance_notif_before,
+                      "after_change" : self.__instance_notif_after,
+                      }
+        for kind, method_name in kinds.items():
+            notifs = all_notifs[kind]
+            if notifs.has_key(prop_name):
+                notifs[prop_name].discard(getattr(observer, method_name))
                 pass
             pass
 
@@ -253,6 +294,19 @@ class Model (object):
 
     def notify_property_value_change(self, prop_name, old, new):
         assert(self.__value_notifications.has_key(prop_name))
+        if self.__batch_depth > 0:
+            if self.__batch_changes.has_key(prop_name):
+                self.__batch_changes[prop_name][1] = new
+            else:
+                self.__batch_names.append(prop_name)
+                self.__batch_changes[prop_name] = [old, new]
+                pass
+            return
+
+        if self.__throttles.has_key(prop_name):
+            self.__throttle_value_change(prop_name, old, new)
+            return
+
         for method in self.__value_notifications[prop_name] :
             obs = method.im_self
             # notification occurs checking spuriousness of the observer
@@ -263,6 +317,47 @@ class Model (object):
             pass
         return
 
+    def __throttle_value_change(self, prop_name, old, new):
+        interval = self.__throttles[prop_name]
+        group = self.__throttle_groups.get(interval)
+        if group is None:
+            group = _ThrottleGroup(interval, self.__deliver_changes)
+            self.__throttle_groups[interval] = group
+            pass
+        group.add(prop_name, old, new)
+        return
+
+    def __deliver_changes(self, changes):
+        """Delivers changes, a list of (name, old, new) tuples, to the
+        observers. Observers defining properties_value_change get them
+        all at once"""
+        aggregated = {}
+        aggregated_obs = [] # in first notification order
+        for prop_name, old, new in changes:
+            for method in self.__value_notifications[prop_name]:
+                obs = method.im_self
+                if old == new and not obs.accepts_spurious_change():
+                    continue
+
+                if hasattr(obs, 'properties_value_change'):
+                    if not aggregated.has_key(obs):
+                        aggregated[obs] = []
+                        aggregated_obs.append(obs)
+                        pass
+                    aggregated[obs].append((prop_name, old, new))
+                    pass
+                else:
+                    self.__notify_observer__(obs, method, self, old, new)
+                    pass
+                pass
+            pass
+
+        for obs in aggregated_obs:
+            self.__notify_observer__(obs, obs.properties_value_change,
+                                     self, aggregated[obs])
+            pass
+        return
+
     def notify_method_before_change(self, prop_name, instance, meth_name,
                                     args, kwargs):
         assert(self.__instance_notif_before.has_key(prop_name))
@@ -294,6 +389,180 @@ class Model (object):
 # ----------------------------------------------------------------------
 
 
+class _Batch (object):
+    """Context manager returned by Model.batch"""
+
+    def __init__(self, model):
+        self.model = model
+        return
+
+    def __enter__(self):
+        self.model._begin_batch()
+        return self.model
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.model._end_batch()
+        return False
+
+    pass # end of class _Batch
+# ----------------------------------------------------------------------
+
+
+@decorators.good_decorator
+def batched(method):
+    """Decorator for model methods, makes the whole method run
+    inside a batch (see Model.batch)"""
+    def wrapper(self, *args, **kwargs):
+        self._begin_batch()
+        try: return method(self, *args, **kwargs)
+        finally: self._end_batch()
+        pass
+    return wrapper
+
+
+_NOTIFICATION_RE = re.compile(
+    r"^property_(.+)_(value_change|before_change|after_change|signal_emit)$")
+
+# keys are observer classes, values are maps from property names to
+# maps from notification kinds to method names:
+_observer_notifications = {}
+
+def _scan_notifications(names):
+    """Returns a map from property names to maps from notification
+    kind ('value_change', 'before_change', 'after_change',
+    'signal_emit') to the method name among names"""
+    notifications = {}
+    for name in names:
+        match = _NOTIFICATION_RE.match(name)
+        if match is None: continue
+        prop_name, kind = match.groups()
+        if not notifications.has_key(prop_name):
+            notifications[prop_name] = {}
+            pass
+        notifications[prop_name][kind] = name
+        pass
+    return notifications
+
+def _get_observer_notifications(observer):
+    """Returns the notification methods defined by observer (see
+    _scan_notifications). Classes are scanned only the first time,
+    methods set on the instance (as adapters do) are added to them,
+    so models call this once per registered observer"""
+    cls = observer.__class__
+    try: notifications = _observer_notifications[cls]
+    except KeyError:
+        notifications = _scan_notifications(dir(cls))
+        _observer_notifications[cls] = notifications
+        pass
+
+    names = [name for name in getattr(observer, "__dict__", {}).keys()
+             if name.startswith("property_")]
+    if not names: return notifications
+
+    merged = {}
+    for prop_name, kinds in notifications.items():
+        merged[prop_name] = dict(kinds)
+        pass
+    for prop_name, kinds in _scan_notifications(names).items():
+        merged.setdefault(prop_name, {}).update(kinds)
+        pass
+    return merged
+
+
+class _MethodSet (object):
+    """A set of notification methods that keeps them in insertion
+    order. Adding and removing are O(1), iterating goes through a
+    snapshot that is rebuilt only after the set changes, so the set
+    can be changed while it is being iterated"""
+
+    def __init__(self):
+        self.__methods = {} # method -> insertion number
+        self.__count = 0
+        self.__snapshot = ()
+        return
+
+    def add(self, method):
+        if self.__methods.has_key(method): return
+        self.__methods[method] = self.__count
+        self.__count += 1
+        self.__snapshot = None
+        return
+
+    def discard(self, method):
+        if not self.__methods.has_key(method): return
+        del self.__methods[method]
+        self.__snapshot = None
+        return
+
+    def __contains__(self, method): return self.__methods.has_key(method)
+
+    def __len__(self): return len(self.__methods)
+
+    def __iter__(self):
+        if self.__snapshot is None:
+            items = [(n, m) for m, n in self.__methods.items()]
+            items.sort()
+            self.__snapshot = tuple([m for n, m in items])
+            pass
+        return iter(self.__snapshot)
+
+    pass # end of class _MethodSet
+# ----------------------------------------------------------------------
+
+
+class _ThrottleGroup (object):
+    """Collapses the changes of the properties throttled with the same
+    interval and hands them to flush_cb, on the leading edge from an
+    idle callback and then at most once per interval (trailing
+    edge). The group stays idle once a whole interval goes by without
+    changes"""
+
+    def __init__(self, interval, flush_cb):
+        self.interval = interval
+        self.flush_cb = flush_cb
+        self.source_id = None
+        self.names = [] # pending properties, in first change order
+        self.pending = {} # name -> [first old, last new]
+        return
+
+    def add(self, name, old, new):
+        if self.pending.has_key(name):
+            self.pending[name][1] = new
+        else:
+            self.names.append(name)
+            self.pending[name] = [old, new]
+            pass
+
+        if self.source_id is None:
+            self.source_id = gobject.idle_add(self.__leading_edge)
+            pass
+        return
+
+    def __flush(self):
+        changes = [(name,) + tuple(self.pending[name]) for name in self.names]
+        self.names = []
+        self.pending = {}
+        self.flush_cb(changes)
+        return
+
+    def __leading_edge(self):
+        self.source_id = gobject.timeout_add(self.interval,
+                                             self.__trailing_edge)
+        self.__flush()
+        return False
+
+    def __trailing_edge(self):
+        if not self.names:
+            self.source_id = None
+            return False
+
+        self.__flush()
+        return True
+
+    pass # end of class _ThrottleGroup
+# ----------------------------------------------------------------------
+
+
 
 import gtk
 # ----------------------------------------------------------------------
@@ -40,7 +40,13 @@ class ModelMT (Model):
     performed by exploiting the gtk idle loop only if needed,
     otherwise the standard notification system (direct method call) is
     used. In this model, the observer is expected to run in the gtk
-    main loop thread."""
+    main loop thread.
+
+    Notifications coming from other threads are queued and the queue
+    is drained by a single idle callback per burst. Value change
+    notifications still queued for the same observer method are merged
+    into one carrying the first old value and the last new one, see
+    get_queue_stats for the queue counters."""
 
     __metaclass__  = support.metaclasses.ObservablePropertyMetaMT
 
@@ -48,6 +54,14 @@ class ModelMT (Model):
         Model.__init__(self)
         self.__observer_threads = {}
         self._prop_lock = _threading.Lock()
+
+        self.__queue_lock = _threading.Lock()
+        self.__queue = [] # [observer, method, args, kwargs]
+        self.__queue_merge = {} # (observer, method) -> queue entry
+        self.__queue_source = None
+        self.__queue_stats = {"queued" : 0, "merged" : 0, "dropped" : 0,
+                              "delivered" : 0, "bursts" : 0,
+                              "max_depth" : 0}
         return
 
     def register_observer(self, observer):
@@ -60,6 +74,19 @@ class ModelMT (Model):
         del self.__observer_threads[observer]
         return
 
+    def get_queue_stats(self):
+        """Returns a map with the counters of the notification queue:
+        depth (notifications waiting), queued, merged (into a waiting
+        one), dropped (spurious after merging, or whose observer went
+        away), delivered, bursts (idle callbacks that drained the queue)
+        and max_depth"""
+        self.__queue_lock.acquire()
+        try:
+            stats = dict(self.__queue_stats)
+            stats["depth"] = len(self.__queue)
+        finally: self.__queue_lock.release()
+        return stats
+
     # ---------- Notifiers:
 
     def __notify_observer__(self, observer, method, *args, **kwargs):
@@ -74,11 +101,71 @@ class ModelMT (Model):
                                              *args, **kwargs)
 
         # multi-threading call
-        gobject.idle_add(self.__idle_callback, observer, method, args, kwargs)
+        self.__enqueue(observer, method, args, kwargs)
+        return
+
+    def __enqueue(self, observer, method, args, kwargs):
+        # only value changes can be merged, every signal emission and
+        # instance change has to be notified
+        name = method.__name__
+        mergeable = name.startswith("property_") and \
+                    name.endswith("_value_change")
+
+        self.__queue_lock.acquire()
+        try:
+            stats = self.__queue_stats
+            stats["queued"] += 1
+            key = (observer, method)
+            if mergeable and self.__queue_merge.has_key(key):
+                entry = self.__queue_merge[key]
+                entry[2] = (entry[2][0], entry[2][1], args[2])
+                stats["merged"] += 1
+                return
+
+            entry = [observer, method, args, kwargs]
+            self.__queue.append(entry)
+            if mergeable: self.__queue_merge[key] = entry
+            stats["max_depth"] = max(stats["max_depth"], len(self.__queue))
+
+            if self.__queue_source is None:
+                self.__queue_source = gobject.idle_add(self.__drain)
+                pass
+        finally: self.__queue_lock.release()
         return
 
-    def __idle_callback(self, observer, method, args, kwargs):
-        method(*args, **kwargs)
+    def __drain(self):
+        self.__queue_lock.acquire()
+        try:
+            queue = self.__queue
+            merge = self.__queue_merge
+            self.__queue = []
+            self.__queue_merge = {}
+            self.__queue_source = None
+            self.__queue_stats["bursts"] += 1
+        finally: self.__queue_lock.release()
+
+        delivered = dropped = 0
+        for observer, method, args, kwargs in queue:
+            if not self.__observer_threads.has_key(observer):
+                dropped += 1
+                continue
+
+            if merge.has_key((observer, method)):
+                model, old, new = args
+                if old == new and not observer.accepts_spurious_change():
+                    dropped += 1
+                    continue
+                pass
+
+            method(*args, **kwargs)
+            delivered += 1
+            pass
+
+        self.__queue_lock.acquire()
+        try:
+            self.__queue_stats["delivered"] += delivered
+            self.__queue_stats["dropped"] += dropped
+        finally: self.__queue_lock.release()
         return False
 
 
@@ -36,6 +36,46 @@ from utils import get_function_from_source
 
 VERBOSE_LEVEL = 5
 
+# values of these types are immutable and never wrapped, setting them
+# takes the fast path of the descriptors
+SCALAR_TYPES = frozenset((int, long, float, str, unicode, bool,
+                          types.NoneType))
+
+
+class PropertyDescriptor (object):
+    """Data descriptor of a property whose value is kept in the
+    member variable _prop_<name> of the instance (the class holds the
+    default value)"""
+
+    def __init__(self, prop_name):
+        self.prop_name = prop_name
+        self.varname = "_prop_%s" % prop_name
+        return
+
+    def __get__(self, obj, objtype=None):
+        if obj is None: return self
+        return getattr(obj, self.varname)
+
+    def __set__(self, obj, val):
+        setattr(obj, self.varname, val)
+        return
+
+    def make_getter(self, getter_name):
+        """Returns a function suitable to be the getter method"""
+        def getter(obj): return self.__get__(obj)
+        getter.__name__ = getter_name
+        return getter
+
+    def make_setter(self, setter_name):
+        """Returns a function suitable to be the setter method"""
+        def setter(obj, val): self.__set__(obj, val)
+        setter.__name__ = setter_name
+        return setter
+
+    pass # end of class
+# ----------------------------------------------------------------------
+
+
 class PropertyMeta (type):
     """This is a meta-class that provides auto-property support.
     The idea is to allow programmers to define some properties which
@@ -65,8 +105,10 @@ class PropertyMeta (type):
 
     To supply your own methods is good for few methods, but can result in a
     very unconfortable way for many methods. In this case you can extend
-    the meta-class, and override methods get_[gs]etter_source with your
-    implementation (this can be probably made better).
+    the meta-class, and override method create_descriptor to return
+    your own PropertyDescriptor. Meta-classes overriding the older
+    get_[gs]etter_source methods are still supported, the source they
+    return gets compiled.
     An example is provided in meta-class PropertyMetaVerbose below.
     """
 
@@ -114,27 +156,43 @@ class PropertyMeta (type):
         setter_name = "set_prop_%s" % prop_name
 
         members_names = cls.__dict__.keys()
+        meta = type(cls)
+        custom = False
+
+        if cls.__uses_sources__():
+            descr = None
+        else:
+            descr = meta.create_descriptor(cls, prop_name)
+            pass
 
         # checks if accessors are already defined:
         if getter_name not in members_names:
-            src = type(cls).get_getter_source(cls, getter_name, prop_name)
-            func = get_function_from_source(src)
+            if descr is None:
+                src = meta.get_getter_source(cls, getter_name, prop_name)
+                func = get_function_from_source(src)
+            else: func = descr.make_getter(getter_name)
             setattr(cls, getter_name, func)
         else:
             cls.__msg__("Warning: Custom member '%s' overloads generated accessor of property '%s'" \
                         % (getter_name, prop_name), 2)
+            custom = True
             pass
 
         if setter_name not in members_names:
-            src = type(cls).get_setter_source(cls, setter_name, prop_name)
-            func = get_function_from_source(src)
+            if descr is None:
+                src = meta.get_setter_source(cls, setter_name, prop_name)
+                func = get_function_from_source(src)
+            else: func = descr.make_setter(setter_name)
             setattr(cls, setter_name, func)
         else:
             cls.__msg__("Warning: Custom member '%s' overloads generated accessor of property '%s'" \
                         % (setter_name, prop_name), 2)
+            custom = True
             pass
 
-        prop = property(getattr(cls, getter_name), getattr(cls, setter_name))
+        if descr is None or custom:
+            prop = property(getattr(cls, getter_name), getattr(cls, setter_name))
+        else: prop = descr
 
         if prop_name in members_names:
             cls.__msg__("Warning: automatic property builder overrids property %s in class %s" \
@@ -148,6 +206,18 @@ class PropertyMeta (type):
                           % (varname, cls.__name__), 2)
         return
 
+    def __uses_sources__(cls):
+        """Returns True if the meta-class overrides the
+        get_[gs]etter_source methods, in that case accessors are
+        compiled from them"""
+        meta = type(cls)
+        for name in ("get_getter_source", "get_setter_source"):
+            if getattr(meta, name).im_func is not \
+                   getattr(PropertyMeta, name).im_func:
+                return True
+            pass
+        return False
+
     def __create_property(cls, name, default_val):
         setattr(cls, name, cls.create_value(name, default_val))
         return
@@ -198,6 +268,10 @@ class PropertyMeta (type):
     # ------------------------------------------------------------
 
     # Override these:
+    def create_descriptor(cls, prop_name):
+        """Returns the descriptor implementing property prop_name"""
+        return PropertyDescriptor(prop_name)
+
     def get_getter_source(cls, getter_name, prop_name):
         """This must be overridden if you need a different implementation.
         Simply the generated implementation returns the variable name
@@ -21,10 +21,52 @@
 #  or email to the author Roberto Cavada <cavada@fbk.eu>.
 #  Please report bugs to <cavada@fbk.eu>.
 
-from metaclass_base import PropertyMeta
+from metaclass_base import PropertyMeta, PropertyDescriptor, SCALAR_TYPES
 import types
 
 
+class ObservablePropertyDescriptor (PropertyDescriptor):
+    """Descriptor of an observable property, setting it notifies the
+    change to the model (see ObservablePropertyMeta)"""
+
+    def __set__(self, obj, val):
+        varname = self.varname
+        old = getattr(obj, varname)
+
+        if type(val) in SCALAR_TYPES:
+            # fast path, scalars are never wrapped
+            self.store(obj, val)
+            reset = type(old) is not type(val)
+        else:
+            cls = type(obj)
+            new = cls.create_value(self.prop_name, val, obj)
+            self.store(obj, new)
+            reset = cls.check_value_change(old, new)
+            pass
+
+        if reset: obj._reset_property_notification(self.prop_name)
+        obj.notify_property_value_change(self.prop_name, old, val)
+        return
+
+    def store(self, obj, val):
+        setattr(obj, self.varname, val)
+        return
+
+    pass #end of class
+
+
+class ObservablePropertyDescriptorMT (ObservablePropertyDescriptor):
+    """Stores the value holding the _prop_lock of the model"""
+
+    def store(self, obj, val):
+        obj._prop_lock.acquire()
+        try: setattr(obj, self.varname, val)
+        finally: obj._prop_lock.release()
+        return
+
+    pass #end of class
+
+
 class ObservablePropertyMeta (PropertyMeta):
     """Classes instantiated by this meta-class must provide a method named
     notify_property_change(self, prop_name, old, new)"""
@@ -32,15 +74,8 @@ class ObservablePropertyMeta (PropertyMeta):
         PropertyMeta.__init__(cls, name, bases, dict)
         return
 
-    def get_setter_source(cls, setter_name, prop_name):
-        return """def %(setter)s(self, val):
- old = self._prop_%(prop)s
- new = type(self).create_value('%(prop)s', val, self)
- self._prop_%(prop)s = new
- if type(self).check_value_change(old, new): self._reset_property_notification('%(prop)s')
- self.notify_property_value_change('%(prop)s', old, val)
- return
-""" % {'setter':setter_name, 'prop':prop_name}
+    def create_descriptor(cls, prop_name):
+        return ObservablePropertyDescriptor(prop_name)
 
     pass #end of class
 
@@ -55,17 +90,8 @@ class ObservablePropertyMetaMT (ObservablePropertyMeta):
         ObservablePropertyMeta.__init__(cls, name, bases, dict)
         return
 
-    def get_setter_source(cls, setter_name, prop_name):
-        return """def %(setter)s(self, val):
- old = self._prop_%(prop)s
- new = type(self).create_value('%(prop)s', val, self)
- self._prop_lock.acquire()
- self._prop_%(prop)s = new
- self._prop_lock.release()
- if type(self).check_value_change(old, new): self._reset_property_notification('%(prop)s')
- self.notify_property_value_change('%(prop)s', old, val)
- return
-""" % {'setter':setter_name, 'prop':prop_name}
+    def create_descriptor(cls, prop_name):
+        return ObservablePropertyDescriptorMT(prop_name)
 
     pass #end of class
 
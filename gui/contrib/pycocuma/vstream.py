@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+ Streaming vCard property extraction
+"""
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+
+import os
+from types import UnicodeType
+
+from gui.contrib.pycocuma.vcore import chop_line, deescape, vC_params
+from gui.logger import logger
+
+# path -> ((mtime, size, names), cards)
+_cache = {}
+
+
+def iter_loglines(stream):
+    "Line De-Folding (RFC 2425) of the lines read from stream, as a generator"
+    current = None
+    for line in stream:
+        # Line is continued if next phy. line starts with
+        # single space or tab:
+        if current is not None and len(line) >= 2 and line[0] in " \t":
+            current.append(chop_line(line[1:]))
+            continue
+
+        if current is not None:
+            yield "".join(current)
+        current = [chop_line(line)]
+
+    if current is not None:
+        yield "".join(current)
+
+
+def _get_name(line):
+    "Returns the upper-cased name of a content line, without group"
+    line = line.lstrip()
+    end = len(line)
+    for delim in ":;":
+        pos = line.find(delim)
+        if pos != -1 and pos < end:
+            end = pos
+    return line[:end].split(".")[-1].upper()
+
+
+def iter_cards(stream, names, encoding='utf8'):
+    """Yields a dict for every vCard read from stream
+
+    Only the properties in names are parsed, the dicts map their
+    (upper-cased) names to lists of (params, value) tuples, where params
+    is a vC_params and value the de-escaped text
+    """
+    names = set([name.upper() for name in names])
+    card = None
+
+    for line in iter_loglines(stream):
+        name = _get_name(line)
+        if name == "BEGIN" or name == "END":
+            value = line.split(":", 1)[-1].strip().upper()
+            if value == "VCARD":
+                if name == "BEGIN":
+                    card = {}
+                elif card is not None:
+                    yield card
+                    card = None
+            continue
+
+        if card is None or name not in names:
+            continue
+
+        if type(line) != UnicodeType:
+            line = unicode(line, encoding, 'replace')
+
+        if ":" not in line:
+            logger.warn("Ignoring vCard line without a value: %r" % line)
+            continue
+
+        head, value = line.split(":", 1)
+        pos = head.find(";")
+        if pos == -1:
+            params = vC_params()
+        else:
+            params = vC_params(head[pos:])
+
+        card.setdefault(name, []).append((params, deescape(value)))
+
+
+def extract_file(fname, names, encoding='utf8'):
+    """Returns the list of dicts of L{iter_cards} for the vcf file fname
+
+    Results are cached until the mtime or size of the file changes, so
+    they must not be modified. Raises OSError or IOError if the file
+    can't be read
+    """
+    st = os.stat(fname)
+    key = (st.st_mtime, st.st_size, tuple(sorted(names)))
+
+    cached = _cache.get(fname)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    fd = open(fname, "rb")
+    try:
+        cards = list(iter_cards(fd, names, encoding))
+    finally:
+        fd.close()
+
+    _cache[fname] = (key, cards)
+    return cards
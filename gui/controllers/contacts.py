@@ -89,7 +89,7 @@ class SearchContactController(Controller):
         pattern = self.view['search_entry'].get_text()
 
         treeview = self.parent_ctrl.view['contacts_treeview']
-        model = treeview.get_model()
+        model = self.parent_ctrl.get_treeview_model('contacts_treeview')
 
         contacts = model.find_contacts(pattern)
         if not contacts:
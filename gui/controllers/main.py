@@ -29,7 +29,7 @@ import gtk
 from gui.contrib.gtkmvc import Controller
 
 from gettext import dgettext
-from gobject import timeout_add_seconds
+from gobject import idle_add, timeout_add_seconds
 
 from wader.common.signals import SIG_SMS_COMP, SIG_SMS_DELV
 from wader.common.keyring import KeyringInvalidPassword
@@ -41,11 +41,14 @@ from gui.config import config
 from gui.logger import logger
 from gui.dialogs import (show_profile_window,
                                show_warning_dialog, ActivityProgressBar,
+                               ProgressBar,
                                show_warning_request_cancel_ok,
                                show_about_dialog, show_error_dialog,
                                ask_password_dialog,
                                open_dialog_question_checkbox_cancel_ok,
-                               save_csv_file, open_import_csv_dialog)
+                               save_csv_file, open_import_csv_dialog,
+                               save_sms_archive_file,
+                               open_sms_archive_dialog)
 from gui.keyring_dialogs import NewKeyringDialog, KeyringPasswordDialog
 from gui.utils import find_windows, get_error_msg, raise_window
 from gui.translate import _
@@ -68,18 +71,21 @@ from gui.constx import (GUI_SIM_AUTH_NONE, GUI_SIM_AUTH_PIN,
                               TV_DICT, TV_DICT_REV)
 
 from gui.contacts import SIMContact
-from gui.phonebook import (get_phonebook, Contact,
+from gui.phonebook import (get_phonebook, Contact, ContactNumberIndex,
                                 all_same_type, all_contacts_writable)
-from gui.csvutils import CSVUnicodeWriter, CSVContactsReader
-from gui.messages import get_messages_obj, is_sim_message
+from gui.csvutils import CSVContactsReader, export_csv, export_vcard
+from gui.messages import get_messages_obj, is_sim_message, get_message_key
+from gui.populate import TreeviewPopulator, DIRECT_INSERT_MAX
+from gui.simimport import SIMImporter
 
 from gui.network_codes import get_customer_support_info
 
 from gui.views.diagnostics import DiagnosticsView
 from gui.controllers.diagnostics import DiagnosticsController
 
-from gui.views.sms import NewSmsView, ForwardSmsView
-from gui.controllers.sms import NewSmsController, ForwardSmsController
+from gui.views.sms import NewSmsView, ForwardSmsView, SMSSearchView
+from gui.controllers.sms import (NewSmsController, ForwardSmsController,
+                                 SMSSearchController)
 
 from gui.views.payt import PayAsYouTalkView
 from gui.controllers.payt import PayAsYouTalkController
@@ -96,6 +102,9 @@ from gui.models.profile import ProfileModel
 from gui.views.profile import APNSelectionView
 from gui.controllers.profile import APNSelectionController
 
+# rows listed in the import failures dialog at most
+IMPORT_FAILURES_SHOWN = 10
+
 
 def get_fake_toggle_button():
     """Returns a toggled L{gtk.ToggleToolButton}"""
@@ -118,11 +127,14 @@ class MainController(Controller):
 
         self.apb = None  # activity progress bar
         self.tray = None
+        self.populator = None  # fills the treeviews in the background
+        self._status_line_source = None
         # ignore cancelled connection attempts errors
         self._ignore_no_reply = False
 
     def register_view(self, view):
         super(MainController, self).register_view(view)
+        self.view.setup_rate_history(self.model.rate_history)
         self._setup_trayicon()
         self.connect_to_signals()
         self.start()
@@ -281,16 +293,31 @@ class MainController(Controller):
             return False  # don't want to be called again
 
         self.view.set_connection_time(self.model.get_connection_time())
+        self.view.update_rate_history()
         return True
 
-    # properties
-    def property_status_value_change(self, model, old, new):
+    def _queue_status_line(self):
+        """
+        Schedules a single status line update for the next idle iteration
+
+        Several of the properties shown in the status line usually change
+        at once, this way they are rendered only once
+        """
+        if self._status_line_source is None:
+            self._status_line_source = idle_add(self._update_status_line)
+
+    def _update_status_line(self):
+        self._status_line_source = None
         self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
+                                  self.model.registration,
+                                  self.model.tech,
+                                  self.model.operator,
+                                  self.model.rssi)
+        return False
 
+    # properties
+    def property_status_value_change(self, model, old, new):
+        self._queue_status_line()
         self.view.set_view_state(new)
 
         if old < GUI_MODEM_STATE_ENABLED and new >= GUI_MODEM_STATE_ENABLED:
@@ -314,32 +341,16 @@ class MainController(Controller):
             self.model.dial_path = None
 
     def property_registration_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
+        self._queue_status_line()
 
     def property_tech_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
+        self._queue_status_line()
 
     def property_operator_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
+        self._queue_status_line()
 
     def property_rssi_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
+        self._queue_status_line()
 
     def on_net_password_required(self, opath, tag):
         password = ask_password_dialog(self.view)
@@ -494,12 +505,20 @@ class MainController(Controller):
     def property_rx_rate_value_change(self, model, old, new):
         if old != new:
             self.view.set_transfer_rate(new, upload=False)
-            logger.info("Rate rx: %d" % new)
 
     def property_tx_rate_value_change(self, model, old, new):
         if old != new:
             self.view.set_transfer_rate(new, upload=True)
-            logger.info("Rate tx: %d" % new)
+
+    def properties_value_change(self, model, changes):
+        # throttled and batched changes arrive together
+        names = []
+        for name, old, new in changes:
+            getattr(self, 'property_%s_value_change' % name)(model, old, new)
+            names.append(name)
+
+        if 'rx_rate' in names or 'tx_rate' in names:
+            logger.debug("Rate rx: %d tx: %d" % (model.rx_rate, model.tx_rate))
 
     def property_transfer_limit_exceeded_value_change(self, model, old, new):
         if not old and new:
@@ -568,8 +587,8 @@ class MainController(Controller):
         sms = None
 
         # Find the original message
-        treeview = self.view['sent_treeview']
-        for message in treeview.get_model().get_messages():
+        model = self.get_treeview_model('sent_treeview')
+        for message in model.get_messages():
             msgref = message.status_reference
             if msgref is not None and msgref == reference:
                 sms = message
@@ -603,21 +622,20 @@ class MainController(Controller):
         contact = self._find_contact_by_number(sms.number)
         if contact:
             who = contact.get_name()
-            contacts_list = [contact]
         else:
             who = sms.number
-            contacts_list = None
 
         # Populate treeview
         treeview = self.view['inbox_treeview']
-        model = treeview.get_model()
-        model.add_message(sms, contacts_list)
+        model = self.get_treeview_model('inbox_treeview')
+        model.add_message(sms, self._get_contacts_index())
 
         # Get the path of the new message and scroll to it
-        paths = [str(i) for i, row in enumerate(model)
-                    if row[TV_SMS_OBJ] is sms]
-        if len(paths):
-            treeview.scroll_to_cell(paths[0])
+        if treeview.get_model() is not None:
+            paths = [str(i) for i, row in enumerate(model)
+                        if row[TV_SMS_OBJ] is sms]
+            if len(paths):
+                treeview.scroll_to_cell(paths[0])
 
         # Send notification
         title = _("SMS received from %s") % who
@@ -787,8 +805,6 @@ class MainController(Controller):
     def on_import_contacts1_activate(self, widget):
         filepath = open_import_csv_dialog()
         if filepath:
-            phonebook = get_phonebook(self.model.device)
-
             try:
                 reader = CSVContactsReader(open(filepath))
             except ValueError:
@@ -797,21 +813,105 @@ class MainController(Controller):
 The csv file that you have tried to import has an invalid format.""")
                 show_warning_dialog(message, details)
             else:
-                phonebook.add_contacts(list(reader), True)
+                self._import_sim_contacts(list(reader))
 
-                # Flip the notebook to contacts
-                self.view['main_notebook'].set_current_page(3)
-                self.refresh_treeviews()
+    def _import_sim_contacts(self, contacts):
+        progress = ProgressBar(_("Importing contacts"), self)
+        failures = []
+
+        def failed_cb(row, contact, reason):
+            failures.append(_("Row %(row)d: %(reason)s") %
+                            dict(row=row, reason=reason))
+
+        def done_cb(added, skipped, cancelled, error):
+            if not progress.exit:
+                progress.close()
+
+            if error is not None:
+                message = _("Contacts not imported")
+                details = _("The contacts of the SIM could not be read to "
+                            "skip duplicates: %s") % get_error_msg(error)
+                show_warning_dialog(message, details)
+                return
+
+            logger.info("Imported %d contacts to the SIM, %d duplicates "
+                        "skipped, %d failed" % (len(added), skipped,
+                                                len(failures)))
+            if failures:
+                message = _("Some contacts could not be imported")
+                details = '\n'.join(failures[:IMPORT_FAILURES_SHOWN])
+                if len(failures) > IMPORT_FAILURES_SHOWN:
+                    details += '\n' + _("and %d more") % \
+                                    (len(failures) - IMPORT_FAILURES_SHOWN)
+                show_warning_dialog(message, details)
+
+            # Flip the notebook to contacts
+            self.view['main_notebook'].set_current_page(3)
+            self.refresh_treeviews()
+
+        importer = SIMImporter(self.model.device, contacts,
+                               progress_cb=progress.set_progress,
+                               failed_cb=failed_cb, done_cb=done_cb)
+        progress.set_cancel_cb(importer.cancel)
+        progress.init()
+        importer.start()
 
     def on_export_contacts1_activate(self, widget):
         filepath = save_csv_file()
         if filepath:
-            writer = CSVUnicodeWriter(open(filepath, 'w'))
             # Now we support different backends we need to be more
             # selective about what we write out?
-            contacts = [c.to_csv() for c in self._get_treeview_contacts()
-                                if c.is_writable()]
-            writer.write_rows(contacts)
+            contacts = (c for c in self._get_treeview_contacts()
+                                if c.is_writable())
+            fobj = open(filepath, 'wb')
+            try:
+                if filepath.lower().endswith('.vcf'):
+                    export_vcard(fobj, contacts)
+                else:
+                    export_csv(fobj, contacts)
+            finally:
+                fobj.close()
+
+    def on_export_messages1_activate(self, widget):
+        filepath = save_sms_archive_file()
+        if filepath:
+            messages_obj = get_messages_obj(self.model.device)
+            fobj = open(filepath, 'wb')
+            try:
+                count = messages_obj.export_archive(fobj)
+            finally:
+                fobj.close()
+
+            logger.info("Exported %d messages to %s" % (count, filepath))
+
+    def on_import_messages1_activate(self, widget):
+        filepath = open_sms_archive_dialog()
+        if filepath:
+            messages_obj = get_messages_obj(self.model.device)
+            fobj = open(filepath, 'rb')
+            try:
+                try:
+                    added, skipped, error = messages_obj.import_archive(fobj)
+                except ValueError, e:
+                    message = _('Invalid SMS archive')
+                    details = _("The file that you have tried to import is "
+                                "not a valid SMS archive: %s") % e
+                    show_warning_dialog(message, details)
+                    return
+            finally:
+                fobj.close()
+
+            logger.info("Imported %d messages from %s, %d duplicates "
+                        "skipped" % (added, filepath, skipped))
+            if added:
+                self.refresh_treeviews()
+
+            if error is not None:
+                message = _('Corrupt SMS archive')
+                details = _("The SMS archive that you have imported is "
+                            "damaged, only %d messages could be imported: "
+                            "%s") % (added, error)
+                show_warning_dialog(message, details)
 
     def on_connect_button_toggled(self, widget):
         dialmanager = self.model.get_dialer_manager()
@@ -909,6 +1009,35 @@ The csv file that you have tried to import has an invalid format.""")
         view.set_parent_view(self.view)
         view.show()
 
+    def on_search_messages1_activate(self, widget):
+        ctrl = SMSSearchController(self.model, self)
+        view = SMSSearchView(ctrl)
+        view.set_parent_view(self.view)
+        view.show()
+
+    def select_message(self, sms):
+        """Selects C{sms} in its folder and shows it"""
+        name = TV_DICT[sms.where]
+        treeview = self.view[name]
+        model = treeview.get_model()
+        if model is None:
+            # the treeviews are being populated
+            return
+
+        key = get_message_key(sms)
+        _iter = model.get_iter_first()
+        while _iter:
+            if get_message_key(model.get_value(_iter, TV_SMS_OBJ)) == key:
+                break
+            _iter = model.iter_next(_iter)
+        else:
+            return
+
+        self.view['main_notebook'].set_current_page(TV_DICT_REV[name] - 1)
+        path = model.get_path(_iter)
+        treeview.set_cursor(path)
+        treeview.scroll_to_cell(path)
+
     def on_quit_menu_item_activate(self, widget):
         self._quit_confirm_exit()
 
@@ -1068,18 +1197,23 @@ The csv file that you have tried to import has an invalid format.""")
             details = _("No mobile connection. Do you want to continue?")
             return show_warning_request_cancel_ok(message, details)
 
-    def _empty_treeviews(self, treeviews):
-        for treeview_name in treeviews:
-            model = self.view[treeview_name].get_model()
-            if model:
-                model.clear()
+    def get_treeview_model(self, treeview_name):
+        """
+        Returns the model of C{treeview_name}
+
+        The model is returned even if it's been temporarily detached from
+        its treeview while the treeviews are populated
+        """
+        treeview = self.view[treeview_name]
+        if self.populator is not None:
+            return self.populator.get_model(treeview)
+        return treeview.get_model()
 
     def _hide_sim_contacts(self):
         """
         Called when the device holding the SIM is removed
         """
-        treeview = self.view['contacts_treeview']
-        model = treeview.get_model()
+        model = self.get_treeview_model('contacts_treeview')
 
         iter = model.get_iter_first()
         while iter:
@@ -1094,7 +1228,7 @@ The csv file that you have tried to import has an invalid format.""")
         Called when the device holding the SIM is removed
         """
         treeview = self.view['inbox_treeview']
-        model = treeview.get_model()
+        model = self.get_treeview_model('inbox_treeview')
 
         iter = model.get_iter_first()
         while iter:
@@ -1111,8 +1245,7 @@ The csv file that you have tried to import has an invalid format.""")
             self.view.set_message_preview(text)
 
     def _find_contact_by_number(self, number):
-        treeview = self.view['contacts_treeview']
-        model = treeview.get_model()
+        model = self.get_treeview_model('contacts_treeview')
 
         contacts = model.find_contacts_by_number(number)
         if not len(contacts):
@@ -1123,38 +1256,100 @@ The csv file that you have tried to import has an invalid format.""")
                 print contact.get_name()
         return contacts[0]
 
-    def _fill_contacts(self, contacts):
-        """Fills the contacts treeview with contacts"""
+    def _populate_treeviews(self, contacts, messages):
+        """
+        Brings the contacts and messages treeviews up to date
+
+        The stores are reconciled with C{contacts} and C{messages} in
+        place, so a refresh doesn't lose the selection nor the scroll
+        position. Only the rows that are new need to be inserted, a few of
+        them are added straight away and bigger batches (i.e. the first
+        fill) are added from an idle source.
+
+        The contacts job runs first so the number index of the contacts
+        treeview is complete by the time the messages are added, that way
+        we don't need to lookup the sender number of every SMS on the whole
+        contacts list to find out whether is a known contact or not.
+        """
+        if self.populator is not None:
+            self.populator.cancel()
+
+        def progress_cb(done, total):
+            self.view.set_throbber_progress(done, total)
+
+        def done_cb():
+            self.populator = None
+            self.view.stop_throbber()
+
+        populator = TreeviewPopulator(done_cb=done_cb,
+                                      progress_cb=progress_cb)
+        direct = []
+
+        def add_job(treeview, items, add_func):
+            if len(items) <= DIRECT_INSERT_MAX:
+                direct.append((items, add_func))
+            else:
+                populator.add_job(treeview, items, add_func)
+
         treeview = self.view['contacts_treeview']
         model = treeview.get_model()
-        model.add_contacts(contacts)
+        add_job(treeview, model.reconcile(contacts), model.add_contact)
+
+        # the contacts store index is not complete until the new contacts
+        # are in, an index of the fresh list is used meanwhile
+        index = ContactNumberIndex(contacts)
+        per_treeview = dict((name, []) for name in
+                            ['inbox_treeview', 'drafts_treeview',
+                             'sent_treeview'])
+        for sms in messages:
+            per_treeview.setdefault(TV_DICT[sms.where], []).append(sms)
+
+        for name, smslist in per_treeview.items():
+            treeview = self.view[name]
+            model = treeview.get_model()
+            add_message = lambda sms, model=model: \
+                                model.add_message(sms, index)
+            add_job(treeview, model.reconcile(smslist, index), add_message)
+
+        for items, add_func in direct:
+            for item in items:
+                add_func(item)
+
+        if not populator.total:
+            self.populator = None
+            return
 
-    def _fill_messages(self, messages):
+        self.populator = populator
+        self.view.start_throbber()
+        populator.start()
+
+    def _merge_contacts_source(self, cclass, contacts):
         """
-        Fills the messages treeview with SIM & DB SMS
+        Brings the contacts of a single source up to date
 
-        We're using the contacts list installed in the contacts treeview
-        because otherwise, adding dozens of SMS to the treeview would be very
-        inefficient, as we would have to lookup the sender number of every SMS
-        to find out whether is a known contact or not.
+        Called as every source delivers so the fastest ones show up
+        without waiting for the rest, big batches and the messages are
+        left for L{_populate_treeviews}
         """
-        contacts = self._get_treeview_contacts()
+        if self.populator is not None:
+            return
 
-        for sms in messages:
-            active_tv = TV_DICT[sms.where]         # get treeview name
-            treeview = self.view[active_tv]        # get treeview object
-            treeview.get_model().add_message(sms, contacts)  # append to tv
+        model = self.get_treeview_model('contacts_treeview')
+        new = model.reconcile(contacts, cclass)
+        if len(new) <= DIRECT_INSERT_MAX:
+            for contact in new:
+                model.add_contact(contact)
 
     def update_message_contact_info(self):
         """
         Iterates through each SMS treeview, updating contact info
         """
 
-        contacts = self._get_treeview_contacts()
+        index = self._get_contacts_index()
 
         for tv in ['inbox_treeview', 'drafts_treeview', 'sent_treeview']:
             treeview = self.view[tv]
-            treeview.get_model().update_contacts(contacts)
+            treeview.get_model().update_contacts(index)
 
     def refresh_treeviews(self):
         """
@@ -1163,9 +1358,7 @@ The csv file that you have tried to import has an invalid format.""")
 
         def messages_cb(contacts, messages):
             # refresh display
-            self._empty_treeviews(list(set(TV_DICT.values())))
-            self._fill_contacts(contacts)
-            self._fill_messages(messages)
+            self._populate_treeviews(contacts, messages)
 
         def contacts_cb(contacts):
             # get messages from all backends(inc SIM)
@@ -1176,11 +1369,14 @@ The csv file that you have tried to import has an invalid format.""")
 
         # get contacts from all backends(inc SIM)
         phonebook = get_phonebook(device=self.model.device)
-        phonebook.get_contacts_async(contacts_cb, logger.error)
+        phonebook.get_contacts_async(contacts_cb, logger.error,
+                                     self._merge_contacts_source)
 
     def _get_treeview_contacts(self):
-        treeview = self.view['contacts_treeview']
-        return treeview.get_model().get_contacts()
+        return self.get_treeview_model('contacts_treeview').get_contacts()
+
+    def _get_contacts_index(self):
+        return self.get_treeview_model('contacts_treeview').index
 
     def update_usage_view(self):
         self.view.update_bars_user_limit()
@@ -1325,8 +1521,10 @@ The csv file that you have tried to import has an invalid format.""")
 
         if number != model[path][TV_CNT_NUMBER] and is_valid_number(number):
             contact = model[path][TV_CNT_OBJ]
+            old_number = contact.get_number()
             if contact.set_number(unicode(number, 'utf8')):
                 model[path][TV_CNT_NUMBER] = number
+                model.reindex_contact(contact, old_number)
                 self.update_message_contact_info()
 
     def _setup_trayicon(self, ignoreconf=False):
@@ -1544,7 +1742,7 @@ The csv file that you have tried to import has an invalid format.""")
                 message_mgr.delete_objs([old])
 
                 # Update the treeview
-                model.update_message(_iter, new, self._get_treeview_contacts())
+                model.update_message(_iter, new, self._get_contacts_index())
 
     def _save_sms_to_draft(self, widget):
         """This will save the selected SMS to the drafts tv and the DB"""
@@ -1556,8 +1754,8 @@ The csv file that you have tried to import has an invalid format.""")
             where = TV_DICT_REV['drafts_treeview']
             new = message_mgr.add_message(old, where=where)
             # Add to the view
-            tv = self.view['drafts_treeview']
-            tv.get_model().add_message(new)
+            model = self.get_treeview_model('drafts_treeview')
+            model.add_message(new, self._get_contacts_index())
 
     def _add_new_contact_cb(self, contact):
         if contact is None:
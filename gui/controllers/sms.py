@@ -23,10 +23,6 @@ from dateutil.tz import gettz
 #from gtkmvc import Controller, Model
 from gui.contrib.gtkmvc import Controller, Model
 
-from messaging.sms import SmsSubmit, is_gsm_text
-from messaging.sms.consts import (SEVENBIT_SIZE, UCS2_SIZE,
-                                 SEVENBIT_MP_SIZE, UCS2_MP_SIZE)
-
 from wader.common.consts import SMS_INTFACE
 from wader.common.provider import NetworkProvider
 from wader.common.sms import Message
@@ -35,6 +31,10 @@ from gui import dialogs
 from gui.translate import _
 from gui.logger import logger
 from gui.messages import get_messages_obj
+from gui.populate import TreeviewPopulator, DIRECT_INSERT_MAX
+from gui.smscounter import SMSCounter
+from gui.smsindex import (get_sms_index, sqlite3, SearchQuery,
+                          MAX_RESULTS)
 from gui.utils import get_error_msg
 from gui.consts import (APP_LONG_NAME, CFG_PREFS_DEFAULT_SMS_VALIDITY,
                         CFG_SMS_VALIDITY_R1D, CFG_SMS_VALIDITY_R3D,
@@ -61,7 +61,7 @@ class NewSmsController(Controller):
         super(NewSmsController, self).__init__(model)
         self.state = IDLE
         self.parent_ctrl = parent_ctrl
-        self.max_length = SEVENBIT_SIZE
+        self.counter = SMSCounter()
         self.numbers_entry = ValidatedEntry(v_phone)
         self.sms = None
         self.contacts = contacts
@@ -80,12 +80,14 @@ class NewSmsController(Controller):
 
     def register_view(self, view):
         super(NewSmsController, self).register_view(view)
-        # set initial text
-        msg = _('Text message: 0/%d chars') % self.max_length
-        self.view.get_top_widget().set_title(msg)
-        # signals stuff
+        # signals stuff, the edits are seen before they are applied
         textbuffer = self.view['sms_edit_text_view'].get_buffer()
+        textbuffer.connect('insert-text', self._textbuffer_insert_text)
+        textbuffer.connect('delete-range', self._textbuffer_delete_range)
         textbuffer.connect('changed', self._textbuffer_changed)
+        # set initial text
+        self.counter.reset(self.get_message_text().decode('utf-8'))
+        self._textbuffer_changed(textbuffer)
         # show up
         self.numbers_entry.grab_focus()
 
@@ -251,26 +253,23 @@ class NewSmsController(Controller):
         view = ContactsListView(ctrl)
         view.run()
 
+    def _textbuffer_insert_text(self, textbuffer, _iter, text, length):
+        self.counter.insert(text.decode('utf-8'))
+
+    def _textbuffer_delete_range(self, textbuffer, start, end):
+        self.counter.delete(textbuffer.get_text(start, end).decode('utf-8'))
+
     def _textbuffer_changed(self, textbuffer):
         """Handler for the textbuffer changed signal"""
-        text = textbuffer.get_text(textbuffer.get_start_iter(),
-                                   textbuffer.get_end_iter())
-        if not len(text):
-            msg = _('Text message: 0/%d chars') % SEVENBIT_SIZE
+        counter = self.counter
+        args = dict(num=counter.get_used(),
+                    total=counter.get_segment_size(),
+                    msgs=counter.get_segments())
+        if args['msgs'] == 1:
+            msg = _('Text message: %(num)d/%(total)d chars') % args
         else:
-            # get the number of messages
-            # we use a default number for encoding purposes
-            num_sms = len(SmsSubmit('+342453435', text).to_pdu())
-            if num_sms == 1:
-                max_length = SEVENBIT_SIZE if is_gsm_text(text) else UCS2_SIZE
-                args = dict(num=len(text), total=max_length)
-                msg = _('Text message: %(num)d/%(total)d chars') % args
-            else:
-                max_length = SEVENBIT_MP_SIZE if is_gsm_text(text) else UCS2_MP_SIZE
-                used = len(text) - (max_length * (num_sms - 1))
-                args = dict(num=used, total=max_length, msgs=num_sms)
-                msg = _('Text message: '
-                        '%(num)d/%(total)d chars (%(msgs)d SMS)') % args
+            msg = _('Text message: '
+                    '%(num)d/%(total)d chars (%(msgs)d SMS)') % args
 
         self.view.get_top_widget().set_title(msg)
 
@@ -301,13 +300,13 @@ class NewSmsController(Controller):
             dblist[0].status_reference = smslist[0].status_reference
 
         tv_name = TV_DICT[where]
-        model = self.parent_ctrl.view[tv_name].get_model()
+        model = self.parent_ctrl.get_treeview_model(tv_name)
         model.add_messages(dblist)
 
     def delete_messages_from_db_and_tv(self, smslist):
         messages = get_messages_obj(self.parent_ctrl.model.get_device())
         messages.delete_messages(smslist)
-        model = self.parent_ctrl.view['drafts_treeview'].get_model()
+        model = self.parent_ctrl.get_treeview_model('drafts_treeview')
         iter = model.get_iter_first()
         while iter:
             if model.get_value(iter, TV_SMS_OBJ) in smslist:
@@ -334,3 +333,94 @@ class ForwardSmsController(NewSmsController):
 
     def set_processed_sms(self, sms):
         self.sms = sms
+
+
+class SMSSearchController(Controller):
+    """Controller for the message search dialog"""
+
+    def __init__(self, model, parent_ctrl):
+        super(SMSSearchController, self).__init__(model)
+        self.parent_ctrl = parent_ctrl
+        self.populator = None
+
+    def close_controller(self):
+        if self.populator is not None:
+            self.populator.cancel()
+        self.model.unregister_observer(self)
+        self.view.get_top_widget().destroy()
+        self.view = None
+        self.model = None
+
+    def on_sms_search_dialog_delete_event(self, *args):
+        self.close_controller()
+
+    def on_sms_search_close_button_clicked(self, widget):
+        self.close_controller()
+
+    def _find_messages(self, keys):
+        # the index only has keys, the messages are the ones shown in the
+        # main window, whose stores keep them by key
+        models = [self.parent_ctrl.get_treeview_model(name) for name in
+                  ['inbox_treeview', 'drafts_treeview', 'sent_treeview']]
+        found = []
+        for key in keys:
+            for model in models:
+                sms = model.get_message_by_key(key)
+                if sms is not None:
+                    found.append(sms)
+                    break
+
+        return found
+
+    def _resolve_sender(self, name):
+        model = self.parent_ctrl.get_treeview_model('contacts_treeview')
+        return [c.get_number() for c in model.find_contacts(name)]
+
+    def on_sms_search_find_button_clicked(self, widget):
+        text = self.view['sms_search_entry'].get_text().decode('utf-8')
+        try:
+            query = SearchQuery(text, self._resolve_sender)
+            keys = get_sms_index().search(query)
+        except ValueError, e:
+            self.view.set_status(str(e))
+            return
+        except sqlite3.Error, e:
+            logger.error("Can not search the SMS index: %s" % e)
+            self.view.set_status(_("The search failed"))
+            return
+
+        found = self._find_messages(keys)
+
+        if len(keys) >= MAX_RESULTS:
+            self.view.set_status(_("Showing the newest %d messages found")
+                                 % len(found))
+        else:
+            self.view.set_status(_("%d messages found") % len(found))
+
+        self._show_results(found)
+
+    def _show_results(self, found):
+        if self.populator is not None:
+            self.populator.cancel()
+
+        treeview = self.view['sms_search_treeview']
+        model = treeview.get_model()
+        model.clear()
+
+        index = self.parent_ctrl._get_contacts_index()
+        add_message = lambda sms: model.add_message(sms, index)
+        if len(found) <= DIRECT_INSERT_MAX:
+            for sms in found:
+                add_message(sms)
+            return
+
+        def done_cb():
+            self.populator = None
+
+        self.populator = TreeviewPopulator(done_cb=done_cb)
+        self.populator.add_job(treeview, found, add_message)
+        self.populator.start()
+
+    def on_sms_search_treeview_row_activated(self, treeview, path, column):
+        model = treeview.get_model()
+        self.parent_ctrl.select_message(model[path][TV_SMS_OBJ])
@@ -21,41 +21,170 @@ Collection of CSV-related utilities and classes
 
 import csv
 import codecs
-import cStringIO
 
+from gui.contrib.pycocuma.vcore import escape
 from gui.phonebook import Contact
 
+# bytes buffered before they are written to the stream
+BLOCK_SIZE = 64 * 1024
+# octets of the longest physical vCard line, without the line break
+VCARD_LINE_SIZE = 75
+
+
+def is_ascii_compatible(encoding):
+    """Returns True if the csv delimiters are encoded as in ASCII"""
+    return u'",\r\n'.encode(encoding) == '",\r\n'
+
+
+class BufferedWriter(object):
+    """
+    I write strings to C{stream} in blocks of C{block_size} bytes
+
+    If given, C{recode} is applied to every block before writing it. The
+    stream is only flushed by L{flush}.
+    """
+
+    def __init__(self, stream, block_size=BLOCK_SIZE, recode=None):
+        self.stream = stream
+        self.block_size = block_size
+        self.recode = recode
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.block_size:
+            self._write_block()
+
+    def _write_block(self):
+        if not self.parts:
+            return
+
+        data = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        if self.recode is not None:
+            data = self.recode(data)
+        self.stream.write(data)
+
+    def flush(self):
+        self._write_block()
+        self.stream.flush()
+
 
 class CSVUnicodeWriter(object):
     """
     A CSV writer which will write rows to CSV file "f",
     which is encoded in the given encoding.
+
+    Rows are buffered, L{write_rows} flushes them when it is done and
+    callers of L{write_row} have to call L{flush} themselves.
     """
 
     def __init__(self, csvfile, dialect=csv.excel, encoding="utf-8", **kwds):
-        # Redirect output to a queue
-        self.queue = cStringIO.StringIO()
-        self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
-        self.stream = csvfile
-        self.encode = codecs.getencoder(encoding)
+        if is_ascii_compatible(encoding):
+            self.encoding = encoding
+            self.stream = BufferedWriter(csvfile)
+        else:
+            # the csv module only handles ASCII compatible byte strings,
+            # rows go through UTF-8 and are encoded block by block
+            self.encoding = "utf-8"
+            encoder = codecs.getincrementalencoder(encoding)()
+            self.stream = BufferedWriter(csvfile, recode=lambda data:
+                                encoder.encode(data.decode("utf-8")))
+        self.writer = csv.writer(self.stream, dialect=dialect, **kwds)
 
     def write_row(self, row):
-        self.writer.writerow([s.encode("utf-8") for s in row])
-        # Fetch UTF-8 output from the queue ...
-        data = self.queue.getvalue()
-        data = data.replace('""', '')  # remove extra '""'
-        data = data.decode("utf-8")
-        # ... and reencode it into the target encoding
-        data = self.encode(data)[0]
-        # write to the target stream
-        self.stream.write(data)
-        self.stream.flush()
-        # empty queue
-        self.queue.truncate(0)
+        encoding = self.encoding
+        self.writer.writerow([s.encode(encoding) for s in row])
 
     def write_rows(self, rows):
+        encoding = self.encoding
+        writerow = self.writer.writerow
         for row in rows:
-            self.write_row(row)
+            writerow([s.encode(encoding) for s in row])
+        self.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+
+def get_csv_row(item):
+    """Returns the csv row of a contact or a message"""
+    if hasattr(item, 'to_csv'):
+        return item.to_csv()
+
+    return [item.number, unicode(item.datetime.isoformat()), item.text]
+
+
+def export_csv(fobj, items, encoding="utf-8"):
+    """
+    Writes the contacts or messages of the iterable C{items} to C{fobj}
+
+    Contacts are written as name and number, messages as number, ISO
+    date and text
+    """
+    writer = CSVUnicodeWriter(fobj, encoding=encoding, quoting=csv.QUOTE_ALL)
+    writer.write_rows(get_csv_row(item) for item in items)
+
+
+def fold_vcard_line(line, encoding="utf-8"):
+    """
+    Returns the unicode content C{line} encoded, with its line break
+
+    Lines longer than L{VCARD_LINE_SIZE} octets are folded (RFC 2425),
+    never in the middle of a character
+    """
+    data = line.encode(encoding)
+    if len(data) <= VCARD_LINE_SIZE:
+        return data + '\r\n'
+
+    parts = []
+    size = 0
+    i = 0
+    while i < len(line):
+        j = i + 1
+        # keep the surrogate pairs of narrow builds together
+        if u'\ud800' <= line[i] <= u'\udbff' and j < len(line):
+            j += 1
+        data = line[i:j].encode(encoding)
+        if size + len(data) > VCARD_LINE_SIZE:
+            parts.append('\r\n ')
+            size = 1
+        parts.append(data)
+        size += len(data)
+        i = j
+
+    parts.append('\r\n')
+    return ''.join(parts)
+
+
+def get_vcard(contact, encoding="utf-8"):
+    """Returns the vCard 3.0 of C{contact} encoded with C{encoding}"""
+    name = escape(contact.get_name())
+    lines = [u'BEGIN:VCARD', u'VERSION:3.0',
+             u'FN:' + name,
+             u'N:%s;;;;' % name,
+             u'TEL;TYPE=CELL:' + escape(contact.get_number()),
+             u'END:VCARD']
+    return ''.join([fold_vcard_line(line, encoding) for line in lines])
+
+
+def export_vcard(fobj, contacts, encoding="utf-8"):
+    """
+    Writes the contacts of the iterable C{contacts} to C{fobj}
+
+    Only ASCII compatible encodings can be used, as line breaks and
+    folding are written in ASCII
+    """
+    if not is_ascii_compatible(encoding):
+        raise ValueError("vCards can not be written in %s" % encoding)
+
+    stream = BufferedWriter(fobj)
+    for contact in contacts:
+        stream.write(get_vcard(contact, encoding))
+    stream.flush()
 
 
 class CSVUnicodeReader(object):
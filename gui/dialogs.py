@@ -20,7 +20,6 @@ import os
 
 import gtk
 import gobject
-import dbus
 #from gtkmvc import Controller, Model
 from gui.contrib.gtkmvc import Controller, Model
 
@@ -28,6 +27,7 @@ from wader.common.consts import WADER_DIALUP_INTFACE
 from gui.translate import _
 from gui.consts import (APP_ARTISTS, APP_AUTHORS, APP_DOCUMENTERS,
                              GLADE_DIR, APP_VERSION, APP_NAME, APP_URL)
+from gui.utils import get_bus
 from gui.views.dialogs import QuestionCheckboxOkCancel
 
 DIALOG_WIDTH = 40
@@ -289,6 +289,12 @@ def save_csv_file(path=None):
     filter_.add_pattern("*csv")
     chooser_dialog.add_filter(filter_)
 
+    filter_ = gtk.FileFilter()
+    filter_.set_name(_("vCard files"))
+    filter_.add_mime_type("text/x-vcard")
+    filter_.add_pattern("*.vcf")
+    chooser_dialog.add_filter(filter_)
+
     filter_ = gtk.FileFilter()
     filter_.set_name(_("All files"))
     filter_.add_pattern("*")
@@ -342,6 +348,64 @@ def open_import_csv_dialog(path=None):
     chooser_dialog.destroy()
     return resp
 
+SMS_ARCHIVE_PATTERN = "*.smsa"
+
+
+def _add_sms_archive_filters(chooser_dialog):
+    filter_ = gtk.FileFilter()
+    filter_.set_name(_("SMS archives"))
+    filter_.add_pattern(SMS_ARCHIVE_PATTERN)
+    chooser_dialog.add_filter(filter_)
+
+    filter_ = gtk.FileFilter()
+    filter_.set_name(_("All files"))
+    filter_.add_pattern("*")
+    chooser_dialog.add_filter(filter_)
+
+
+def save_sms_archive_file(path=None):
+    """Opens a filechooser dialog to choose where to save an SMS archive"""
+    title = _("Export messages to...")
+    chooser_dialog = gtk.FileChooserDialog(title,
+                    action=gtk.FILE_CHOOSER_ACTION_SAVE,
+                    buttons=(gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                             gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+
+    chooser_dialog.set_default_response(gtk.RESPONSE_OK)
+    chooser_dialog.set_do_overwrite_confirmation(True)
+    _add_sms_archive_filters(chooser_dialog)
+
+    if path:
+        chooser_dialog.set_filename(os.path.abspath(path))
+    if chooser_dialog.run() == gtk.RESPONSE_OK:
+        resp = chooser_dialog.get_filename()
+    else:
+        resp = None
+
+    chooser_dialog.destroy()
+    return resp
+
+
+def open_sms_archive_dialog(path=None):
+    """Opens a filechooser dialog to import an SMS archive"""
+    title = _("Import messages from...")
+    chooser_dialog = gtk.FileChooserDialog(title,
+                    buttons=(gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                             gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+
+    chooser_dialog.set_default_response(gtk.RESPONSE_OK)
+    _add_sms_archive_filters(chooser_dialog)
+
+    if path:
+        chooser_dialog.set_filename(os.path.abspath(path))
+    if chooser_dialog.run() == gtk.RESPONSE_OK:
+        resp = chooser_dialog.get_filename()
+    else:
+        resp = None
+
+    chooser_dialog.destroy()
+    return resp
+
 #########################################################################
 
 PULSE_STEP = .2
@@ -403,7 +467,7 @@ class ActivityProgressBar(object):
         self.connect_to_signals()
 
     def connect_to_signals(self):
-        bus = dbus.SystemBus()
+        bus = get_bus()
         self.disconnect_sm = bus.add_signal_receiver(
                                 self.disconnected_cb,
                                 "Disconnected",
@@ -448,3 +512,21 @@ class ActivityProgressBar(object):
         self.cancel_func = func
         self.cancel_args = args
         self.cancel_kwds = kwds
+
+
+class ProgressBar(ActivityProgressBar):
+    """
+    I am a progress bar for operations whose length is known
+    """
+
+    def init(self):
+        self.window.show_all()
+
+    def set_progress(self, done, total):
+        if self.exit:
+            return
+
+        if total:
+            self.progress_bar.set_fraction(float(done) / total)
+        self.progress_bar.set_text(_('%(done)d of %(total)d') %
+                                   dict(done=done, total=total))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Fixed size throughput history
+"""
+
+from array import array
+
+# one hour of per second samples
+SHORT_TERM_SIZE = 3600
+# samples summarized in every long term slot
+DOWNSAMPLE_FACTOR = 60
+# one day of per minute summaries
+LONG_TERM_SIZE = 24 * 60
+
+
+class RingBuffer(object):
+    """
+    I keep the last C{size} numbers appended to me
+
+    The numbers live in a preallocated C{array} so memory stays constant
+    no matter how many are appended. Every number gets a sequence number,
+    the first one appended is 0, which can be used to get it back while it
+    is still in the buffer.
+    """
+
+    def __init__(self, size, typecode='d'):
+        self.size = size
+        self.data = array(typecode, [0] * size)
+        self.count = 0  # numbers appended so far
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, value):
+        self.data[self.count % self.size] = value
+        self.count += 1
+
+    def first(self):
+        """Returns the sequence number of the oldest number kept"""
+        return max(0, self.count - self.size)
+
+    def get(self, seq, default=None):
+        """Returns the number with sequence number C{seq}"""
+        if seq < self.first() or seq >= self.count:
+            return default
+        return self.data[seq % self.size]
+
+    def values(self, last=None):
+        """Returns the last C{last} numbers (all by default), oldest first"""
+        if last is None or last > len(self):
+            last = len(self)
+        return [self.data[seq % self.size]
+                    for seq in xrange(self.count - last, self.count)]
+
+
+class Summary(object):
+    """I keep the min, avg and max of a downsampled series"""
+
+    def __init__(self, size):
+        self.min = RingBuffer(size)
+        self.avg = RingBuffer(size)
+        self.max = RingBuffer(size)
+
+    def __len__(self):
+        return len(self.avg)
+
+    def append(self, values):
+        self.min.append(min(values))
+        self.avg.append(sum(values) / float(len(values)))
+        self.max.append(max(values))
+
+
+class RateHistory(object):
+    """
+    I record the rx and tx rates of the connection
+
+    The last L{SHORT_TERM_SIZE} samples are kept as is and every
+    L{DOWNSAMPLE_FACTOR} samples are summarized in the long term history,
+    which keeps the last L{LONG_TERM_SIZE} summaries
+    """
+
+    def __init__(self, size=SHORT_TERM_SIZE, factor=DOWNSAMPLE_FACTOR,
+                 long_term_size=LONG_TERM_SIZE):
+        self.rx = RingBuffer(size)
+        self.tx = RingBuffer(size)
+        self.factor = factor
+        self.rx_summary = Summary(long_term_size)
+        self.tx_summary = Summary(long_term_size)
+
+    def __len__(self):
+        return len(self.rx)
+
+    def get_count(self):
+        """Returns the number of samples recorded so far"""
+        return self.rx.count
+
+    def add(self, rx_rate, tx_rate):
+        self.rx.append(rx_rate)
+        self.tx.append(tx_rate)
+
+        if self.rx.count % self.factor == 0:
+            self.rx_summary.append(self.rx.values(self.factor))
+            self.tx_summary.append(self.tx.values(self.factor))
+
+    def get(self, seq):
+        """Returns the C{(rx, tx)} rates of sample C{seq}, or None"""
+        rx = self.rx.get(seq)
+        if rx is None:
+            return None
+        return rx, self.tx.get(seq)
+
+    def get_max(self, last):
+        """Returns the highest rate among the last C{last} samples"""
+        values = self.rx.values(last) + self.tx.values(last)
+        if not values:
+            return 0
+        return max(values)
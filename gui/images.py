@@ -17,14 +17,119 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 """Images frequently used"""
 
-from os.path import join, exists
+from os.path import join, exists, isabs
 
+import gobject
 import gtk
 
 from gui.consts import IMAGES_DIR
+from gui.logger import logger
 
-MOBILE_IMG = gtk.gdk.pixbuf_new_from_file(join(IMAGES_DIR, 'mobile.png'))
-COMPUTER_IMG = gtk.gdk.pixbuf_new_from_file(join(IMAGES_DIR, 'computer.png'))
+# maximum number of unpinned pixbufs kept around
+CACHE_SIZE = 32
+
+# images shown in the status line, they are decoded at startup and never
+# evicted from the cache
+STATUS_IMAGES = ['radio-off.png', 'nodevice.png', 'device.png',
+                 'simlocked.png'] + \
+                ['signal-%s-%d.png' % (tech, value)
+                    for tech in ['gprs', 'umts', 'lte']
+                        for value in [0, 25, 50, 75, 100]]
+
+
+class PixbufCache(object):
+    """
+    I decode every image only once and share the pixbuf among its users
+
+    Pinned images are kept forever, the rest are evicted in least recently
+    used order once there are more than C{size} of them
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.pinned = {}
+        self.cache = {}
+        self.lru = []  # least recently used first
+
+    def _get_path(self, name):
+        if isabs(name):
+            return name
+        return join(IMAGES_DIR, name)
+
+    def get(self, name):
+        """Returns the pixbuf for C{name}, decoding it if needed"""
+        path = self._get_path(name)
+        try:
+            return self.pinned[path]
+        except KeyError:
+            pass
+
+        pixbuf = self.cache.get(path)
+        if pixbuf is None:
+            pixbuf = gtk.gdk.pixbuf_new_from_file(path)
+            self.cache[path] = pixbuf
+            if len(self.lru) >= self.size:
+                del self.cache[self.lru.pop(0)]
+        else:
+            self.lru.remove(path)
+
+        self.lru.append(path)
+        return pixbuf
+
+    def pin(self, name):
+        """Decodes C{name} and keeps it in the cache forever"""
+        path = self._get_path(name)
+        if path in self.pinned:
+            return self.pinned[path]
+
+        pixbuf = self.cache.pop(path, None)
+        if pixbuf is None:
+            pixbuf = gtk.gdk.pixbuf_new_from_file(path)
+        else:
+            self.lru.remove(path)
+
+        self.pinned[path] = pixbuf
+        return pixbuf
+
+    def preload(self, names):
+        """Pins C{names} from an idle source, one image per iteration"""
+        names = list(names)
+
+        def load_next():
+            while names:
+                name = names.pop(0)
+                if not exists(self._get_path(name)):
+                    continue
+                try:
+                    self.pin(name)
+                except gobject.GError, e:
+                    logger.warn("Can not load image %s: %s" % (name, e))
+                return True
+
+            return False
+
+        gobject.idle_add(load_next, priority=gobject.PRIORITY_LOW)
+
+
+_cache = PixbufCache()
+
+
+def get_pixbuf(name):
+    """
+    Returns the shared pixbuf of image C{name}
+
+    C{name} can be a path or a filename relative to L{IMAGES_DIR}
+    """
+    return _cache.get(name)
+
+
+def preload_status_images():
+    """Decodes the status line images in the background"""
+    _cache.preload(STATUS_IMAGES)
+
+
+MOBILE_IMG = _cache.pin('mobile.png')
+COMPUTER_IMG = _cache.pin('computer.png')
 
 THROBBER = gtk.gdk.PixbufAnimation(join(IMAGES_DIR, 'throbber.gif'))
 
@@ -19,9 +19,15 @@
 messages presents a uniform layer to deal with messages from both SIM and DB
 """
 
+import calendar
+from datetime import datetime
+import hashlib
+from itertools import islice
 from os.path import exists
+import struct
+import zlib
 
-from dateutil.tz import gettz
+from dateutil.tz import gettz, tzutc
 
 from wader.common.encoding import unpack_dbus_safe_string
 from wader.common.consts import SMS_INTFACE
@@ -38,12 +44,264 @@ KNOWN_FOLDERS = [inbox_folder, drafts_folder, outbox_folder]
 
 WAP_REPLACEMENT = _('WAP Push (Binary content)')
 
+# SMS archive layout: header (magic, index offset and length), one zlib
+# compressed chunk per run of messages of a thread and a zlib compressed
+# index with the folder, number, date range and position of every chunk
+ARCHIVE_MAGIC = 'VMBSMSA1'
+ARCHIVE_HEADER = struct.Struct('>8sQI')
+# messages per chunk
+ARCHIVE_CHUNK_SIZE = 256
+
+# device whose messages the SMS index was last synced with
+_index_device = None
+
 
 def is_sim_message(sms):
     """Returns True if C{sms} is a SIM sms"""
     return not isinstance(sms, DBMessage)
 
 
+def get_message_key(sms):
+    """
+    Returns a key that identifies C{sms} across refreshes
+
+    SIM messages are identified by their storage index and DB messages by
+    their DB id. wader doesn't tell which memory (SM, ME) a SIM message
+    is stored in, it selects a single preferred storage with AT+CPMS and
+    the indexes of SMS.List and SMS.Get all refer to it
+    """
+    if is_sim_message(sms):
+        return ('sim', sms.index)
+    return ('db', sms.index)
+
+
+def _to_timestamp(dt):
+    """Returns the UTC timestamp of C{dt}, naive datetimes are UTC"""
+    return calendar.timegm(dt.utctimetuple())
+
+
+def _escape(text):
+    return text.encode('utf-8').encode('string_escape')
+
+
+def _unescape(text):
+    return text.decode('string_escape').decode('utf-8')
+
+
+def get_sms_key(sms):
+    """
+    Returns the key of C{sms} for duplicate detection
+
+    It is made of the number, the timestamp and a hash of the text
+    """
+    text = (sms.text or u'').encode('utf-8')
+    return (sms.number, _to_timestamp(sms.datetime),
+            hashlib.md5(text).hexdigest())
+
+
+class ArchivedMessage(object):
+    """
+    A message read from an SMS archive
+    """
+
+    def __init__(self, number, text, _datetime, where):
+        self.number = number
+        self.text = text
+        self.datetime = _datetime
+        self.where = where
+
+    def __repr__(self):
+        return '<ArchivedMessage number="%s" where="%d">' % (self.number,
+                                                             self.where)
+
+
+class ArchiveChunk(object):
+    """
+    Index entry of a chunk of an SMS archive
+
+    C{first} and C{last} are the UTC timestamps of its oldest and newest
+    messages
+    """
+
+    def __init__(self, where, number, first, last, count, offset, length):
+        self.where = where
+        self.number = number
+        self.first = first
+        self.last = last
+        self.count = count
+        self.offset = offset
+        self.length = length
+
+    def matches(self, where=None, number=None, since=None, until=None):
+        """Returns True if the chunk may have messages matching the args"""
+        if where is not None and self.where != where:
+            return False
+        if number is not None and self.number != number:
+            return False
+        if since is not None and self.last < since:
+            return False
+        if until is not None and self.first > until:
+            return False
+        return True
+
+    def to_line(self):
+        return '%d\t%s\t%d\t%d\t%d\t%d\t%d\n' % (self.where,
+                _escape(self.number), self.first, self.last, self.count,
+                self.offset, self.length)
+
+    @classmethod
+    def from_line(cls, line):
+        where, number, first, last, count, offset, length = \
+                                                        line.split('\t')
+        return cls(int(where), _unescape(number), int(first), int(last),
+                   int(count), int(offset), int(length))
+
+
+class SMSArchiveWriter(object):
+    """
+    I write messages to an SMS archive in C{fobj}
+
+    C{fobj} must be seekable, the header is written again by L{close}
+    once the position of the index is known
+    """
+
+    def __init__(self, fobj, chunk_size=ARCHIVE_CHUNK_SIZE):
+        self.fobj = fobj
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.count = 0
+        self.start = fobj.tell()
+        fobj.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, 0, 0))
+
+    def add_thread(self, where, number, messages):
+        """Writes the iterable C{messages} of C{number} in folder C{where}"""
+        messages = iter(messages)
+        while True:
+            chunk = list(islice(messages, self.chunk_size))
+            if not chunk:
+                break
+            self._write_chunk(where, number, chunk)
+
+    def _write_chunk(self, where, number, messages):
+        lines = []
+        first = last = None
+        for sms in messages:
+            timestamp = _to_timestamp(sms.datetime)
+            if first is None or timestamp < first:
+                first = timestamp
+            if last is None or timestamp > last:
+                last = timestamp
+            lines.append('%d\t%s\n' % (timestamp, _escape(sms.text or u'')))
+
+        data = zlib.compress(''.join(lines))
+        offset = self.fobj.tell() - self.start
+        self.fobj.write(data)
+        self.chunks.append(ArchiveChunk(where, number, first, last,
+                                        len(lines), offset, len(data)))
+        self.count += len(lines)
+
+    def close(self):
+        """Writes the index and the header"""
+        index = zlib.compress(''.join([c.to_line() for c in self.chunks]))
+        offset = self.fobj.tell() - self.start
+        self.fobj.write(index)
+        end = self.fobj.tell()
+
+        self.fobj.seek(self.start)
+        self.fobj.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, offset,
+                                            len(index)))
+        self.fobj.seek(end)
+        self.fobj.flush()
+
+
+class SMSArchiveReader(object):
+    """
+    I read an SMS archive from C{fobj}
+
+    Only the index is read on creation, chunks are decompressed when
+    their messages are requested. Raises ValueError if C{fobj} is not an
+    SMS archive
+    """
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.start = fobj.tell()
+
+        header = fobj.read(ARCHIVE_HEADER.size)
+        if len(header) != ARCHIVE_HEADER.size:
+            raise ValueError("Truncated SMS archive")
+
+        magic, offset, length = ARCHIVE_HEADER.unpack(header)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("Not an SMS archive")
+        if not offset:
+            raise ValueError("Unfinished SMS archive")
+
+        try:
+            index = zlib.decompress(self._read(offset, length))
+        except zlib.error, e:
+            raise ValueError("Corrupt SMS archive index: %s" % e)
+
+        self.chunks = [ArchiveChunk.from_line(line)
+                            for line in index.splitlines()]
+
+    def _read(self, offset, length):
+        self.fobj.seek(self.start + offset)
+        data = self.fobj.read(length)
+        if len(data) != length:
+            raise ValueError("Truncated SMS archive")
+        return data
+
+    def __len__(self):
+        return sum([chunk.count for chunk in self.chunks])
+
+    def find_chunks(self, where=None, number=None, since=None, until=None):
+        """
+        Returns the chunks that may have messages matching the args
+
+        C{since} and C{until} are datetimes
+        """
+        if since is not None:
+            since = _to_timestamp(since)
+        if until is not None:
+            until = _to_timestamp(until)
+
+        return [chunk for chunk in self.chunks
+                    if chunk.matches(where, number, since, until)]
+
+    def iter_messages(self, where=None, number=None, since=None,
+                      until=None):
+        """
+        Yields the L{ArchivedMessage}s matching the args
+
+        Chunks that can't match are not decompressed
+        """
+        first = last = None
+        if since is not None:
+            first = _to_timestamp(since)
+        if until is not None:
+            last = _to_timestamp(until)
+        utc = tzutc()
+
+        for chunk in self.find_chunks(where, number, since, until):
+            try:
+                data = zlib.decompress(self._read(chunk.offset, chunk.length))
+            except zlib.error, e:
+                raise ValueError("Corrupt SMS archive chunk: %s" % e)
+
+            for line in data.splitlines():
+                timestamp, text = line.split('\t', 1)
+                timestamp = int(timestamp)
+                if first is not None and timestamp < first:
+                    continue
+                if last is not None and timestamp > last:
+                    continue
+
+                yield ArchivedMessage(chunk.number, _unescape(text),
+                            datetime.fromtimestamp(timestamp, utc),
+                            chunk.where)
+
+
 class DBSMSManager(object):
     """
     SMS manager for DB stored messages
@@ -70,6 +328,7 @@ class DBSMSManager(object):
 
         msg = DBMessage(sms.number, sms.text, _datetime=sms.datetime)
         self.provider.add_sms(msg, folder=folder)
+        msg.where = KNOWN_FOLDERS.index(folder) + 1
         return msg
 
     def add_messages(self, sms_list, where=None):
@@ -91,6 +350,35 @@ class DBSMSManager(object):
                 ret.extend(msgs)
         return ret
 
+    def iter_threads(self):
+        """Yields the folder number, number and messages of every thread"""
+        for i, folder in enumerate(KNOWN_FOLDERS):
+            for thread in self.provider.list_from_folder(folder):
+                yield i + 1, thread.number, \
+                        self.provider.list_from_thread(thread)
+
+    def export_archive(self, fobj, extra=None):
+        """
+        Writes all the DB messages to an SMS archive in C{fobj}
+
+        The messages of the list C{extra}, e.g. the SIM ones, are
+        archived too. Returns the number of messages written
+        """
+        writer = SMSArchiveWriter(fobj)
+        for where, number, messages in self.iter_threads():
+            writer.add_thread(where, number, messages)
+
+        threads = {}
+        for sms in extra or []:
+            key = (getattr(sms, 'where', None) or 1, sms.number)
+            threads.setdefault(key, []).append(sms)
+
+        for (where, number), messages in sorted(threads.items()):
+            writer.add_thread(where, number, messages)
+
+        writer.close()
+        return writer.count
+
 
 class Messages(object):
     """
@@ -111,20 +399,40 @@ class Messages(object):
         self.smanager.close()
         self.device = None
 
+    def _update_index(self, method, messages):
+        # gui.smsindex depends on this module
+        from gui.smsindex import get_sms_index, sqlite3
+        try:
+            getattr(get_sms_index(), method)(messages)
+        except sqlite3.Error, e:
+            logger.error("Can not update the SMS index: %s" % e)
+
+    def _sync_index(self, messages):
+        # the first listing of a device syncs the index, later changes
+        # go through the add and delete hooks
+        global _index_device
+        if self.device is _index_device:
+            return
+
+        _index_device = self.device
+        from gui.smsindex import schedule_sync
+        schedule_sync(messages)
+
     def add_messages(self, smslist, where=None):
-        return self.smanager.add_messages(smslist, where)
+        ret = self.smanager.add_messages(smslist, where)
+        self._update_index('add_messages', ret)
+        return ret
 
     def add_message(self, sms, where=None):
         if where:
             # where is only set when is a DB SMS
-            return self.smanager.add_message(sms, where)
+            ret = self.smanager.add_message(sms, where)
+            self._update_index('add_messages', [ret])
+            return ret
 
-    def get_messages(self):
+    def _get_sim_messages(self, slist):
         ret = []
-
-        # from sim storage
-        lst = self.device.List(dbus_interface=SMS_INTFACE)
-        for dct in lst:
+        for dct in slist:
             sms = SMMessage.from_dict(dct, self.tz)
             try:
                 text = unpack_dbus_safe_string(sms.text)
@@ -134,34 +442,32 @@ class Messages(object):
                     sms = SMMessage.from_dict(dct, self.tz)
             except ValueError:
                 pass
+
             ret.append(sms)
 
+        return ret
+
+    def get_messages(self):
+        ret = []
+
+        # from sim storage
+        ret.extend(self._get_sim_messages(
+                            self.device.List(dbus_interface=SMS_INTFACE)))
+
         # return messages in db storage too
         lst = self.smanager.get_messages()
         for msg in lst:
             msg.datetime = msg.datetime.astimezone(self.tz)
             ret.append(msg)
 
+        self._sync_index(ret)
         return ret
 
     def get_messages_async(self, cb, eb):
 
         def _cb(slist):
-            ret = []
-
             # from sim storage
-            for dct in slist:
-                sms = SMMessage.from_dict(dct, self.tz)
-                try:
-                    text = unpack_dbus_safe_string(sms.text)
-                    if text[1] == '\x06':  # WAP Push
-                        dct['text'] = '%s\n%s' % \
-                            (WAP_REPLACEMENT, text.encode('string_escape'))
-                        sms = SMMessage.from_dict(dct, self.tz)
-                except ValueError:
-                    pass
-
-                ret.append(sms)
+            ret = self._get_sim_messages(slist)
 
             # return messages in db storage too
             lst = self.smanager.get_messages()
@@ -169,18 +475,77 @@ class Messages(object):
                 msg.datetime = msg.datetime.astimezone(self.tz)
                 ret.append(msg)
 
+            self._sync_index(ret)
             cb(ret)
 
         self.device.List(dbus_interface=SMS_INTFACE,
                          reply_handler=_cb,
                          error_handler=eb)
 
+    def export_archive(self, fobj, include_sim=True):
+        """
+        Writes all the messages to an SMS archive in C{fobj}
+
+        SIM messages are only included if C{include_sim} is set and there
+        is a device. Returns the number of messages written
+        """
+        extra = []
+        if include_sim and self.device is not None:
+            extra = self._get_sim_messages(
+                            self.device.List(dbus_interface=SMS_INTFACE))
+
+        return self.smanager.export_archive(fobj, extra)
+
+    def import_archive(self, fobj, where=None, number=None, since=None,
+                       until=None):
+        """
+        Adds the messages of the SMS archive in C{fobj} to the DB
+
+        The args restrict the messages imported as in
+        L{SMSArchiveReader.iter_messages}. Messages already in the DB or,
+        if there is a device, in the SIM are skipped, so importing an
+        archive twice adds nothing. Returns the number of messages added
+        and skipped, and the ValueError of a corrupt chunk that stopped
+        the import (None if it completed). Raises ValueError if C{fobj}
+        is not an SMS archive
+        """
+        reader = SMSArchiveReader(fobj)
+        if self.device is not None:
+            messages = self.get_messages()
+        else:
+            messages = self.smanager.get_messages()
+        seen = set([get_sms_key(sms) for sms in messages])
+
+        added = []
+        skipped = 0
+        error = None
+        try:
+            for sms in reader.iter_messages(where, number, since, until):
+                key = get_sms_key(sms)
+                if key in seen:
+                    skipped += 1
+                    continue
+
+                seen.add(key)
+                if sms.where > len(KNOWN_FOLDERS):
+                    sms.where = None
+                added.append(self.smanager.add_message(sms, sms.where))
+        except ValueError, e:
+            # the messages read before the corrupt chunk stay imported
+            error = e
+
+        if added:
+            self._update_index('add_messages', added)
+        return len(added), skipped, error
+
     def get_message(self, index):
         dct = self.device.Get(index, dbus_interface=SMS_INTFACE)
         sms = SMMessage.from_dict(dct, self.tz)
+        self._update_index('add_messages', [sms])
         return sms
 
     def delete_messages(self, smslist):
+        self._update_index('remove_messages', smslist)
         for sms in smslist:
             if is_sim_message(sms):
                 self.device.Delete(sms.index, dbus_interface=SMS_INTFACE,
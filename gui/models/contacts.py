@@ -25,6 +25,9 @@ from gui.contrib.gtkmvc import ListStoreModel
 
 from gui.consts import (TV_CNT_TYPE, TV_CNT_NAME, TV_CNT_NUMBER,
                         TV_CNT_EDITABLE, TV_CNT_OBJ)
+from gui.images import get_pixbuf
+from gui.phonebook import ContactNumberIndex, get_contact_key
+from gui.utils import column_differs
 
 
 class ContactsStoreModel(ListStoreModel):
@@ -33,6 +36,8 @@ class ContactsStoreModel(ListStoreModel):
     def __init__(self):
         super(ContactsStoreModel, self).__init__(gtk.gdk.Pixbuf,
                 TYPE_STRING, TYPE_STRING, TYPE_BOOLEAN, TYPE_PYOBJECT)
+        # kept in sync with the rows, used to resolve numbers to contacts
+        self.index = ContactNumberIndex()
 
     def add_contacts(self, contacts):
         """Adds C{contacts} to the store"""
@@ -42,25 +47,85 @@ class ContactsStoreModel(ListStoreModel):
     def add_contact(self, contact):
         """Adds C{contact} to the store"""
         c = [None] * (TV_CNT_OBJ + 1)
-        c[TV_CNT_TYPE] = gtk.gdk.pixbuf_new_from_file(contact.image_16x16())
+        c[TV_CNT_TYPE] = get_pixbuf(contact.image_16x16())
         c[TV_CNT_NAME] = contact.name
         c[TV_CNT_NUMBER] = contact.number
         c[TV_CNT_EDITABLE] = contact.writable
         c[TV_CNT_OBJ] = contact
         self.append(c)
+        self.index.add(contact)
+
+    def reconcile(self, contacts, cclass=None):
+        """
+        Updates the store in place so it holds C{contacts}
+
+        If C{cclass} is given only the rows holding instances of it are
+        reconciled, so sources can be brought up to date one by one
+
+        Rows are matched on L{get_contact_key}, the ones that are no longer
+        present are removed and the ones whose contact changed are updated
+        in place, so selection and scroll position survive. The contacts
+        that are not in the store yet are returned to let the caller decide
+        how to add them.
+        """
+        wanted = {}
+        for contact in contacts:
+            wanted.setdefault(get_contact_key(contact), contact)
 
-    def find_contacts_by_number(self, number):
-        ret = []
+        seen = set()
         _iter = self.get_iter_first()
         while _iter:
-            _number = self.get_value(_iter, TV_CNT_NUMBER)
-            if _number == number:
-                ret.append(self.get_value(_iter, TV_CNT_OBJ))
-
-            _iter = self.iter_next(_iter)
+            _next = self.iter_next(_iter)
+            old = self.get_value(_iter, TV_CNT_OBJ)
+            if cclass is not None and not isinstance(old, cclass):
+                _iter = _next
+                continue
+
+            key = get_contact_key(old)
+            new = wanted.get(key)
+            if new is None or key in seen:
+                self.remove(_iter)
+            else:
+                seen.add(key)
+                if old is not new and vars(old) != vars(new):
+                    self._update_contact(_iter, old, new)
+            _iter = _next
 
+        ret = []
+        for contact in contacts:
+            key = get_contact_key(contact)
+            if key not in seen:
+                seen.add(key)
+                ret.append(contact)
         return ret
 
+    def _update_contact(self, _iter, old, new):
+        columns = [(TV_CNT_NAME, new.name), (TV_CNT_NUMBER, new.number),
+                   (TV_CNT_EDITABLE, new.writable)]
+        for column, value in columns:
+            if column_differs(self.get_value(_iter, column), value):
+                self.set_value(_iter, column, value)
+
+        self.set_value(_iter, TV_CNT_OBJ, new)
+        self.index.remove(old)
+        self.index.add(new)
+
+    def remove(self, _iter):
+        """Removes the row pointed by C{_iter} and unindexes its contact"""
+        self.index.remove(self.get_value(_iter, TV_CNT_OBJ))
+        return super(ContactsStoreModel, self).remove(_iter)
+
+    def clear(self):
+        self.index.clear()
+        super(ContactsStoreModel, self).clear()
+
+    def reindex_contact(self, contact, old_number):
+        """Updates the index after C{contact}'s number was edited"""
+        self.index.update(contact, old_number)
+
+    def find_contacts_by_number(self, number):
+        return self.index.lookup(number)
+
     def find_contacts(self, pattern):
         ret = []
         _iter = self.get_iter_first()
@@ -27,7 +27,7 @@ dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 from gobject import timeout_add_seconds
 
 #from gtkmvc import Model
-from gui.contrib.gtkmvc import Model
+from gui.contrib.gtkmvc import Model, batched
 
 from wader.common.consts import (WADER_SERVICE, WADER_OBJPATH, WADER_INTFACE,
                                  WADER_DIALUP_SERVICE, WADER_DIALUP_OBJECT,
@@ -48,8 +48,10 @@ from gui.dialogs import show_error_dialog
 from gui.models.profile import ProfilesModel
 from gui.models.preferences import PreferencesModel
 from gui.translate import _
-from gui.utils import dbus_error_is, get_error_msg
-from gui.consts import USAGE_DB, APP_VERSION
+from gui.utils import dbus_error_is, get_error_msg, get_bus
+from gui.consts import (USAGE_DB, APP_VERSION,
+                        CFG_PREFS_DEFAULT_USAGE_JOURNAL_INTERVAL,
+                        CFG_PREFS_DEFAULT_STATS_UPDATE_INTERVAL)
 from gui.constx import (GUI_SIM_AUTH_NONE, GUI_SIM_AUTH_PIN,
                               GUI_SIM_AUTH_PUK, GUI_SIM_AUTH_PUK2,
                               GUI_MODEM_STATE_UNKNOWN,
@@ -59,7 +61,9 @@ from gui.constx import (GUI_SIM_AUTH_NONE, GUI_SIM_AUTH_PIN,
                               GUI_MODEM_STATE_ENABLED,
                               GUI_MODEM_STATE_CONNECTED)
 from gui.config import config
+from gui.history import RateHistory
 from gui.uptime import get_uptime
+from gui.usage import UsageAggregateCache, UsageRecorder
 from gui.network_codes import get_msisdn_ussd_info
 
 
@@ -72,6 +76,14 @@ NETREG_INTERVAL = 5 * 1000  # 5ms
 AUTH_TIMEOUT = 150          # 2.5m
 ENABLE_TIMEOUT = 2 * 60     # 2m
 REGISTER_TIMEOUT = 3 * 60   # 3m
+MONTH_CHECK_INTERVAL = 60   # 1m
+
+# properties set on every SIG_DIAL_STATS
+DIAL_STATS_PROPERTIES = ['rx_rate', 'tx_rate',
+                         'current_session_3g', 'current_session_2g',
+                         'current_session_total',
+                         'current_summed_3g', 'current_summed_2g',
+                         'current_summed_total']
 
 ONE_MB = 2 ** 20
 
@@ -126,7 +138,12 @@ class MainModel(Model):
             self.get_app_version(), self.get_core_version()))
 
         super(MainModel, self).__init__()
-        self.bus = dbus.SystemBus()
+        interval = int(config.get('preferences', 'stats_update_interval',
+                                  CFG_PREFS_DEFAULT_STATS_UPDATE_INTERVAL))
+        for name in DIAL_STATS_PROPERTIES:
+            self.set_property_throttle(name, interval)
+
+        self.bus = get_bus()
         self.obj = None
         self.conf = config
         # we have to break MVC here :P
@@ -148,6 +165,16 @@ class MainModel(Model):
         self.preferences_model = PreferencesModel()
         self.profiles_model = ProfilesModel(self)
         self.provider = UsageProvider(USAGE_DB)
+        self.usage_cache = UsageAggregateCache(self.provider)
+        self.rate_history = RateHistory()
+        interval = config.get('preferences', 'usage_journal_interval',
+                              CFG_PREFS_DEFAULT_USAGE_JOURNAL_INTERVAL)
+        self.usage_recorder = UsageRecorder(self.usage_cache,
+                                            interval=int(interval))
+        # account the traffic of a session that didn't finish cleanly
+        self.usage_recorder.replay()
+        self._usage_month = self.get_month(0)
+        timeout_add_seconds(MONTH_CHECK_INTERVAL, self._check_month_rollover)
         self._init_wader_object()
         # Per device
         self.card_manufacturer = None
@@ -218,6 +245,7 @@ class MainModel(Model):
         if not self.device:
             self._get_devices_cb([opath])
 
+    @batched
     def _device_removed_cb(self, opath):
         logger.info('Device with opath %s removed' % opath)
 
@@ -259,7 +287,9 @@ class MainModel(Model):
         return self.dialer_manager
 
     def quit(self, quit_cb):
+        # keep the traffic of an open connection for the next run and
         # close UsageProvider on exit
+        self.usage_recorder.flush()
         self.provider.close()
 
         def quit_eb(e):
@@ -718,16 +748,10 @@ class MainModel(Model):
             self.transfer_limit_exceeded = False
 
     def calc_month(self, offset):
-        v_3g = v_2g = 0
-
-        for item in self._get_month(offset):
-            if item.is_3g():
-                v_3g += item.total()
-            else:
-                v_2g += item.total()
-
-        return (v_3g, v_2g)
+        usage = self.usage_cache.get_month(self._get_month_date(offset))
+        return (usage.umts, usage.gprs)
 
+    @batched
     def calc_current_summed(self):
         self.current_summed_3g = \
             self._month_to_date_3g + self.current_session_3g
@@ -736,17 +760,33 @@ class MainModel(Model):
         self.current_summed_total = \
             self.current_summed_3g + self.current_summed_2g
 
+    @batched
     def zero_current_session(self):
         self.current_session_3g = 0
         self.current_session_2g = 0
         self.current_session_total = 0
 
+    @batched
     def txfr_current_summed_to_month_to_date(self):
         self._month_to_date_3g = self.current_summed_3g
         self._month_to_date_2g = self.current_summed_2g
         self.zero_current_session()
         self.calc_current_summed()
 
+    def _check_month_rollover(self):
+        month = self.get_month(0)
+        if month != self._usage_month:
+            logger.info("Usage month changed from %s to %s"
+                        % (self._usage_month, month))
+            self._usage_month = month
+            # the open segment has to be split before summing up the months
+            self.usage_recorder.check_boundary()
+            self.populate_last_month()
+            self.populate_curr_month()
+            self.check_transfer_limit()
+
+        return True
+
     def populate_last_month(self):
         self.last_month_name = self.get_month(-1)
         self.last_month_3g, self.last_month_2g = self.calc_month(-1)
@@ -764,37 +804,28 @@ class MainModel(Model):
         self.rx_bytes, self.tx_bytes = self.device.GetStats()
         self.rx_rate = self.tx_rate = 0
 
-        # the last values written to DB
-        self._last_time = self.start_time
-        self._last_rx = self.rx_bytes
-        self._last_tx = self.tx_bytes
+        self.usage_recorder.start(self.rx_bytes, self.tx_bytes,
+                                  self.is_3g_bearer,
+                                  self.start_time.replace(microsecond=0))
 
     def write_dial_stats(self, is_3g_bearer=None):
-        # Save data to the DB. Called on bearer change, connection tear down,
-        # or possibly day transition(future)
-
-        # nothing to write
-        if ((self._last_rx == self.rx_bytes) and
-            (self._last_tx == self.tx_bytes)):
-            return
+        # Save data to the DB. Called on bearer change and connection tear
+        # down, the recorder splits segments at day transitions by itself
 
         # coalesce writes
         if self.is_3g_bearer == is_3g_bearer:
             return
 
-        # before resetting the counters, we'll store the stats
-        now = datetime.datetime.utcnow()
-        self.provider.add_usage_item(self._last_time, now,
-                                     self.rx_bytes - self._last_rx,
-                                     self.tx_bytes - self._last_tx,
-                                     self.is_3g_bearer)
-        self._last_time = now
-        self._last_rx = self.rx_bytes
-        self._last_tx = self.tx_bytes
+        if is_3g_bearer is None:
+            self.usage_recorder.stop()
+        else:
+            self.usage_recorder.compact(is_3g_bearer)
 
+    @batched
     def on_dial_stats(self, stats):
         rx_bytes, tx_bytes = stats[:2]
         self.rx_rate, self.tx_rate = stats[2:]
+        self.rate_history.add(self.rx_rate, self.tx_rate)
         dx_rx_bytes = dx_tx_bytes = 0
 
         # sanitise txfr values - they have been known to go backwards :-)
@@ -807,6 +838,8 @@ class MainModel(Model):
             dx_tx_bytes = tx_bytes - self.tx_bytes
             self.tx_bytes = tx_bytes
 
+        self.usage_recorder.update(self.rx_bytes, self.tx_bytes)
+
         # total traffic
         dx_bytes = dx_rx_bytes + dx_tx_bytes
 
@@ -16,7 +16,6 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import dbus
 import gobject
 
 #from gtkmvc import ListStoreModel, Model
@@ -30,6 +29,7 @@ from gui.consts import (CFG_PREFS_DEFAULT_BROWSER,
                               CFG_PREFS_DEFAULT_EXIT_WITHOUT_CONFIRMATION,
                               CFG_PREFS_DEFAULT_SMS_VALIDITY,
                               CFG_PREFS_DEFAULT_SMS_CONFIRMATION)
+from gui.utils import get_bus
 
 PREF_TABS = ["PROFILES"]
 
@@ -59,7 +59,7 @@ class PreferencesModel(Model):
 
     def __init__(self):
         super(PreferencesModel, self).__init__()
-        self.bus = dbus.SystemBus()
+        self.bus = get_bus()
         self.conf = config
         self.load()
 
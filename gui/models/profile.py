@@ -32,6 +32,7 @@ from gui.config import config
 from gui.logger import logger
 from gui.profiles import manager
 from gui.translate import _
+from gui.utils import get_bus
 
 from gui.constx import (GUI_NETWORK_AUTH_ANY,
                               GUI_NETWORK_AUTH_PAP,
@@ -139,7 +140,7 @@ class ProfileModel(Model):
                     profile=None, imsi=None, network=None):
         super(ProfileModel, self).__init__()
 
-        self.bus = dbus.SystemBus()
+        self.bus = get_bus()
         self.manager = manager
         self.profile = profile
 
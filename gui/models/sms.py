@@ -22,9 +22,11 @@ from gobject import TYPE_PYOBJECT, TYPE_STRING
 
 from gui.contrib.gtkmvc import ListStoreModel
 
-from gui.consts import TV_SMS_NUMBER, TV_SMS_OBJ
+from gui.consts import TV_SMS_TEXT, TV_SMS_NUMBER, TV_SMS_DATE, TV_SMS_OBJ
 from gui.images import MOBILE_IMG, COMPUTER_IMG
-from gui.messages import is_sim_message
+from gui.messages import is_sim_message, get_message_key
+from gui.phonebook import get_contacts_index
+from gui.utils import column_differs
 
 
 class SMSStoreModel(ListStoreModel):
@@ -40,6 +42,8 @@ class SMSStoreModel(ListStoreModel):
             TYPE_STRING, TYPE_STRING, TYPE_PYOBJECT, TYPE_PYOBJECT)
         self._callable = _callable
         self.device = None
+        # kept in sync with the rows, get_message_key -> message
+        self.messages = {}
 
     def add_messages(self, messages, contacts=None):
         """
@@ -47,27 +51,18 @@ class SMSStoreModel(ListStoreModel):
 
         See L{add_message} docs
         """
+        index = get_contacts_index(contacts)
         for sms in messages:
-            self.add_message(sms, contacts)
+            self.add_message(sms, index)
 
-    def _make_entry(self, message, contacts):
+    def _make_entry(self, message, index):
         if is_sim_message(message):
             entry = [MOBILE_IMG, message.text.split('\n')[0]]
         else:
             entry = [COMPUTER_IMG, message.text.split('\n')[0]]
 
-        if contacts or contacts == []:
-            # this is only used at startup received as the return value
-            # of sconn.get_all_contacts(), an unmodified fresh copy of all
-            # the contacts, we use it instead of doing a lookup for each
-            # contact
-            match = [contact.name for contact in contacts
-                            if message.number == contact.get_number()]
-            if match:
-                entry.append(match[0])
-            else:
-                entry.append(message.number)
-
+        if index is not None:
+            entry.append(index.lookup_name(message.number, message.number))
         else: # no contacts received
             entry.append(message.number)
 
@@ -82,43 +77,116 @@ class SMSStoreModel(ListStoreModel):
 
         Whenever a new message is inserted, I lookup the number on the
         phonebook and will show the name instead of the number if its a
-        contact. As this can be really expensive for mass insertions, such as
-        during startup, it also accepts a list of contacts to save the lookup.
+        contact. C{contacts} can be a list of contacts or, preferably for
+        mass insertions, a L{gui.phonebook.ContactNumberIndex} that is
+        reused for every message.
 
         @type message: L{wader.common.sms.ShortMessage}
-        @type contacts: list
+        @type contacts: list or L{gui.phonebook.ContactNumberIndex}
         """
 
-        entry = self._make_entry(message, contacts)
+        entry = self._make_entry(message, get_contacts_index(contacts))
         self.append(entry)
+        self.messages[get_message_key(message)] = message
 
     def update_message(self, _iter, message, contacts=None):
         """
         Updates the existing row specified by C{_iter} with the C{message}
         """
 
-        entry = self._make_entry(message, contacts)
+        self._unindex(self.get_value(_iter, TV_SMS_OBJ))
+        entry = self._make_entry(message, get_contacts_index(contacts))
         for column in range(len(entry)):
             self.set_value(_iter, column, entry[column])
+        self.messages[get_message_key(message)] = message
+
+    def reconcile(self, messages, contacts=None):
+        """
+        Updates the store in place so it holds C{messages}
+
+        Rows are matched on L{gui.messages.get_message_key}, the ones that
+        are no longer present are removed and the ones whose text, sender or
+        date changed are updated in place, so selection and scroll position
+        survive. The messages that are not in the store yet are returned to
+        let the caller decide how to add them.
+        """
+        index = get_contacts_index(contacts)
+
+        wanted = {}
+        for sms in messages:
+            wanted.setdefault(get_message_key(sms), sms)
+
+        seen = set()
+        _iter = self.get_iter_first()
+        while _iter:
+            _next = self.iter_next(_iter)
+            key = get_message_key(self.get_value(_iter, TV_SMS_OBJ))
+            new = wanted.get(key)
+            if new is None or key in seen:
+                self.remove(_iter)
+            else:
+                seen.add(key)
+                self._update_changed_columns(_iter, new, index)
+            _iter = _next
+
+        ret = []
+        for sms in messages:
+            key = get_message_key(sms)
+            if key not in seen:
+                seen.add(key)
+                ret.append(sms)
+        return ret
+
+    def _update_changed_columns(self, _iter, message, index):
+        # we keep the old object if nothing visible changed, it might have
+        # been annotated (i.e. status_reference) after being stored
+        entry = self._make_entry(message, index)
+        changed = False
+        for column in (TV_SMS_TEXT, TV_SMS_NUMBER, TV_SMS_DATE):
+            if column_differs(self.get_value(_iter, column), entry[column]):
+                self.set_value(_iter, column, entry[column])
+                changed = True
+
+        if changed:
+            self.set_value(_iter, TV_SMS_OBJ, message)
+            self.messages[get_message_key(message)] = message
+
+    def _unindex(self, message):
+        key = get_message_key(message)
+        if self.messages.get(key) is message:
+            del self.messages[key]
+
+    def remove(self, _iter):
+        """Removes the row pointed by C{_iter} and unindexes its message"""
+        self._unindex(self.get_value(_iter, TV_SMS_OBJ))
+        return super(SMSStoreModel, self).remove(_iter)
+
+    def clear(self):
+        self.messages = {}
+        super(SMSStoreModel, self).clear()
+
+    def get_message_by_key(self, key):
+        """
+        Returns the message of L{gui.messages.get_message_key} C{key} in
+        the store, or None
+        """
+        return self.messages.get(key)
 
     def update_contacts(self, contacts):
         """
         Iterates through the liststore updating the contacts
         """
 
-        if not contacts:
+        index = get_contacts_index(contacts)
+        if index is None:
             return
 
         _iter = self.get_iter_first()
         while _iter:
             message = self.get_value(_iter, TV_SMS_OBJ)
-
-            match = [contact.name for contact in contacts
-                            if message.number == contact.get_number()]
-            if match:
-                self.set_value(_iter, TV_SMS_NUMBER, match[0])
-            else:
-                self.set_value(_iter, TV_SMS_NUMBER, message.number)
+            name = index.lookup_name(message.number, message.number)
+            if self.get_value(_iter, TV_SMS_NUMBER) != name:
+                self.set_value(_iter, TV_SMS_NUMBER, name)
 
             _iter = self.iter_next(_iter)
 
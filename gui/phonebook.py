@@ -19,9 +19,22 @@
 phonebook presents a uniform layer to deal with contacts from all sources
 """
 
+import threading
+
+from gobject import idle_add, timeout_add_seconds, source_remove
+
 from gui.contacts import supported_types
 # just for now, we'll interrogate later
 from gui.contacts.contact_sim import SIMContactsManager
+from gui.logger import logger
+
+# numbers with at least this many digits are also matched on their tail, so
+# that '+34 600 123 456', '0034600123456' and '600123456' are all the same
+NUMBER_SUFFIX_LEN = 9
+
+# seconds a contacts source has to deliver before its previous contacts
+# are used instead
+SOURCE_TIMEOUT = 15
 
 
 def all_same_type(l):
@@ -42,6 +55,158 @@ def all_contacts_writable(l):
     return True
 
 
+def normalize_number(number):
+    """
+    Returns C{number} without any formatting characters
+
+    An international '00' prefix is rewritten as '+' so both notations
+    of the same E.164 number normalize to the same string
+    """
+    if not number:
+        return ''
+
+    digits = ''.join([c for c in number if c.isdigit()])
+    if number.lstrip().startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    return digits
+
+
+def number_suffix(number):
+    """
+    Returns the last L{NUMBER_SUFFIX_LEN} digits of normalized C{number}
+
+    Short numbers (service codes, etc) return None as they can't be
+    matched reliably by their tail
+    """
+    digits = number.lstrip('+')
+    if len(digits) < NUMBER_SUFFIX_LEN:
+        return None
+    return digits[-NUMBER_SUFFIX_LEN:]
+
+
+class ContactNumberIndex(object):
+    """
+    I map phone numbers to contacts in O(1)
+
+    Numbers are normalized before being stored, an exact lookup is tried
+    first and, if it fails, the lookup falls back to the last
+    L{NUMBER_SUFFIX_LEN} digits so that national and international
+    notations of the same number still match
+    """
+
+    def __init__(self, contacts=None):
+        self._exact = {}
+        self._suffix = {}
+        if contacts:
+            for contact in contacts:
+                self.add(contact)
+
+    def __len__(self):
+        return sum([len(l) for l in self._exact.itervalues()])
+
+    def _add_to(self, table, key, contact):
+        if key:
+            table.setdefault(key, []).append(contact)
+
+    def _remove_from(self, table, key, contact):
+        bucket = table.get(key)
+        if not bucket:
+            return
+
+        for i, item in enumerate(bucket):
+            if item is contact:
+                del bucket[i]
+                break
+
+        if not bucket:
+            del table[key]
+
+    def add(self, contact, number=None):
+        """Indexes C{contact} under C{number} or its own number"""
+        if number is None:
+            number = contact.get_number()
+
+        key = normalize_number(number)
+        if not key:
+            return
+
+        self._add_to(self._exact, key, contact)
+        self._add_to(self._suffix, number_suffix(key), contact)
+
+    def remove(self, contact, number=None):
+        """Removes C{contact} indexed under C{number} or its own number"""
+        if number is None:
+            number = contact.get_number()
+
+        key = normalize_number(number)
+        if not key:
+            return
+
+        self._remove_from(self._exact, key, contact)
+        suffix = number_suffix(key)
+        if suffix:
+            self._remove_from(self._suffix, suffix, contact)
+
+    def update(self, contact, old_number):
+        """Reindexes C{contact} after its number changed from C{old_number}"""
+        self.remove(contact, old_number)
+        self.add(contact)
+
+    def clear(self):
+        self._exact.clear()
+        self._suffix.clear()
+
+    def lookup(self, number):
+        """Returns a list with the contacts that match C{number}"""
+        key = normalize_number(number)
+        if not key:
+            return []
+
+        match = self._exact.get(key)
+        if match:
+            return list(match)
+
+        suffix = number_suffix(key)
+        if suffix:
+            return list(self._suffix.get(suffix, []))
+
+        return []
+
+    def lookup_name(self, number, default=None):
+        """Returns the name of the first contact matching C{number}"""
+        match = self.lookup(number)
+        if match:
+            return match[0].get_name()
+        return default
+
+
+def get_contact_key(contact):
+    """
+    Returns a key that identifies C{contact} across refreshes
+
+    Backends that provide an index (SIM position, Evolution id) are keyed on
+    it, the rest fall back to their name and number
+    """
+    get_index = getattr(contact, 'get_index', None)
+    index = get_index() if get_index is not None else None
+    if index is not None:
+        return (type(contact).__name__, index)
+    return (type(contact).__name__, contact.get_name(), contact.get_number())
+
+
+def get_contacts_index(contacts):
+    """
+    Returns a L{ContactNumberIndex} for C{contacts}
+
+    C{contacts} can be None, a list of contacts or an already built index
+    """
+    if contacts is None or isinstance(contacts, ContactNumberIndex):
+        return contacts
+    return ContactNumberIndex(contacts)
+
+
 class Contact(object):
     """
     Generic object capable only of being initialised and returning
@@ -59,6 +224,81 @@ class Contact(object):
         return self.number
 
 
+class ContactsAggregator(object):
+    """
+    I collect the contacts of every source for L{PhoneBook.get_contacts_async}
+
+    Sources that need the device are asked over D-Bus while the rest run
+    in worker threads, if a worker doesn't deliver within C{timeout}
+    seconds the contacts of its previous fetch are used. Each source is
+    handed to C{partial_cb} with its contact class as soon as it is
+    available and C{cb} gets all of them, in L{supported_types} order,
+    once every source is done. If a device source fails C{eb} is called
+    instead of C{cb}.
+    """
+
+    def __init__(self, phonebook, cb, eb, partial_cb=None,
+                 timeout=SOURCE_TIMEOUT):
+        self.phonebook = phonebook
+        self.cb = cb
+        self.eb = eb
+        self.partial_cb = partial_cb
+        self.timeout = timeout
+        self.failed = False
+        self.results = {}
+        self.timeouts = {}
+        self.pending = set([mclass for cclass, mclass in supported_types])
+
+    def start(self):
+        for cclass, mclass in supported_types:
+            manager = mclass()
+            if manager.device_reqd():
+                # D-Bus calls time out on their own
+                manager.set_device(self.phonebook.device)
+                manager.get_contacts_async(
+                    lambda contacts, mclass=mclass:
+                        self.source_done(mclass, contacts),
+                    lambda failure, mclass=mclass:
+                        self.source_failed(mclass, failure))
+            else:
+                self.timeouts[mclass] = timeout_add_seconds(self.timeout,
+                                                    self._timeout_cb, mclass)
+                self.phonebook.fetch_in_thread(mclass, self.source_done)
+
+    def _timeout_cb(self, mclass):
+        logger.warn("Contacts source %s timed out" % mclass.__name__)
+        del self.timeouts[mclass]
+        self.source_done(mclass, self.phonebook.get_last_contacts(mclass))
+        return False
+
+    def source_failed(self, mclass, failure):
+        if mclass in self.pending:
+            self.pending.remove(mclass)
+            self.failed = True
+            self.eb(failure)
+
+    def source_done(self, mclass, contacts):
+        if mclass not in self.pending:
+            return  # timed out already
+
+        self.pending.remove(mclass)
+        source_id = self.timeouts.pop(mclass, None)
+        if source_id is not None:
+            source_remove(source_id)
+
+        self.results[mclass] = contacts
+        if self.partial_cb is not None:
+            for cclass, _mclass in supported_types:
+                if _mclass is mclass:
+                    self.partial_cb(cclass, contacts)
+
+        if not self.pending and not self.failed:
+            ret = []
+            for cclass, mclass in supported_types:
+                ret.extend(self.results[mclass])
+            self.cb(ret)
+
+
 class PhoneBook(object):
     """
     I manage all your contacts
@@ -69,6 +309,10 @@ class PhoneBook(object):
 
     def __init__(self, device=None):
         self.device = device
+        # manager class -> contacts of its last fetch
+        self._last_contacts = {}
+        # manager class -> callbacks waiting for its running worker
+        self._workers = {}
 
     def close(self):
         self.device = None
@@ -83,8 +327,13 @@ class PhoneBook(object):
             raise RuntimeError("Cannot handle DB contacts right now")
 
     def add_contacts(self, contacts, sim=False):
-        for contact in contacts:
-            self.add_contact(contact, sim)
+        if not sim:
+            # XXX: Fix DB contacts handling
+            raise RuntimeError("Cannot handle DB contacts right now")
+
+        manager = SIMContactsManager()
+        manager.set_device(self.device)
+        return [manager.add_contact(contact) for contact in contacts]
 
     def get_writable_types(self):
         ret = []
@@ -103,21 +352,54 @@ class PhoneBook(object):
             ret.extend(manager.get_contacts())
         return ret
 
-    def get_contacts_async(self, cb, eb):
-        sim_manager = SIMContactsManager()
-        sim_manager.set_device(self.device)
+    def get_contacts_async(self, cb, eb, partial_cb=None):
+        """
+        Gets the contacts of every source without blocking the main loop
 
-        def _cb(scontacts):
-            ret = scontacts
+        See L{ContactsAggregator} for C{cb}, C{eb} and C{partial_cb}
+        """
+        ContactsAggregator(self, cb, eb, partial_cb).start()
 
-            for cclass, mclass in supported_types:
-                manager = mclass()
-                if manager.device_reqd():  # SIM
-                    continue
-                ret.extend(manager.get_contacts())
-            cb(ret)
+    def get_last_contacts(self, mclass):
+        """Returns the contacts of the last fetch from C{mclass}"""
+        return self._last_contacts.get(mclass, [])
+
+    def fetch_in_thread(self, mclass, callback):
+        """
+        Fetches the contacts of C{mclass} in a worker thread
+
+        C{callback} is called from the main loop with C{mclass} and the
+        contacts. Only a worker per source runs at a time, callers that
+        arrive while it is running get its result.
+        """
+        if mclass in self._workers:
+            self._workers[mclass].append(callback)
+            return
+
+        self._workers[mclass] = [callback]
+
+        def run():
+            try:
+                contacts, error = mclass().get_contacts(), None
+            except Exception, e:
+                contacts, error = None, e
+            idle_add(self._worker_done, mclass, contacts, error)
+
+        worker = threading.Thread(target=run, name=mclass.__name__)
+        worker.setDaemon(True)
+        worker.start()
+
+    def _worker_done(self, mclass, contacts, error):
+        if error is not None:
+            logger.error("Can not get contacts from %s: %s"
+                         % (mclass.__name__, error))
+            contacts = self.get_last_contacts(mclass)
+        else:
+            self._last_contacts[mclass] = contacts
 
-        sim_manager.get_contacts_async(_cb, eb)
+        for callback in self._workers.pop(mclass):
+            callback(mclass, contacts)
+        return False
 
     def delete_objs(self, objs):
         return self.delete_contacts(objs)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Incremental treeview population from the GLib idle loop
+"""
+
+from time import time
+
+import gobject
+
+# rows inserted per idle callback at most
+CHUNK_SIZE = 100
+# seconds an idle callback may spend inserting rows, a 60Hz frame is 16ms
+# so leave some room for the rest of the main loop
+TIME_BUDGET = 0.010
+# below this many rows it's cheaper to insert them straight away than to
+# detach the treeview and go through the idle loop
+DIRECT_INSERT_MAX = 50
+
+# GTK_TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, not exported by PyGTK
+UNSORTED_SORT_COLUMN_ID = -2
+
+
+class TreeviewPopulator(object):
+    """
+    I fill treeviews with rows in chunks from an idle source
+
+    Every treeview gets its model detached and its sorting disabled while
+    the rows are being inserted, once all the jobs are done the models are
+    reattached and sorted only once. Jobs are processed in the order they
+    were added, so a job can rely on the results of the previous ones.
+    """
+
+    def __init__(self, done_cb=None, progress_cb=None,
+                 chunk_size=CHUNK_SIZE, budget=TIME_BUDGET):
+        self.done_cb = done_cb
+        self.progress_cb = progress_cb
+        self.chunk_size = chunk_size
+        self.budget = budget
+
+        self.jobs = []
+        self.detached = []  # [(treeview, model, (sort_column, order))]
+        self.total = 0
+        self.done = 0
+        self.source_id = None
+
+    def add_job(self, treeview, items, add_func):
+        """
+        Schedules C{add_func(item)} for every item in C{items}
+
+        C{add_func} is expected to append the row to C{treeview}'s model
+        """
+        items = list(items)
+        self.total += len(items)
+        self.jobs.append((treeview, iter(items), add_func))
+
+    def get_model(self, treeview):
+        """Returns C{treeview}'s model even if it's currently detached"""
+        for _treeview, model, sort in self.detached:
+            if _treeview is treeview:
+                return model
+        return treeview.get_model()
+
+    def is_running(self):
+        return self.source_id is not None
+
+    def start(self):
+        for treeview, items, add_func in self.jobs:
+            self._detach(treeview)
+
+        self.source_id = gobject.idle_add(self._process_chunk)
+
+    def cancel(self):
+        if self.source_id is not None:
+            gobject.source_remove(self.source_id)
+        self._finish(notify=False)
+
+    def _detach(self, treeview):
+        for _treeview, model, sort in self.detached:
+            if _treeview is treeview:
+                return
+
+        model = treeview.get_model()
+        sort = model.get_sort_column_id()
+        if sort[0] is not None:
+            model.set_sort_column_id(UNSORTED_SORT_COLUMN_ID,
+                                     sort[1] or 0)
+
+        treeview.set_model(None)
+        self.detached.append((treeview, model, sort))
+
+    def _reattach(self):
+        while self.detached:
+            treeview, model, sort = self.detached.pop(0)
+            if sort[0] is not None:
+                model.set_sort_column_id(*sort)
+            treeview.set_model(model)
+
+    def _process_chunk(self):
+        deadline = time() + self.budget
+        count = 0
+
+        while self.jobs:
+            treeview, items, add_func = self.jobs[0]
+            try:
+                item = items.next()
+            except StopIteration:
+                self.jobs.pop(0)
+                continue
+
+            add_func(item)
+            self.done += 1
+            count += 1
+
+            if count >= self.chunk_size or time() >= deadline:
+                if self.progress_cb is not None:
+                    self.progress_cb(self.done, self.total)
+                return True
+
+        self._finish()
+        return False
+
+    def _finish(self, notify=True):
+        self.source_id = None
+        self.jobs = []
+        self._reattach()
+
+        if notify and self.done_cb is not None:
+            self.done_cb()
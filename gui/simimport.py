@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Bulk import of contacts to the SIM
+"""
+
+import re
+
+from gui.contacts.contact_sim import SIMContactsManager
+from gui.logger import logger
+from gui.phonebook import normalize_number
+from gui.translate import _
+from gui.utils import get_error_msg
+
+# Add calls waiting for their reply at most, the device serializes them
+# anyway but this keeps it busy while the replies travel back
+IMPORT_WINDOW = 4
+
+NUMBER_SEPARATORS_RE = re.compile(r'[\s\-().]')
+VALID_NUMBER_RE = re.compile(r'^\+?[0-9*#pPwW]+$')
+
+
+def get_import_key(name, number):
+    """Returns the key of a contact for duplicate detection"""
+    return name.strip().lower(), normalize_number(number)
+
+
+def clean_row(contact):
+    """
+    Returns the C{(name, number)} to store for C{contact}
+
+    Raises ValueError with the reason if the row can't be imported
+    """
+    name = contact.get_name().strip()
+    if not name:
+        raise ValueError(_("The name is empty"))
+
+    number = NUMBER_SEPARATORS_RE.sub('', contact.get_number())
+    if not VALID_NUMBER_RE.match(number):
+        raise ValueError(_("Invalid number"))
+
+    return name, number
+
+
+class SIMImporter(object):
+    """
+    I import a list of contacts to the SIM
+
+    The rows are validated and compared with the contacts already in the
+    SIM first, then the rest are added asynchronously with at most
+    C{window} requests in flight.
+
+    C{progress_cb} gets the number of rows done and the total,
+    C{failed_cb} the row number (starting at 1), the contact and the
+    reason of every row that couldn't be imported. C{done_cb} gets the
+    list of L{SIMContact}s added, the number of duplicates skipped,
+    whether the import was cancelled and the error that aborted it, if
+    the SIM contacts couldn't be listed (None otherwise).
+    """
+
+    def __init__(self, device, contacts, window=IMPORT_WINDOW,
+                 progress_cb=None, failed_cb=None, done_cb=None):
+        self.manager = SIMContactsManager()
+        self.manager.set_device(device)
+        self.contacts = contacts
+        self.window = window
+        self.progress_cb = progress_cb
+        self.failed_cb = failed_cb
+        self.done_cb = done_cb
+
+        self.queue = []  # [(row, contact, name, number)] in reverse order
+        self.added = []
+        self.skipped = 0
+        self.in_flight = 0
+        self.done = 0
+        self.total = 0
+        self.cancelled = False
+        self.finished = False
+        self.error = None
+
+    def start(self):
+        self.manager.get_contacts_async(self._existing_cb, self._existing_eb)
+
+    def cancel(self):
+        """Stops issuing requests, the ones in flight are still awaited"""
+        self.cancelled = True
+        self.queue = []
+        self._check_finished()
+
+    def _existing_eb(self, error):
+        # without the SIM contacts there is no way to skip duplicates,
+        # so nothing is added
+        logger.error("Can not list SIM contacts: %s" % error)
+        self.error = error
+        self.queue = []
+        self._check_finished()
+
+    def _existing_cb(self, existing):
+        if self.cancelled:
+            return
+
+        seen = set([get_import_key(c.get_name(), c.get_number())
+                    for c in existing])
+
+        for row, contact in enumerate(self.contacts):
+            try:
+                name, number = clean_row(contact)
+            except ValueError, e:
+                self._failed(row + 1, contact, e.args[0])
+                continue
+
+            key = get_import_key(name, number)
+            if key in seen:
+                self.skipped += 1
+                continue
+
+            seen.add(key)
+            self.queue.append((row + 1, contact, name, number))
+
+        self.queue.reverse()
+        self.total = len(self.queue)
+        self._progress()
+        self._fill()
+
+    def _fill(self):
+        while self.queue and self.in_flight < self.window:
+            row, contact, name, number = self.queue.pop()
+            self.in_flight += 1
+            self.manager.add_contact_async(name, number,
+                lambda added, row=row, contact=contact:
+                    self._added_cb(row, contact, added),
+                lambda error, row=row, contact=contact:
+                    self._added_eb(row, contact, error))
+
+        self._check_finished()
+
+    def _added_cb(self, row, contact, added):
+        if added is None:
+            self._failed(row, contact, _("The SIM refused the contact"))
+        else:
+            self.added.append(added)
+        self._request_done()
+
+    def _added_eb(self, row, contact, error):
+        logger.error("Can not add row %d to the SIM: %s" % (row, error))
+        self._failed(row, contact, get_error_msg(error))
+        self._request_done()
+
+    def _request_done(self):
+        self.in_flight -= 1
+        self.done += 1
+        self._progress()
+        self._fill()
+
+    def _failed(self, row, contact, reason):
+        if self.failed_cb is not None:
+            self.failed_cb(row, contact, reason)
+
+    def _progress(self):
+        if self.progress_cb is not None:
+            self.progress_cb(self.done, self.total)
+
+    def _check_finished(self):
+        if self.finished or self.queue or self.in_flight:
+            return
+
+        self.finished = True
+        if self.done_cb is not None:
+            self.done_cb(self.added, self.skipped, self.cancelled,
+                         self.error)
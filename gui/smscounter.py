@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Incremental length and segment count of an SMS being written
+"""
+
+from messaging.sms.consts import (SEVENBIT_SIZE, UCS2_SIZE,
+                                  SEVENBIT_MP_SIZE, UCS2_MP_SIZE)
+
+# GSM 03.38 default alphabet, without the escape to the extension table
+GSM_BASIC = frozenset(u"@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./"
+                      u"0123456789:;<=>?¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿"
+                      u"abcdefghijklmnopqrstuvwxyzäöñüà")
+# GSM 03.38 extension table, every char takes an escape septet too
+GSM_EXTENDED = frozenset(u"\x0c^{}\\[~]|€")
+
+
+class SMSCounter(object):
+    """
+    I keep the length of an SMS text as it is edited
+
+    Only the inserted and deleted text is looked at, so the cost of an
+    edit doesn't depend on the length of the message. The text is sent
+    as GSM 7-bit while all of its chars are in the GSM alphabet, where
+    the extension chars take two septets, and as UCS2 otherwise, where
+    the chars outside the BMP take two code units.
+    """
+
+    def __init__(self, text=u''):
+        self.reset(text)
+
+    def reset(self, text=u''):
+        self.chars = 0
+        self.septets = 0
+        self.units = 0
+        self.non_gsm = 0
+        self.insert(text)
+
+    def _count(self, text):
+        septets = units = non_gsm = 0
+        for c in text:
+            if c in GSM_BASIC:
+                septets += 1
+            elif c in GSM_EXTENDED:
+                septets += 2
+            else:
+                non_gsm += 1
+
+            if ord(c) > 0xffff:
+                units += 2
+            else:
+                units += 1
+
+        return len(text), septets, units, non_gsm
+
+    def insert(self, text):
+        """Accounts for C{text} being added to the message"""
+        chars, septets, units, non_gsm = self._count(text)
+        self.chars += chars
+        self.septets += septets
+        self.units += units
+        self.non_gsm += non_gsm
+
+    def delete(self, text):
+        """Accounts for C{text} being removed from the message"""
+        chars, septets, units, non_gsm = self._count(text)
+        self.chars -= chars
+        self.septets -= septets
+        self.units -= units
+        self.non_gsm -= non_gsm
+
+    def is_gsm(self):
+        """Returns True if the message can be sent with the GSM alphabet"""
+        return not self.non_gsm
+
+    def get_length(self):
+        """Returns the length of the message in septets or UCS2 units"""
+        if self.is_gsm():
+            return self.septets
+        return self.units
+
+    def get_segment_size(self):
+        """Returns the capacity of every segment of the message"""
+        if self.is_gsm():
+            single, multi = SEVENBIT_SIZE, SEVENBIT_MP_SIZE
+        else:
+            single, multi = UCS2_SIZE, UCS2_MP_SIZE
+
+        if self.get_length() <= single:
+            return single
+        return multi
+
+    def get_segments(self):
+        """Returns the number of SMS needed to send the message"""
+        length = self.get_length()
+        size = self.get_segment_size()
+        return max(1, (length + size - 1) // size)
+
+    def get_used(self):
+        """Returns the length used in the last segment"""
+        return self.get_length() - \
+                    self.get_segment_size() * (self.get_segments() - 1)
+
+    def get_remaining(self):
+        """Returns the length left in the last segment"""
+        return self.get_segment_size() - self.get_used()
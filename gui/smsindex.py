@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Full-text search index of the SMS history
+
+The index lives in its own SQLite DB next to the messages DB. It uses
+the FTS4 or FTS3 extension when SQLite has been built with it and falls
+back to a plain term table otherwise. Either way the text is folded and
+tokenized here, so every engine matches the same words.
+"""
+
+import calendar
+from datetime import date, timedelta
+import hashlib
+import re
+import time
+import unicodedata
+
+import gobject
+
+try:
+    import sqlite3
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite3
+
+from gui.consts import SMS_INDEX_DB
+from gui.logger import logger
+from gui.messages import get_message_key
+from gui.phonebook import normalize_number, number_suffix
+
+SCHEMA_VERSION = '1'
+# results returned by a query at most
+MAX_RESULTS = 500
+# messages checked per iteration of a scheduled sync
+SYNC_BATCH_SIZE = 500
+
+TOKEN_RE = re.compile(r'[^\W_]+', re.UNICODE)
+QUERY_RE = re.compile(r'(?:(\w+):)?(?:"([^"]*)"?|(\S+))', re.UNICODE)
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m', '%Y']
+
+SENDER_FILTERS = ['from', 'to']
+SINCE_FILTERS = ['after', 'since']
+BEFORE_FILTERS = ['before']
+UNTIL_FILTERS = ['until']
+
+_index = None
+_sync_source = None
+
+
+def fold(text):
+    """Returns C{text} lower-cased and without diacritics"""
+    text = unicodedata.normalize('NFKD', text)
+    return u''.join([c for c in text
+                        if not unicodedata.combining(c)]).lower()
+
+
+def tokenize(text):
+    """Returns the list of folded words of C{text}"""
+    return TOKEN_RE.findall(fold(text))
+
+
+def _to_timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def _parse_date(text):
+    """
+    Returns the local timestamps of the start and the end of the day,
+    month or year given by C{text}
+    """
+    for fmt in DATE_FORMATS:
+        try:
+            tm = time.strptime(text, fmt)
+        except ValueError:
+            continue
+
+        start = date(tm.tm_year, tm.tm_mon, tm.tm_mday)
+        if fmt == '%Y-%m-%d':
+            end = start + timedelta(days=1)
+        elif fmt == '%Y-%m':
+            end = date(start.year + start.month // 12,
+                       start.month % 12 + 1, 1)
+        else:
+            end = date(start.year + 1, 1, 1)
+
+        return (int(time.mktime(start.timetuple())),
+                int(time.mktime(end.timetuple())))
+
+    raise ValueError("Invalid date: %s" % text)
+
+
+def _key_to_str(key):
+    return '%s:%d' % key
+
+
+def _str_to_key(text):
+    storage, index = text.split(':')
+    return storage, int(index)
+
+
+class SearchQuery(object):
+    """
+    A parsed search query
+
+    Plain words must all appear in the text, a word ending in C{*}
+    matches any word starting with it and a quoted text matches the
+    words in that order. C{from:} (or C{to:}) restricts the results to
+    a number and C{after:} and C{before:} to a date range given as
+    YYYY-MM-DD, YYYY-MM or YYYY. The C{after:} (or C{since:}) date is
+    included and the C{before:} one is not, C{until:} includes it.
+
+    Senders that are not numbers are passed to C{resolve_sender}, which
+    should return the list of numbers of the contacts matching it.
+    """
+
+    def __init__(self, text, resolve_sender=None):
+        self.terms = []
+        self.prefixes = []
+        self.phrases = []
+        self.numbers = []
+        self.since = None
+        self.until = None
+        self.parse(text, resolve_sender)
+
+    def parse(self, text, resolve_sender):
+        for name, phrase, word in QUERY_RE.findall(text):
+            name = name.lower()
+            value = phrase or word
+
+            if name in SENDER_FILTERS and value:
+                self._add_sender(value, resolve_sender)
+            elif name in SINCE_FILTERS and value:
+                self.since = _parse_date(value)[0]
+            elif name in BEFORE_FILTERS and value:
+                self.until = _parse_date(value)[0]
+            elif name in UNTIL_FILTERS and value:
+                self.until = _parse_date(value)[1]
+            else:
+                if name:
+                    value = name + u' ' + value
+                self._add_text(value, phrase != '', word.endswith('*'))
+
+    def _add_sender(self, value, resolve_sender):
+        if [c for c in value if c.isdigit()]:
+            numbers = [value]
+        elif resolve_sender is not None:
+            # no contact by that name matches nothing
+            numbers = resolve_sender(value) or [u'']
+        else:
+            numbers = [u'']
+
+        self.numbers.extend([normalize_number(n) for n in numbers])
+
+    def _add_text(self, value, is_phrase, is_prefix):
+        tokens = tokenize(value)
+        if not tokens:
+            return
+
+        if is_phrase and len(tokens) > 1:
+            self.phrases.append(tokens)
+        elif is_prefix:
+            self.terms.extend(tokens[:-1])
+            self.prefixes.append(tokens[-1])
+        elif len(tokens) > 1:
+            # "can't" and the like are searched as a phrase
+            self.phrases.append(tokens)
+        else:
+            self.terms.extend(tokens)
+
+    def has_text(self):
+        return bool(self.terms or self.prefixes or self.phrases)
+
+    def is_empty(self):
+        return not (self.has_text() or self.numbers or
+                    self.since is not None or self.until is not None)
+
+    def get_match(self):
+        """Returns the FTS MATCH expression of the query"""
+        parts = list(self.terms)
+        parts.extend([p + u'*' for p in self.prefixes])
+        parts.extend([u'"%s"' % u' '.join(p) for p in self.phrases])
+        return u' '.join(parts)
+
+
+class SMSIndex(object):
+    """
+    I keep a full-text index of the SMS history in C{path}
+
+    Messages are identified by L{gui.messages.get_message_key}, L{sync}
+    only touches the entries that changed since the last call and
+    L{add_messages} and L{remove_messages} keep it up to date between
+    refreshes.
+    """
+
+    def __init__(self, path=SMS_INDEX_DB):
+        self.conn = sqlite3.connect(path)
+        self.engine = self._get_engine()
+        self._setup()
+
+    def close(self):
+        self.conn.close()
+
+    def _get_engine(self):
+        for engine in ['fts4', 'fts3']:
+            try:
+                self.conn.execute("CREATE VIRTUAL TABLE temp.probe "
+                                  "USING %s(body)" % engine)
+            except sqlite3.Error:
+                continue
+
+            self.conn.execute("DROP TABLE temp.probe")
+            return engine
+
+        return 'terms'
+
+    def _setup(self):
+        c = self.conn
+        c.execute("CREATE TABLE IF NOT EXISTS meta "
+                  "(name TEXT PRIMARY KEY, value TEXT)")
+        meta = dict(c.execute("SELECT name, value FROM meta"))
+        if meta == {'version': SCHEMA_VERSION, 'engine': self.engine}:
+            return
+
+        # new index, a different schema or SQLite lost the FTS extension,
+        # start from scratch and let the next sync fill it
+        logger.info("Creating the SMS index with %s" % self.engine)
+        for table in ['docs_fts', 'terms', 'docs']:
+            try:
+                c.execute("DROP TABLE IF EXISTS %s" % table)
+            except sqlite3.Error:
+                # an FTS table can't be dropped without the extension
+                logger.error("Can not drop the SMS index table %s" % table)
+
+        c.execute("CREATE TABLE docs (docid INTEGER PRIMARY KEY, "
+                  "key TEXT UNIQUE, sig TEXT, number TEXT, suffix TEXT, "
+                  "timestamp INTEGER, folder INTEGER, body TEXT)")
+        c.execute("CREATE INDEX docs_number ON docs (number)")
+        c.execute("CREATE INDEX docs_suffix ON docs (suffix)")
+        c.execute("CREATE INDEX docs_timestamp ON docs (timestamp)")
+
+        if self.engine == 'terms':
+            c.execute("CREATE TABLE terms (term TEXT, docid INTEGER)")
+            c.execute("CREATE INDEX terms_term ON terms (term, docid)")
+            c.execute("CREATE INDEX terms_docid ON terms (docid)")
+        else:
+            c.execute("CREATE VIRTUAL TABLE docs_fts USING %s(body)" %
+                      self.engine)
+
+        c.execute("DELETE FROM meta")
+        c.executemany("INSERT INTO meta VALUES (?, ?)",
+                      [('version', SCHEMA_VERSION), ('engine', self.engine)])
+        c.commit()
+
+    def _get_sig(self, sms):
+        # cheap enough to be computed for the whole history on a sync
+        data = u'%s\0%s\0%s\0%s' % (sms.number, sms.datetime.isoformat(),
+                    getattr(sms, 'where', None), sms.text or u'')
+        return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+    def _get_entry(self, sms, key=None, sig=None):
+        if key is None:
+            key = _key_to_str(get_message_key(sms))
+        if sig is None:
+            sig = self._get_sig(sms)
+        return (key, sig, normalize_number(sms.number),
+                _to_timestamp(sms.datetime),
+                getattr(sms, 'where', None) or 1, sms.text or u'')
+
+    def _insert(self, entry):
+        key, sig, number, timestamp, folder, text = entry
+        tokens = tokenize(text)
+        cursor = self.conn.execute("INSERT INTO docs (key, sig, number, "
+                    "suffix, timestamp, folder, body) VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?)", (key, sig, number,
+                    number_suffix(number), timestamp, folder,
+                    u' '.join(tokens)))
+        docid = cursor.lastrowid
+
+        if self.engine == 'terms':
+            self.conn.executemany("INSERT INTO terms VALUES (?, ?)",
+                                  [(t, docid) for t in set(tokens)])
+        else:
+            self.conn.execute("INSERT INTO docs_fts (docid, body) "
+                              "VALUES (?, ?)", (docid, u' '.join(tokens)))
+
+    def _delete(self, key):
+        row = self.conn.execute("SELECT docid FROM docs WHERE key = ?",
+                                (key,)).fetchone()
+        if row is None:
+            return False
+
+        if self.engine == 'terms':
+            self.conn.execute("DELETE FROM terms WHERE docid = ?", row)
+        else:
+            self.conn.execute("DELETE FROM docs_fts WHERE docid = ?", row)
+        self.conn.execute("DELETE FROM docs WHERE docid = ?", row)
+        return True
+
+    def add_messages(self, messages):
+        """Indexes C{messages}, replacing the entries of the same keys"""
+        for sms in messages:
+            entry = self._get_entry(sms)
+            row = self.conn.execute("SELECT sig FROM docs WHERE key = ?",
+                                    (entry[0],)).fetchone()
+            if row is not None:
+                if row[0] == entry[1]:
+                    continue
+                self._delete(entry[0])
+            self._insert(entry)
+
+        self.conn.commit()
+
+    def remove_messages(self, messages):
+        """Removes C{messages} from the index"""
+        for sms in messages:
+            self._delete(_key_to_str(get_message_key(sms)))
+
+        self.conn.commit()
+
+    def iter_sync(self, messages, batch_size=SYNC_BATCH_SIZE):
+        """
+        Makes the index hold exactly C{messages}, as a generator
+
+        It yields after every C{batch_size} messages, with the changes so
+        far committed, and finally yields the number of entries added and
+        removed. Entries added meanwhile are kept, as only the ones
+        present when it started are removed
+        """
+        indexed = dict(self.conn.execute("SELECT key, sig FROM docs"))
+
+        added = 0
+        for i, sms in enumerate(messages):
+            if i and not i % batch_size:
+                self.conn.commit()
+                yield None
+
+            key = _key_to_str(get_message_key(sms))
+            sig = self._get_sig(sms)
+            old_sig = indexed.pop(key, None)
+            if old_sig == sig:
+                continue
+            if old_sig is not None:
+                self._delete(key)
+            self._insert(self._get_entry(sms, key, sig))
+            added += 1
+
+        for key in indexed:
+            self._delete(key)
+
+        self.conn.commit()
+        yield added, len(indexed)
+
+    def sync(self, messages):
+        """
+        Makes the index hold exactly C{messages}
+
+        Returns the number of entries added and removed
+        """
+        for result in self.iter_sync(messages):
+            pass
+        return result
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Returns the keys of the messages matching C{query}, newest first
+
+        C{query} is a L{SearchQuery}
+        """
+        if query.is_empty():
+            return []
+
+        sql = ["SELECT docs.key FROM docs"]
+        where = []
+        args = []
+
+        if query.has_text():
+            if self.engine == 'terms':
+                self._add_terms_clauses(query, where, args)
+            else:
+                sql.append("JOIN docs_fts ON docs_fts.docid = docs.docid")
+                where.append("docs_fts MATCH ?")
+                args.append(query.get_match())
+
+        if query.numbers:
+            marks = ', '.join(['?'] * len(query.numbers))
+            suffixes = [number_suffix(n) for n in query.numbers]
+            where.append("(docs.number IN (%s) OR docs.suffix IN (%s))" %
+                         (marks, marks))
+            args.extend(query.numbers)
+            args.extend([s or u'' for s in suffixes])
+
+        if query.since is not None:
+            where.append("docs.timestamp >= ?")
+            args.append(query.since)
+        if query.until is not None:
+            where.append("docs.timestamp < ?")
+            args.append(query.until)
+
+        sql.append("WHERE " + " AND ".join(where))
+        sql.append("ORDER BY docs.timestamp DESC LIMIT ?")
+        args.append(limit)
+
+        return [_str_to_key(row[0])
+                    for row in self.conn.execute(' '.join(sql), args)]
+
+    def _add_terms_clauses(self, query, where, args):
+        selects = []
+        words = list(query.terms)
+        for phrase in query.phrases:
+            words.extend(phrase)
+
+        for word in set(words):
+            selects.append("SELECT docid FROM terms WHERE term = ?")
+            args.append(word)
+
+        for prefix in query.prefixes:
+            selects.append("SELECT docid FROM terms "
+                           "WHERE term >= ? AND term < ?")
+            args.extend([prefix, prefix + u'\uffff'])
+
+        where.append("docs.docid IN (%s)" % " INTERSECT ".join(selects))
+
+        # the terms only tell us the words are there, not their order
+        for phrase in query.phrases:
+            where.append("(' ' || docs.body || ' ') LIKE ?")
+            args.append(u'%% %s %%' % u' '.join(phrase))
+
+
+def get_sms_index():
+    """Returns the L{SMSIndex} shared by the whole application"""
+    global _index
+    if _index is None:
+        _index = SMSIndex()
+    return _index
+
+
+def schedule_sync(messages):
+    """
+    Syncs the shared index with C{messages} from a low priority idle source
+
+    Every iteration checks L{SYNC_BATCH_SIZE} messages, so the main loop
+    is never blocked for long. A sync that is still running is replaced
+    """
+    global _sync_source
+    if _sync_source is not None:
+        gobject.source_remove(_sync_source)
+
+    steps = get_sms_index().iter_sync(list(messages))
+
+    def sync_next():
+        global _sync_source
+        try:
+            result = steps.next()
+        except sqlite3.Error, e:
+            logger.error("Can not sync the SMS index: %s" % e)
+            _sync_source = None
+            return False
+
+        if result is None:
+            return True
+
+        logger.info("SMS index synced, %d entries added and %d removed"
+                    % result)
+        _sync_source = None
+        return False
+
+    _sync_source = gobject.idle_add(sync_next, priority=gobject.PRIORITY_LOW)
@@ -40,6 +40,10 @@ class StatsBar(gtk.Object):
         self.max_value = units_to_bytes(max_value, units)
         self.user_limit = units_to_bytes(user_limit, units)
 
+        # cached background, ticks and limits
+        self.static_layer = None
+        self.static_key = None
+
         self.drawingarea.connect('expose-event', self.on_expose)
         self.drawingarea.connect('screen-changed', self.on_screen_changed)
 
@@ -70,26 +74,20 @@ class StatsBar(gtk.Object):
         if not widget.window:
             return
 
+        x, y, width, height = widget.get_allocation()
+        inner_width = width * .75
+
         cr = widget.window.cairo_create()
-        if self.supports_alpha:
-            cr.set_source_rgba(1.0, 1.0, 1.0, 0.0)  # Transparent
-        else:
-            cr.set_source_rgb(1.0, 1.0, 1.0)        # Opaque white
+        area = event.area
+        cr.rectangle(area.x, area.y, area.width, area.height)
+        cr.clip()
 
-        # Draw the background
+        # Draw the background, ticks and limits
         cr.set_operator(cairo.OPERATOR_SOURCE)
+        cr.set_source_surface(self.get_static_layer(cr, width, height), 0, 0)
         cr.paint()
+        cr.set_operator(cairo.OPERATOR_OVER)
 
-        x, y, width, height = widget.get_allocation()
-        cr.set_source_rgba(.8, 0.8, 0.8, 0.4)
-
-        cr.rectangle(1.0, 1.0, width - 1.0, height - 1.0)
-        # Draw a rectangle (and fill background)
-        cr.fill()
-        #cr.stroke()
-
-        inner_width = width * .75
-        self.draw_limits(cr, inner_width, height)
         self.draw_usage(cr, inner_width, height)
         # Draw inner rectangle
         cr.set_line_width(.8)
@@ -103,6 +101,42 @@ class StatsBar(gtk.Object):
 
         return False
 
+    def get_static_layer(self, cr, width, height):
+        """
+        Returns a surface with everything that doesn't depend on the value
+
+        The surface is drawn once and reused until the size, the maximum
+        value or the user limit change
+        """
+        key = (width, height, self.max_value, self.user_limit,
+               self.supports_alpha)
+        if self.static_layer is not None and self.static_key == key:
+            return self.static_layer
+
+        surface = cr.get_target().create_similar(cairo.CONTENT_COLOR_ALPHA,
+                                                 width, height)
+        scr = cairo.Context(surface)
+        if self.supports_alpha:
+            scr.set_source_rgba(1.0, 1.0, 1.0, 0.0)  # Transparent
+        else:
+            scr.set_source_rgb(1.0, 1.0, 1.0)        # Opaque white
+
+        # Draw the background
+        scr.set_operator(cairo.OPERATOR_SOURCE)
+        scr.paint()
+        scr.set_operator(cairo.OPERATOR_OVER)
+
+        scr.set_source_rgba(.8, 0.8, 0.8, 0.4)
+        scr.rectangle(1.0, 1.0, width - 1.0, height - 1.0)
+        # Draw a rectangle (and fill background)
+        scr.fill()
+
+        self.draw_limits(scr, width * .75, height)
+
+        self.static_layer = surface
+        self.static_key = key
+        return surface
+
     def draw_limits(self, cr, inner_width, height):
         cr.set_source_rgba(1.0, 1.0, 1.0, 1.0)
         cr.set_line_width(.1)
@@ -170,17 +204,28 @@ class StatsBar(gtk.Object):
         return value / max_value
 
     def update(self):
-        assert self.max_value > self.value
-        self.drawingarea.emit('expose-event', gtk.gdk.Event(gtk.gdk.EXPOSE))
         self.drawingarea.queue_draw()
 
+    def _get_usage_top(self, height):
+        return height - (self._fraction() * height)
+
     def set_value(self, value):
         if value != self.value:
             if value >= self.max_value:
                 self.max_value = 1.25 * value + 1
+                self.value = value
+                self.update()
+                return
 
+            x, y, width, height = self.drawingarea.get_allocation()
+            old_top = self._get_usage_top(height)
             self.value = value
-            self.update()
+            new_top = self._get_usage_top(height)
+
+            # only the usage fill needs to be painted again
+            top = int(min(old_top, new_top)) - 1
+            self.drawingarea.queue_draw_area(4, top, int(width * .75) - 7,
+                                             height - top)
 
     def set_max_value(self, max_value):
         if max_value != self.max_value:
@@ -195,3 +240,101 @@ class StatsBar(gtk.Object):
             self.user_limit = user_limit
 
             self.update()
+
+
+class SparkLine(gtk.Object):
+    """
+    I draw the recent rx and tx rates of a L{gui.history.RateHistory}
+
+    Every sample takes a column, the newest one on the right. When new
+    samples arrive the window contents are scrolled and only the newly
+    exposed columns are painted.
+    """
+
+    def __init__(self, history, drawingarea=None):
+        self.history = history
+        self.drawingarea = gtk.DrawingArea() \
+            if drawingarea is None else drawingarea
+        # sequence number of the sample on the rightmost column
+        self.last_seq = history.get_count() - 1
+        # rate at the top of the widget
+        self.scale = 1
+
+        self.drawingarea.connect('expose-event', self.on_expose)
+
+    def DrawingArea(self):
+        return self.drawingarea
+
+    def _get_scale(self, width):
+        top = max(self.history.get_max(width), 1)
+        if top > self.scale or top < self.scale / 4:
+            # leave some headroom so the scale doesn't change every second
+            return top * 1.25
+        return self.scale
+
+    def update(self):
+        """Shows the samples added to the history since the last update"""
+        last_seq = self.history.get_count() - 1
+        new = last_seq - self.last_seq
+        if new <= 0:
+            return
+
+        self.last_seq = last_seq
+        window = self.drawingarea.window
+        if window is None:
+            return
+
+        x, y, width, height = self.drawingarea.get_allocation()
+        scale = self._get_scale(width)
+        if scale != self.scale or new >= width:
+            self.scale = scale
+            self.drawingarea.queue_draw()
+        else:
+            # the scrolled in strip is exposed by GDK
+            window.scroll(-new, 0)
+
+    def on_expose(self, widget, event):
+        if not widget.window:
+            return
+
+        x, y, width, height = widget.get_allocation()
+        area = event.area
+
+        cr = widget.window.cairo_create()
+        cr.rectangle(area.x, area.y, area.width, area.height)
+        cr.clip()
+
+        cr.set_source_rgb(1.0, 1.0, 1.0)
+        cr.paint()
+
+        first = area.x
+        last = min(area.x + area.width, width)
+        # one column to the left so the tx line joins the previous column
+        start = max(first - 1, 0)
+        seqs = [(column, self.last_seq - (width - 1 - column))
+                    for column in xrange(start, last)]
+        samples = [(column, self.history.get(seq)) for column, seq in seqs]
+        samples = [(column, sample) for column, sample in samples
+                        if sample is not None]
+
+        def y_for(rate):
+            return height - (float(rate) / self.scale) * (height - 1)
+
+        # rx rate as a filled area
+        cr.set_source_rgba(0.7, 0.7, 0.7, 0.9)
+        for column, (rx, tx) in samples:
+            if column >= first:
+                cr.rectangle(column, y_for(rx), 1, height)
+        cr.fill()
+
+        # tx rate as a line
+        cr.set_source_rgba(0.8, 0.0, 0.0, 0.8)
+        cr.set_line_width(1.0)
+        for i, (column, (rx, tx)) in enumerate(samples):
+            if i == 0:
+                cr.move_to(column + 0.5, y_for(tx))
+            else:
+                cr.line_to(column + 0.5, y_for(tx))
+        cr.stroke()
+
+        return False
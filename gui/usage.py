@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011  Vodafone España, S.A.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Usage accounting helpers
+"""
+
+import os
+import time
+import calendar
+import datetime
+import struct
+
+from gobject import timeout_add_seconds, source_remove
+
+from gui.consts import (USAGE_DB, USAGE_CACHE, USAGE_JOURNAL,
+                        CFG_PREFS_DEFAULT_USAGE_JOURNAL_INTERVAL)
+from gui.logger import logger
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+CACHE_VERSION = '1'
+# the SQLite header holds a file change counter at this offset
+SQLITE_COUNTER_OFFSET = 24
+
+
+def month_key(date):
+    """Returns the C{(year, month)} tuple C{date} belongs to"""
+    return (date.year, date.month)
+
+
+def _format_time(t):
+    if t is None:
+        return '-'
+    return t.strftime(TIME_FORMAT)
+
+
+def _parse_time(s):
+    if s == '-':
+        return None
+    return datetime.datetime.strptime(s, TIME_FORMAT)
+
+
+class MonthUsage(object):
+    """
+    I hold the aggregated usage of a month
+
+    Totals are in bytes, C{first} and C{last} are the UTC start time of the
+    first segment and the UTC end time of the last one
+    """
+
+    def __init__(self, umts=0, gprs=0, count=0, first=None, last=None):
+        self.umts = umts
+        self.gprs = gprs
+        self.count = count
+        self.first = first
+        self.last = last
+
+    def add(self, start, end, total, is_3g):
+        if is_3g:
+            self.umts += total
+        else:
+            self.gprs += total
+        self.count += 1
+
+        if self.first is None or start < self.first:
+            self.first = start
+        if self.last is None or end > self.last:
+            self.last = end
+
+    def total(self):
+        return self.umts + self.gprs
+
+
+class UsageAggregateCache(object):
+    """
+    I keep per-month usage totals so they don't have to be summed up again
+
+    The aggregates are persisted to C{path} alongside a signature of the
+    usage DB, if the DB was modified behind our back (i.e. a crash between
+    both writes) the cache is discarded and every month is rebuilt from
+    the raw usage items the first time it is requested.
+    """
+
+    def __init__(self, provider, path=USAGE_CACHE, db_path=USAGE_DB):
+        self.provider = provider
+        self.path = path
+        self.db_path = db_path
+        self.months = {}
+        self.load()
+
+    def _get_db_signature(self):
+        # size and mtime miss an INSERT that doesn't grow the file, the
+        # change counter is bumped by every committed transaction
+        try:
+            st = os.stat(self.db_path)
+            fobj = open(self.db_path, 'rb')
+            try:
+                fobj.seek(SQLITE_COUNTER_OFFSET)
+                data = fobj.read(4)
+            finally:
+                fobj.close()
+        except (IOError, OSError):
+            return None
+
+        counter = 0
+        if len(data) == 4:
+            counter = struct.unpack('>I', data)[0]
+        return '%d:%r:%d' % (st.st_size, st.st_mtime, counter)
+
+    def load(self):
+        self.months = {}
+        try:
+            fobj = open(self.path)
+        except IOError:
+            return
+
+        try:
+            try:
+                header = fobj.readline().split()
+                if header != [CACHE_VERSION, str(self._get_db_signature())]:
+                    logger.info("Usage cache is stale, rebuilding it")
+                    return
+
+                months = {}
+                for line in fobj:
+                    year, month, umts, gprs, count, first, last = line.split()
+                    months[(int(year), int(month))] = MonthUsage(
+                        int(umts), int(gprs), int(count),
+                        _parse_time(first), _parse_time(last))
+
+                self.months = months
+            except ValueError:
+                logger.warn("Corrupt usage cache %s, rebuilding it"
+                            % self.path)
+        finally:
+            fobj.close()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        try:
+            fobj = open(tmp, 'w')
+            try:
+                fobj.write('%s %s\n' % (CACHE_VERSION,
+                                        self._get_db_signature()))
+                for (year, month), usage in sorted(self.months.items()):
+                    fobj.write('%d %d %d %d %d %s %s\n' % (year, month,
+                        usage.umts, usage.gprs, usage.count,
+                        _format_time(usage.first), _format_time(usage.last)))
+            finally:
+                fobj.close()
+            os.rename(tmp, self.path)
+        except (IOError, OSError), e:
+            logger.error("Can not save usage cache %s: %s" % (self.path, e))
+
+    def get_month(self, date):
+        """Returns the L{MonthUsage} of the month C{date} belongs to"""
+        key = month_key(date)
+        try:
+            return self.months[key]
+        except KeyError:
+            return self.rebuild(date)
+
+    def add_usage_item(self, start, end, bytes_recv, bytes_sent, is_3g):
+        """Stores a usage segment and accounts it in its month"""
+        self.provider.add_usage_item(start, end, bytes_recv, bytes_sent,
+                                     is_3g)
+
+        key = month_key(start)
+        if key in self.months:
+            self.months[key].add(start, end, bytes_recv + bytes_sent, is_3g)
+            self.save()
+        else:
+            # the DB signature has changed and needs to be saved even if
+            # this month isn't cached yet
+            self.rebuild(start)
+
+    def rebuild(self, date=None):
+        """
+        Reconciles the cache with the usage DB
+
+        Only the month of C{date} is summed up again if given, otherwise
+        the whole cache is dropped and months are rebuilt on demand
+        """
+        if date is None:
+            self.months = {}
+            self.save()
+            return None
+
+        first_day = datetime.date(date.year, date.month, 1)
+        usage = MonthUsage()
+        for item in self.provider.get_usage_for_month(first_day):
+            usage.add(item.start_time, item.end_time, item.total(),
+                      item.is_3g())
+
+        self.months[month_key(date)] = usage
+        self.save()
+        return usage
+
+
+def utcnow():
+    """Returns the current UTC time with the precision of the journal"""
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+
+def utc_to_local(t):
+    """Converts the naive UTC datetime C{t} to naive local time"""
+    return datetime.datetime.fromtimestamp(calendar.timegm(t.timetuple()))
+
+
+def local_to_utc(t):
+    """Converts the naive local datetime C{t} to naive UTC time"""
+    return datetime.datetime.utcfromtimestamp(time.mktime(t.timetuple()))
+
+
+def get_next_boundary(t):
+    """
+    Returns the first day boundary after the naive UTC datetime C{t}
+
+    That is whichever comes first of the next UTC midnight and the next
+    local midnight, expressed in UTC. A segment that doesn't cross it is
+    accounted in the same day and month both in local and UTC time.
+    """
+    one_day = datetime.timedelta(days=1)
+    utc_midnight = datetime.datetime(t.year, t.month, t.day) + one_day
+
+    local = utc_to_local(t)
+    local_midnight = datetime.datetime(local.year, local.month,
+                                       local.day) + one_day
+
+    return min(utc_midnight, local_to_utc(local_midnight))
+
+
+class UsageSegment(object):
+    """
+    I am the traffic of a connection since C{start} on the same bearer
+
+    The byte counters are the device's, the segment's traffic is the
+    difference with the counters it was opened with
+    """
+
+    def __init__(self, start, rx_bytes, tx_bytes, is_3g):
+        self.start = start
+        self.is_3g = is_3g
+        self.base_rx = self.rx_bytes = rx_bytes
+        self.base_tx = self.tx_bytes = tx_bytes
+
+    def received(self):
+        return self.rx_bytes - self.base_rx
+
+    def sent(self):
+        return self.tx_bytes - self.base_tx
+
+    def is_empty(self):
+        return not (self.received() or self.sent())
+
+
+class UsageRecorder(object):
+    """
+    I account the traffic of the current connection
+
+    The open segment lives in memory and every C{interval} seconds its
+    totals so far are appended to a small journal. The usage DB is only
+    written when the segment is closed (bearer change or disconnect), after
+    that the journal is truncated. A journal left behind by a crash is
+    replayed the next time we start, so at most C{interval} seconds of
+    traffic can be lost.
+
+    Segments are also closed at day boundaries (see L{get_next_boundary}),
+    so a connection that spans midnight of the last day of the month gets
+    its traffic split among both months.
+    """
+
+    def __init__(self, cache, path=USAGE_JOURNAL,
+                 interval=CFG_PREFS_DEFAULT_USAGE_JOURNAL_INTERVAL):
+        self.cache = cache
+        self.path = path
+        self.interval = interval
+        self.segment = None
+        self._journaled = None  # (rx, tx) of the last journal record
+        self._boundary = None  # UTC time at which the segment is split
+        self._source_id = None
+
+    def is_recording(self):
+        return self.segment is not None
+
+    def start(self, rx_bytes, tx_bytes, is_3g, now=None):
+        """Opens a new segment with the device counters at C{now}"""
+        if self.segment is not None:
+            self.stop(now)
+
+        self.segment = UsageSegment(now or utcnow(), rx_bytes, tx_bytes,
+                                    is_3g)
+        self._journaled = (rx_bytes, tx_bytes)
+        self._boundary = get_next_boundary(self.segment.start)
+        self._source_id = timeout_add_seconds(self.interval, self._flush_cb)
+
+    def update(self, rx_bytes, tx_bytes, now=None):
+        """Updates the device counters of the open segment"""
+        if self.segment is not None:
+            # the traffic since the previous update is accounted after
+            # the boundary, the counters are updated every second
+            self.check_boundary(now)
+            self.segment.rx_bytes = rx_bytes
+            self.segment.tx_bytes = tx_bytes
+
+    def check_boundary(self, now=None):
+        """
+        Splits the open segment at every day boundary passed by C{now}
+
+        Returns True if the segment was split
+        """
+        if self.segment is None:
+            return False
+
+        now = now or utcnow()
+        split = False
+        while now >= self._boundary:
+            self._close(self.segment.is_3g, self._boundary)
+            split = True
+        return split
+
+    def compact(self, is_3g=None, now=None):
+        """
+        Closes the open segment and opens a new one at C{now}
+
+        The closed segment is written to the usage DB and the journal is
+        truncated. The new segment keeps the bearer unless C{is_3g} is given
+        """
+        if self.segment is None:
+            return
+
+        now = now or utcnow()
+        self.check_boundary(now)
+        if is_3g is None:
+            is_3g = self.segment.is_3g
+        self._close(is_3g, now)
+
+    def _close(self, is_3g, now):
+        segment = self.segment
+        if not segment.is_empty():
+            self.cache.add_usage_item(segment.start, now, segment.received(),
+                                      segment.sent(), segment.is_3g)
+        self._truncate()
+
+        self.segment = UsageSegment(now, segment.rx_bytes, segment.tx_bytes,
+                                    is_3g)
+        self._journaled = (segment.rx_bytes, segment.tx_bytes)
+        self._boundary = get_next_boundary(now)
+
+    def stop(self, now=None):
+        """Closes the open segment and stops the periodic flush"""
+        if self._source_id is not None:
+            source_remove(self._source_id)
+            self._source_id = None
+
+        self.compact(now=now)
+        self.segment = None
+        self._journaled = None
+        self._boundary = None
+
+    def flush(self, now=None):
+        """Appends the open segment totals to the journal if they changed"""
+        segment = self.segment
+        if segment is None or segment.is_empty():
+            return
+
+        counters = (segment.rx_bytes, segment.tx_bytes)
+        if counters == self._journaled:
+            return
+
+        record = '%s %s %d %d %d\n' % (_format_time(segment.start),
+                                       _format_time(now or utcnow()),
+                                       segment.received(), segment.sent(),
+                                       int(segment.is_3g))
+        try:
+            fobj = open(self.path, 'a')
+            try:
+                fobj.write(record)
+                fobj.flush()
+                os.fsync(fobj.fileno())
+            finally:
+                fobj.close()
+        except (IOError, OSError), e:
+            logger.error("Can not write usage journal %s: %s"
+                         % (self.path, e))
+            return
+
+        self._journaled = counters
+
+    def _flush_cb(self):
+        # an idle connection doesn't update the counters
+        self.check_boundary()
+        self.flush()
+        return True
+
+    def _truncate(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def replay(self):
+        """Stores the segments found in a journal left by a crash"""
+        try:
+            fobj = open(self.path)
+        except IOError:
+            return
+
+        segments = {}
+        order = []
+        try:
+            for line in fobj:
+                try:
+                    start, end, recv, sent, is_3g = line.split()
+                    start = _parse_time(start)
+                    record = (_parse_time(end), int(recv), int(sent),
+                              bool(int(is_3g)))
+                except ValueError:
+                    # most likely a record cut short by the crash
+                    logger.warn("Ignoring usage journal record %r" % line)
+                    continue
+
+                if start not in segments:
+                    order.append(start)
+                # the last record of a segment has its totals
+                segments[start] = record
+        finally:
+            fobj.close()
+
+        for start in order:
+            end, recv, sent, is_3g = segments[start]
+            if self._is_stored(start):
+                # the crash happened after the segment was written
+                continue
+
+            logger.info("Recovering usage segment %s - %s from journal"
+                        % (start, end))
+            self.cache.add_usage_item(start, end, recv, sent, is_3g)
+
+        self._truncate()
+
+    def _is_stored(self, start):
+        first_day = datetime.date(start.year, start.month, 1)
+        for item in self.cache.provider.get_usage_for_month(first_day):
+            if item.start_time.replace(microsecond=0) == start:
+                return True
+        return False
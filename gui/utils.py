@@ -16,7 +16,10 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import os
 import re
+
+import dbus
 import wnck
 import gtk
 
@@ -39,6 +42,18 @@ def get_error_msg(e):
     return e.message
 
 
+def get_bus():
+    """
+    Returns the D-Bus bus where wader lives
+
+    The system bus unless C{VMB_USE_SESSION_BUS} is set in the environment,
+    which is how the GUI talks to benchmarks/fake_wader.py
+    """
+    if os.environ.get('VMB_USE_SESSION_BUS'):
+        return dbus.SessionBus()
+    return dbus.SystemBus()
+
+
 def dbus_error_is(e, exception):
     return exception.__name__ in get_error_msg(e)
 
@@ -77,6 +92,17 @@ def bytes_repr(_bytes):
     return repr_usage(_bytes)
 
 
+def column_differs(stored, value):
+    """
+    Returns True if C{value} differs from the C{stored} treemodel value
+
+    GTK returns string columns as UTF-8 encoded byte strings
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return stored != value
+
+
 def find_windows(app_regex, win_regex):
     """
     Returns a list with all windows matching application name and
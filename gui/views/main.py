@@ -21,6 +21,7 @@ Views for the main interface
 
 import os
 
+from gobject import GError
 import gtk
 from pango import ELLIPSIZE_END
 
@@ -65,14 +66,16 @@ from gui.constx import (GUI_MODEM_STATE_NODEVICE,
                         TV_DICT)
 
 
-from gui.stats import StatsBar
+from gui.images import THROBBER, get_pixbuf, preload_status_images
+from gui.stats import StatsBar, SparkLine
 from gui.utils import UNIT_KB, UNIT_MB, units_to_bytes
 
 from gui.models.sms import SMSStoreModel
 from gui.models.contacts import ContactsStoreModel
 
 WIDGETS_TO_SHOW = ['change_pin1', 'request_pin1',
-                   'import_contacts1', 'export_contacts1', 'new_menu_item',
+                   'import_contacts1', 'export_contacts1',
+                   'import_messages1', 'export_messages1', 'new_menu_item',
                    'new_sms_menu_item', 'contact1', 'reply_sms_menu_item',
                    'reply_sms_menu', 'forward_sms_menu_item',
                    'imagemenuitem3', 'preferences_menu_item']
@@ -83,6 +86,9 @@ WIN_HEIGHT = 500
 
 SMS_TEXT_TV_WIDTH = 220
 
+# statusbar context used while the treeviews are being populated
+THROBBER_CONTEXT = 2
+
 
 class MainView(View):
     """View for the main window"""
@@ -104,9 +110,12 @@ class MainView(View):
                                          CFG_PREFS_DEFAULT_USAGE_MAX_VALUE))
         self.usage_units = UNIT_KB
         self.usage_bars = {}
+        self.sparkline = None
 
         self.bearer = 'gprs'    # 'gprs' or 'umts'
         self.signal = 0         # -1, 0, 25, 50, 75, 100
+        # last (image, bearer, operator, roaming) shown in the status line
+        self._status_line = None
 
         self.setup_view(height)
         ctrl.register_view(self)
@@ -137,6 +146,7 @@ class MainView(View):
         window.set_size_request(width=WIN_WIDTH, height=height)
         self._setup_support_tabs()
         self._setup_usage_view()
+        preload_status_images()
         self.set_status_line(GUI_MODEM_STATE_NODEVICE, None, None, None, None)
         self.set_view_state(GUI_MODEM_STATE_NODEVICE)
 
@@ -188,6 +198,16 @@ class MainView(View):
         self.get_top_widget().hide()
         self['sms_message_pane'].hide()
 
+    def setup_rate_history(self, history):
+        self.sparkline = SparkLine(history)
+        box = self['stats_bar_current_box']
+        box.pack_start(self.sparkline.DrawingArea(), expand=True, fill=True)
+        self.sparkline.DrawingArea().show()
+
+    def update_rate_history(self):
+        if self.sparkline is not None:
+            self.sparkline.update()
+
     def show_current_session(self, show):
         items = ['usage_label7', 'current_session_2g_label',
                  'usage_label8', 'current_session_3g_label',
@@ -267,44 +287,68 @@ class MainView(View):
         self.get_top_widget().set_title(name)
 
     def set_status_line(self, state, registration, tech, operator, rssi):
+        """
+        Updates the signal image, bearer, operator and roaming indicator
 
-        def set_image(filename):
-            try:
-                self['signal_image'].set_from_file(
-                                        os.path.join(IMAGES_DIR, filename))
-            except AttributeError:
-                pass  # Probably we are being destroyed
-
-        def set_cell_type(name=None):
-            try:
-                if name:
-                    self['cell_type_label'].set_text(name)
-                    self['cell_type_label'].show()
-                else:
-                    self['cell_type_label'].set_text('')
-                    self['cell_type_label'].hide()
-            except AttributeError:
-                pass
-
-        def set_network_name(name=None):
-            try:
-                if name:
-                    self['network_name_label'].set_text(name)
-                    self['network_name_label'].show()
-                else:
-                    self['network_name_label'].set_text('')
-                    self['network_name_label'].hide()
-            except AttributeError:
-                pass
-
-        def set_roaming_indicator(show=False):
-            try:
-                if show:
+        Only the widgets whose computed value differs from the previous
+        call are touched
+        """
+        status_line = self._get_status_line(state, registration, tech,
+                                            operator, rssi)
+        old = self._status_line
+        if status_line == old:
+            return
+
+        image, cell_type, network_name, roaming = status_line
+
+        try:
+            if image is not None and (old is None or image != old[0]):
+                self._set_signal_image(image)
+
+            if old is None or cell_type != old[1]:
+                self._set_optional_label('cell_type_label', cell_type)
+
+            if old is None or network_name != old[2]:
+                self._set_optional_label('network_name_label', network_name)
+
+            if old is None or roaming != old[3]:
+                if roaming:
                     self['roaming_image'].show()
                 else:
                     self['roaming_image'].hide()
-            except AttributeError:
-                pass
+        except AttributeError:
+            return  # Probably we are being destroyed
+
+        if image is None and old is not None:
+            # the image was left untouched
+            status_line = (old[0],) + status_line[1:]
+        self._status_line = status_line
+
+    def _set_signal_image(self, image):
+        if image == 'throbber.gif':
+            self['signal_image'].set_from_animation(THROBBER)
+            return
+
+        try:
+            self['signal_image'].set_from_pixbuf(get_pixbuf(image))
+        except GError:
+            # let GTK show its broken image icon
+            self['signal_image'].set_from_file(
+                                    os.path.join(IMAGES_DIR, image))
+
+    def _set_optional_label(self, name, text):
+        if text:
+            self[name].set_text(text)
+            self[name].show()
+        else:
+            self[name].set_text('')
+            self[name].hide()
+
+    def _get_status_line(self, state, registration, tech, operator, rssi):
+        """
+        Returns the image file, bearer name, operator and roaming state
+        that represent the given modem state
+        """
 
         def get_signal_image_name(_type, rssi):
             if rssi < 10 or rssi > 100:
@@ -324,13 +368,13 @@ class MainView(View):
 
             # Image
             if tech == MM_GSM_ACCESS_TECH_UNKNOWN:
-                set_image('radio-off.png')
+                image = 'radio-off.png'
             elif tech <= MM_GSM_ACCESS_TECH_EDGE:
-                set_image(get_signal_image_name('gprs', rssi))
+                image = get_signal_image_name('gprs', rssi)
             elif tech <= MM_GSM_ACCESS_TECH_HSPA_PLUS:
-                set_image(get_signal_image_name('umts', rssi))
+                image = get_signal_image_name('umts', rssi)
             else:
-                set_image(get_signal_image_name('lte', rssi))
+                image = get_signal_image_name('lte', rssi)
 
             # Bearer
             tech_names = {
@@ -345,38 +389,28 @@ class MainView(View):
                 MM_GSM_ACCESS_TECH_HSPA_PLUS: _('HSPA+'),
                 MM_GSM_ACCESS_TECH_LTE: _('LTE'),
             }
-            set_cell_type(tech_names.get(tech, _('Unknown')))
-
-            # Operator
-            set_network_name(operator)
-
-            # Roaming
-            set_roaming_indicator(registration == 5)
-        else:
-            # Image
-            if state <= GUI_MODEM_STATE_NODEVICE:
-                set_image('nodevice.png')
-            elif state in [GUI_MODEM_STATE_HAVEDEVICE,
-                           GUI_MODEM_STATE_DISABLED,
-                           GUI_MODEM_STATE_UNLOCKED,
-                           GUI_MODEM_STATE_ENABLED]:
-                set_image('device.png')
-            elif state == GUI_MODEM_STATE_LOCKED:
-                set_image('simlocked.png')
-            elif state in [GUI_MODEM_STATE_UNLOCKING,
-                           GUI_MODEM_STATE_ENABLING,
-                           GUI_MODEM_STATE_DISABLING,
-                           GUI_MODEM_STATE_SEARCHING]:
-                set_image('throbber.gif')
-
-            # Bearer
-            set_cell_type(None)
-
-            # Operator
-            set_network_name(None)
-
-            # Roaming
-            set_roaming_indicator(False)
+            cell_type = tech_names.get(tech, _('Unknown'))
+
+            return image, cell_type, operator or None, registration == 5
+
+        # Image
+        image = None
+        if state <= GUI_MODEM_STATE_NODEVICE:
+            image = 'nodevice.png'
+        elif state in [GUI_MODEM_STATE_HAVEDEVICE,
+                       GUI_MODEM_STATE_DISABLED,
+                       GUI_MODEM_STATE_UNLOCKED,
+                       GUI_MODEM_STATE_ENABLED]:
+            image = 'device.png'
+        elif state == GUI_MODEM_STATE_LOCKED:
+            image = 'simlocked.png'
+        elif state in [GUI_MODEM_STATE_UNLOCKING,
+                       GUI_MODEM_STATE_ENABLING,
+                       GUI_MODEM_STATE_DISABLING,
+                       GUI_MODEM_STATE_SEARCHING]:
+            image = 'throbber.gif'
+
+        return image, None, None, False
 
     def set_view_state(self, state):
 
@@ -594,7 +628,28 @@ class MainView(View):
             self['sms_message_pane'].show()
 
     def start_throbber(self):
-        pass
+        try:
+            if self.throbber is None:
+                self.throbber = gtk.image_new_from_animation(THROBBER)
+                self['net_statusbar'].pack_end(self.throbber, False, False)
+            self.throbber.show()
+        except AttributeError:
+            pass  # Probably we are being destroyed
+
+    def set_throbber_progress(self, done, total):
+        try:
+            statusbar = self['net_statusbar']
+            statusbar.pop(THROBBER_CONTEXT)
+            if total:
+                percent = done * 100 / total
+                statusbar.push(THROBBER_CONTEXT, _('Loading %d%%') % percent)
+        except AttributeError:
+            pass
 
     def stop_throbber(self):
-        pass
+        try:
+            if self.throbber is not None:
+                self.throbber.hide()
+            self['net_statusbar'].pop(THROBBER_CONTEXT)
+        except AttributeError:
+            pass
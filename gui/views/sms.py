@@ -20,10 +20,14 @@
 import os.path
 
 import gtk
+from pango import ELLIPSIZE_END
 #from gtkmvc import View
 from gui.contrib.gtkmvc import View
 
-from gui.consts import APP_SLUG_NAME, GLADE_DIR
+from gui.consts import (APP_SLUG_NAME, GLADE_DIR, TV_SMS_TYPE, TV_SMS_TEXT,
+                        TV_SMS_NUMBER, TV_SMS_DATE)
+from gui.models.sms import SMSStoreModel
+from gui.translate import _
 
 HEIGHT = 200
 WIDTH = 425
@@ -78,3 +82,54 @@ class ForwardSmsView(NewSmsView):
 
     def __init__(self, ctrl):
         super(ForwardSmsView, self).__init__(ctrl)
+
+
+class SMSSearchView(View):
+    """View for the message search dialog"""
+
+    GLADE_FILE = os.path.join(GLADE_DIR, "sms.glade")
+
+    def __init__(self, ctrl):
+        super(SMSSearchView, self).__init__(ctrl, self.GLADE_FILE,
+                                            'sms_search_dialog',
+                                            register=False,
+                                            domain=APP_SLUG_NAME)
+        self.setup_view()
+        ctrl.register_view(self)
+
+    def setup_view(self):
+        self.get_top_widget().set_position(gtk.WIN_POS_CENTER_ON_PARENT)
+
+        treeview = self['sms_search_treeview']
+        model = SMSStoreModel(None)
+        treeview.set_model(model)
+
+        cell = gtk.CellRendererPixbuf()
+        column = gtk.TreeViewColumn(_("Type"), cell, pixbuf=TV_SMS_TYPE)
+        treeview.append_column(column)
+
+        cell = gtk.CellRendererText()
+        cell.set_property('ellipsize', ELLIPSIZE_END)
+        column = gtk.TreeViewColumn(_("Text"), cell, text=TV_SMS_TEXT)
+        column.set_resizable(True)
+        column.set_expand(True)
+        treeview.append_column(column)
+
+        cell = gtk.CellRendererText()
+        column = gtk.TreeViewColumn(_("Number"), cell, text=TV_SMS_NUMBER)
+        column.set_resizable(True)
+        treeview.append_column(column)
+
+        def render_date(cellview, cell, model, _iter):
+            datetime = model.get_value(_iter, TV_SMS_DATE)
+            if datetime:
+                cell.set_property('text', datetime.strftime("%c"))
+
+        cell = gtk.CellRendererText()
+        cell.set_property('xalign', 1.0)
+        column = gtk.TreeViewColumn(_("Date"), cell)
+        column.set_cell_data_func(cell, render_date)
+        treeview.append_column(column)
+
+    def set_status(self, text):
+        self['sms_search_status_label'].set_text(text)